@@ -5,16 +5,31 @@ Notes:
 """
 from enum import Enum
 import argparse
+import asyncio
+import contextlib
+import functools
 import glob
+import gzip
+import hashlib
+import itertools
+import json
 import logging
+import multiprocessing
 import os
 import platform
 import re
+import shlex
 import shutil
+import signal
 import subprocess
 import sys
+import tempfile
+import threading
+import time
 import typing
 import xml.etree.ElementTree as ET
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from multiprocessing.synchronize import Event as EventType
 from os import PathLike
 from pathlib import Path
 from subprocess import PIPE
@@ -23,12 +38,14 @@ from typing import (
     Collection,
     Dict,
     Iterable,
+    Iterator,
     List,
     Literal,
     Mapping,
     Optional,
     Sequence,
     Set,
+    TextIO,
     Tuple,
     Union,
     cast,
@@ -44,6 +61,14 @@ MSPlatform = Literal["Win32", "x64"]
 AddressModel = Literal[32, 64]
 MSVCInternalVersion = Literal["14.1", "14.2"]
 SupportedSystem = Literal["win", "linux"]
+CompilerCache = Literal["ccache", "sccache"]
+BuildTool = Literal["make", "ninja"]
+PgoPhase = Literal["generate", "use"]
+LtoMode = Literal["none", "full", "thin"]
+Linker = Literal["bfd", "gold", "lld", "mold"]
+CpuVariant = Literal["x86-64-v2", "x86-64-v3"]
+RecordKind = Literal["units", "failures", "links"]
+StageKind = Literal["patch", "cmake", "rdkit", "copy_dlls", "wrapper", "nuget"]
 
 here = Path(__file__).parent.resolve()
 
@@ -61,6 +86,23 @@ _LangType_to_str: Mapping[LangType, str]  ={
 }
 
 
+# SWIG interfaces in files/rdkit included by GraphMolCSharp.i in this order.
+_fingerprint_interfaces: Sequence[str] = ("FingerprintBlocks.i", "FingerprintIndex.i")
+# suffixes of files in the RDKit tree which RDKit is built from.
+_rdkit_source_suffixes: Sequence[str] = (
+    ".h", ".hpp", ".c", ".cc", ".cpp", ".cxx", ".i", ".txt", ".cmake", ".in"
+)
+# environment variables read by cmake when it configures RDKit.
+_configure_env_vars: Sequence[str] = (
+    "CC",
+    "CXX",
+    "CFLAGS",
+    "CXXFLAGS",
+    "LDFLAGS",
+    "CMAKE_PREFIX_PATH",
+    "BOOST_ROOT",
+    "EIGEN3_ROOT",
+)
 _platform_system_to_system: Mapping[str, SupportedSystem] = {
     "Windows": "win",
     "Linux": "linux",
@@ -97,6 +139,27 @@ def get_os() -> SupportedSystem:
     return _platform_system_to_system[pf]
 
 
+@functools.lru_cache(maxsize=None)
+def get_toolchain_id() -> str:
+    """Returns versions of CMake and the C++ compiler to identify build outputs."""
+    texts: List[str] = []
+    cmds: List[str] = ["cmake --version"]
+    if get_os() == "linux":
+        cmds.append("c++ --version")
+    for cmdline in cmds:
+        proc = subprocess.run(cmdline, shell=True, stdout=PIPE, stderr=PIPE, text=True)
+        texts += proc.stdout.splitlines()[:1]
+    if get_os() == "win":
+        texts.append(get_vs_ver())
+        texts.append(get_value_from_env("VCToolsVersion", "") or "")
+    return "\n".join(texts)
+
+
+def is_clang_toolchain() -> bool:
+    """Returns whether the C++ compiler on Linux is Clang."""
+    return get_os() == "linux" and "clang" in get_toolchain_id()
+
+
 def get_value(dic: Mapping[str, str], key: Optional[str]) -> str:
     if key is None:
         raise ValueError
@@ -146,42 +209,372 @@ def _replace_file_content(
             file.write(filedata)
 
 
+def replace_string(text: str, pattern_replace: Sequence[Tuple[str, str]]) -> str:
+    for pattern, replace in pattern_replace:
+        text = re.sub(pattern, replace, text, flags=re.MULTILINE | re.DOTALL)
+    return text
+
+
+def insert_line_after_string(text: str, insert_after: Mapping[str, str]) -> str:
+    new_lines: List[str] = []
+    lines = text.split("\n")
+    for line in lines:
+        new_lines.append(line)
+        if line in insert_after:
+            new_lines.append(insert_after[line])
+    return "\n".join(new_lines) + "\n"
+
+
 def replace_file_string(
     filename: PathLike, pattern_replace: Sequence[Tuple[str, str]], make_backup: bool
 ) -> None:
-    def __replace_text(text: str) -> str:
-        for pattern, replace in pattern_replace:
-            text = re.sub(pattern, replace, text, flags=re.MULTILINE | re.DOTALL)
-        return text
-
-    _replace_file_content(filename, __replace_text, make_backup)
+    _replace_file_content(filename, lambda t: replace_string(t, pattern_replace), make_backup)
 
 
 def insert_line_after(
     filename: PathLike, insert_after: Mapping[str, str], make_backup: bool
 ) -> None:
-    def __replace_text(text: str) -> str:
-        new_lines: List[str] = []
-        lines = text.split("\n")
-        for line in lines:
-            new_lines.append(line)
-            if line in insert_after:
-                new_lines.append(insert_after[line])
-        return "\n".join(new_lines) + "\n"
+    _replace_file_content(
+        filename, lambda t: insert_line_after_string(t, insert_after), make_backup
+    )
 
-    _replace_file_content(filename, __replace_text, make_backup)
 
+class PatchLedger:
+    """Records patch manifest and resulting content hash of each patched file."""
+
+    def __init__(self, path: Path):
+        self.path: Path = path
+        self.entries: Dict[str, Dict[str, str]] = {}
+        if path.exists():
+            with open(path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+
+    def save(self) -> None:
+        # readers never see a truncated ledger.
+        tmp_path = self.path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+
+MAX_BLOCK_LINES = 1000
+REWRITE_CHUNK_LINES = 4096
+
+
+def rewrite_lines(
+    lines: Iterable[str], rules: Sequence[Sequence[str]], chunk_lines: int = REWRITE_CHUNK_LINES
+) -> Iterator[str]:
+    r"""Applies rewrite rules to lines in a single pass.
+
+    A rule ("line", pattern, replace) substitutes within each line. A rule
+    ("block", start, end, pattern, replace) collects lines from a line matching `start` to
+    the next line matching `end` and substitutes within them, so no regex scans more than
+    a block. Lines are processed in chunks of `chunk_lines`, which bounds memory.
+
+    Args:
+        lines (Iterable[str]): Lines with line endings.
+        rules (Sequence[Sequence[str]]): Rewrite rules.
+        chunk_lines (int): Number of lines of a chunk.
+
+    Yields:
+        str: Rewritten text in order.
+
+    Blocks right after another block, also at a chunk boundary, are rewritten once:
+
+    >>> rules = [["block", "f\\(", "\\}", "x", "y"]]
+    >>> lines = ["f(x) {\n", "}\n", "f(x) {\n", "}\n", "x\n"]
+    >>> "".join(rewrite_lines(lines, rules))
+    'f(y) {\n}\nf(y) {\n}\nx\n'
+    >>> "".join(rewrite_lines(lines, rules, chunk_lines=2))
+    'f(y) {\n}\nf(y) {\n}\nx\n'
+    """
+    line_rules = [
+        (re.compile(rule[1], re.MULTILINE), rule[2]) for rule in rules if rule[0] == "line"
+    ]
+    block_rules = [
+        (re.compile(rule[1]), re.compile(rule[2]), re.compile(rule[3], re.DOTALL), rule[4])
+        for rule in rules
+        if rule[0] == "block"
+    ]
+    any_start = re.compile(
+        "|".join(f"(?P<b{i}>{rule[0].pattern})" for i, rule in enumerate(block_rules)),
+        re.MULTILINE,
+    )
 
-def call_subprocess(cmd: Sequence[str], show_info: bool = True) -> None:
-    try:
-        _env: Dict[str, str] = {}
-        _env.update(os.environ)
-        _CL_env_for_MSVC: Mapping[str, str] = {
-            "CL": "/source-charset:utf-8 /execution-charset:utf-8"
-        }
-        _env.update(_CL_env_for_MSVC)
-        logging.info(f"pwd={os.path.abspath(os.curdir)}")
+    def _rewrite(text: str) -> str:
+        for pattern, replace in line_rules:
+            text = pattern.sub(replace, text)
+        return text
+
+    # lines of a block not terminated in the current chunk
+    carry = ""
+    block_rule: Optional[Tuple[re.Pattern, re.Pattern, re.Pattern, str]] = None
+    it = iter(lines)
+    while chunk := list(itertools.islice(it, chunk_lines)):
+        text = carry + "".join(chunk)
+        carry = ""
+        pos = 0
+        while pos < len(text):
+            if block_rule is None:
+                m = any_start.search(text, pos) if block_rules else None
+                if m is None:
+                    yield _rewrite(text[pos:])
+                    break
+                # the block may start at the line at `pos`, e.g. right after another block.
+                nl = text.rfind("\n", pos, m.start())
+                block_pos = pos if nl < 0 else nl + 1
+                yield _rewrite(text[pos:block_pos])
+                block_rule = block_rules[int(cast(str, m.lastgroup)[1:])]
+                pos = block_pos
+            m = block_rule[1].search(text, pos)
+            if m is not None:
+                block_end = text.find("\n", max(m.start(), m.end() - 1)) + 1 or len(text)
+            elif text.count("\n", pos) < MAX_BLOCK_LINES:
+                carry = text[pos:]
+                break
+            else:
+                block_end = len(text)
+            yield _rewrite(block_rule[2].sub(block_rule[3], text[pos:block_end]))
+            block_rule = None
+            pos = block_end
+    yield _rewrite(carry)
+
+
+def stream_rewrite_file(filename: Path, rules: Sequence[Sequence[str]]) -> Tuple[bool, str]:
+    """Rewrites a file by `rewrite_lines` without loading it into memory.
+
+    Returns:
+        Tuple[bool, str]: Whether the file is changed and SHA-256 of the resulting file.
+    """
+    src_hash = hashlib.sha256()
+    dst_hash = hashlib.sha256()
+    tmp_filename = Path(f"{filename}.tmp")
+
+    def _read(src: TextIO) -> Iterator[str]:
+        while lines := src.readlines(1 << 20):
+            src_hash.update("".join(lines).encode("utf-8"))
+            yield from lines
+
+    with open(filename, "r", encoding="utf-8", newline="") as src, open(
+        tmp_filename, "w", encoding="utf-8", newline=""
+    ) as dst:
+        for line in rewrite_lines(_read(src), rules):
+            dst_hash.update(line.encode("utf-8"))
+            dst.write(line)
+    changed = src_hash.digest() != dst_hash.digest()
+    if changed:
+        os.replace(tmp_filename, filename)
+    else:
+        tmp_filename.unlink()
+    return changed, dst_hash.hexdigest()
+
+
+class PatchPlan:
+    """Declarative patches to files.
+
+    Patches are recorded as data, so applying a plan can compare them with the ledger
+    and leave files whose resulting contents do not change untouched.
+    """
+
+    def __init__(self):
+        self.patches: Dict[Path, List[Tuple[str, object]]] = {}
+
+    def insert_line_after(self, filename: Path, insert_after: Mapping[str, str]) -> None:
+        self.patches.setdefault(filename, []).append(
+            ("insert_line_after", sorted(insert_after.items()))
+        )
+
+    def replace_file_string(
+        self, filename: Path, pattern_replace: Sequence[Tuple[str, str]]
+    ) -> None:
+        self.patches.setdefault(filename, []).append(
+            ("replace_file_string", [list(a) for a in pattern_replace])
+        )
+
+    def append_text(self, filename: Path, text: str) -> None:
+        self.patches.setdefault(filename, []).append(("append_text", text))
+
+    def replace_line_string(
+        self, filename: Path, pattern_replace: Sequence[Tuple[str, str]]
+    ) -> None:
+        """Patches by regexes matching within a line, which can be streamed."""
+        self.patches.setdefault(filename, []).append(
+            ("rewrite_lines", [["line", *a] for a in pattern_replace])
+        )
+
+    def replace_block_string(
+        self, filename: Path, start: str, end: str, pattern_replace: Sequence[Tuple[str, str]]
+    ) -> None:
+        """Patches by regexes matching within lines from `start` to `end`, which is streamable."""
+        self.patches.setdefault(filename, []).append(
+            ("rewrite_lines", [["block", start, end, *a] for a in pattern_replace])
+        )
+
+    def get_manifest(self, filename: Path) -> str:
+        text = json.dumps(self.patches.get(filename, []), sort_keys=True)
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def is_streamable(self, filename: Path) -> bool:
+        return all(kind == "rewrite_lines" for kind, _ in self.patches.get(filename, []))
+
+    def get_rules(self, filename: Path) -> List[List[str]]:
+        rules: List[List[str]] = []
+        for kind, args in self.patches.get(filename, []):
+            if kind == "rewrite_lines":
+                rules += cast(List[List[str]], args)
+        return rules
+
+    def relocate(self, src: Path, dest: Path) -> "PatchPlan":
+        """Returns the plan with files under `src` moved to `dest`."""
+        plan = PatchPlan()
+        for filename, patches in self.patches.items():
+            plan.patches[dest / filename.relative_to(src)] = list(patches)
+        return plan
+
+    def patch_text(self, filename: Path, text: str) -> str:
+        for kind, args in self.patches.get(filename, []):
+            if kind == "insert_line_after":
+                text = insert_line_after_string(text, dict(cast(List[Tuple[str, str]], args)))
+            elif kind == "replace_file_string":
+                text = replace_string(text, cast(List[Tuple[str, str]], args))
+            elif kind == "append_text":
+                text += cast(str, args)
+            elif kind == "rewrite_lines":
+                rules = cast(List[List[str]], args)
+                text = "".join(rewrite_lines(text.splitlines(keepends=True), rules))
+            else:
+                raise RuntimeError(f"Unknown patch {kind}.")
+        return text
+
+    def _patch_file(self, filename: Path, from_bak: bool) -> bool:
+        curr_text = get_as_text(filename)
+        if from_bak:
+            if filename in self.patches:
+                make_bak(filename)
+            original_text = get_original_text(filename)
+        else:
+            original_text = curr_text
+        text = self.patch_text(filename, original_text)
+        if text == curr_text:
+            return False
+        with open(filename, "w", encoding="utf-8") as file:
+            file.write(text)
+        return True
+
+    def apply(
+        self, filenames: Iterable[Path], ledger: PatchLedger, from_bak: bool, jobs: int = 1
+    ) -> List[Path]:
+        """Applies the plan and returns files whose contents are changed.
+
+        Args:
+            filenames (Iterable[Path]): Files to patch in addition to files in the plan.
+                Files without patches are restored from their .bak.
+            ledger (PatchLedger): Ledger to compare and record results.
+            from_bak (bool): Patch original text in .bak, or patch the current text once
+                per content, like files generated by SWIG.
+            jobs (int): Number of processes to stream files in parallel.
+
+        Returns:
+            List[Path]: Changed files.
+        """
+        pending: List[Path] = []
+        for filename in dict.fromkeys([*self.patches, *filenames]):
+            if not filename.exists():
+                continue
+            entry = ledger.entries.get(str(filename))
+            if (
+                entry
+                and entry["manifest"] == self.get_manifest(filename)
+                and entry["sha256"] == file_digest(filename)
+            ):
+                continue
+            pending.append(filename)
+
+        # Files only rewritten line by line are streamed, which needs no .bak.
+        streamed = [f for f in pending if not from_bak and self.is_streamable(f)]
+        results: Dict[Path, Tuple[bool, str]] = {}
+        if jobs > 1 and len(streamed) > 1:
+            with ProcessPoolExecutor(max_workers=min(jobs, len(streamed))) as executor:
+                futures = {
+                    f: executor.submit(stream_rewrite_file, f, self.get_rules(f)) for f in streamed
+                }
+                results = {f: future.result() for f, future in futures.items()}
+        else:
+            results = {f: stream_rewrite_file(f, self.get_rules(f)) for f in streamed}
+
+        changed: List[Path] = []
+        for filename in pending:
+            if filename in results:
+                is_changed, digest = results[filename]
+            else:
+                is_changed = self._patch_file(filename, from_bak)
+                digest = file_digest(filename)
+            if is_changed:
+                logging.info(f"Patched {filename}.")
+                changed.append(filename)
+            ledger.entries[str(filename)] = {
+                "manifest": self.get_manifest(filename),
+                "sha256": digest,
+            }
+        ledger.save()
+        return changed
+
+
+def _run_swig_patch_benchmark(plan: PatchPlan, streaming: bool, jobs: int) -> Tuple[float, float]:
+    """Patches files of `plan` and returns wall time and peak RSS in MiB."""
+    import resource
+
+    start = time.perf_counter()
+    if streaming:
+        ledger = PatchLedger(Path(os.path.commonpath(list(plan.patches))) / "ledger.json")
+        plan.apply([], ledger, from_bak=False, jobs=jobs)
+    else:
+        # The former way, which reads whole text and applies regexes to it.
+        for filename in plan.patches:
+            pattern_replace = [(rule[-2], rule[-1]) for rule in plan.get_rules(filename)]
+            replace_file_string(filename, pattern_replace, make_backup=False)
+    elapsed = time.perf_counter() - start
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    return elapsed, peak / 1024
+
+
+def get_exit_code(status: int) -> int:
+    if os.WIFSIGNALED(status):
+        return 128 + os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+# stage running in this process and resource usages of its subprocesses.
+_current_stage: Optional[str] = None
+_subprocess_records: List[Dict[str, object]] = []
+# gzip log of the current stage, default timeout of commands in seconds, and event set
+# by StageScheduler to cancel commands of all stages.
+_stage_log_path: Optional[Path] = None
+_command_timeout: Optional[float] = None
+_cancel_event: Optional[EventType] = None
+# serializes lines of commands running at the same time.
+_output_lock = threading.Lock()
+
+
+class SubprocessJob:
+    def __init__(
+        self,
+        cmd: Sequence[str],
+        env: Optional[Mapping[str, str]] = None,
+        name: Optional[str] = None,
+        timeout: Optional[float] = None,
+    ):
+        self.cmd: List[str] = [a for a in cmd if a]
+        self.env: Optional[Mapping[str, str]] = env
+        # prefix of output lines, the current stage if None.
+        self.name: Optional[str] = name
+        self.timeout: Optional[float] = timeout
 
+    @property
+    def cmdline(self) -> str:
         def __t(text: str) -> str:
             if '"' in text:
                 return text
@@ -189,15 +582,192 @@ def call_subprocess(cmd: Sequence[str], show_info: bool = True) -> None:
                 return '"' + text + '"'
             return text
 
-        cmdline = " ".join([__t(s) for s in cmd if s])
-        logging.info(cmdline)
+        return " ".join([__t(s) for s in self.cmd])
+
+
+class SubprocessCancelled(Exception):
+    """Raised when commands are cancelled because another stage failed."""
+
+
+def _wait_process(proc: subprocess.Popen) -> Optional[object]:
+    """Waits for `proc` and returns its resource usage on Linux."""
+    if get_os() == "win":
+        proc.wait()
+        return None
+    _, status, rusage = os.wait4(proc.pid, 0)
+    proc.returncode = get_exit_code(status)
+    return rusage
+
+
+def _kill_process_tree(proc: subprocess.Popen, force: bool = False) -> None:
+    if proc.returncode is not None:
+        return
+    with contextlib.suppress(OSError):
         if get_os() == "win":
-            subprocess.check_call(cmdline, env=_env)
+            subprocess.run(
+                ["taskkill", "/T", "/F", "/PID", str(proc.pid)], stdout=PIPE, stderr=PIPE
+            )
         else:
-            subprocess.check_call(cmd, env=_env)
-    except subprocess.CalledProcessError as e:
-        logging.warning(e)
-        sys.exit(e.returncode)
+            # make and ninja do not pass signals to their children.
+            os.killpg(proc.pid, signal.SIGKILL if force else signal.SIGTERM)
+
+
+def _run_in_thread(func: Callable[[], object]) -> "asyncio.Future[object]":
+    """Runs blocking `func` in a daemon thread, which does not keep the script alive."""
+    loop = asyncio.get_running_loop()
+    future: "asyncio.Future[object]" = loop.create_future()
+
+    def __set(result: object, error: Optional[BaseException]) -> None:
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def __run() -> None:
+        result: object = None
+        error: Optional[BaseException] = None
+        try:
+            result = func()
+        except BaseException as e:
+            error = e
+        # the loop is closed when the result is abandoned.
+        with contextlib.suppress(RuntimeError):
+            loop.call_soon_threadsafe(__set, result, error)
+
+    threading.Thread(target=__run, daemon=True).start()
+    return future
+
+
+async def _run_job(job: SubprocessJob, log: Optional[TextIO]) -> Dict[str, object]:
+    env: Dict[str, str] = {}
+    env.update(os.environ)
+    env["CL"] = "/source-charset:utf-8 /execution-charset:utf-8"
+    if job.env:
+        env.update(job.env)
+    prefix = f"[{job.name or _current_stage or os.path.basename(job.cmd[0])}] "
+    cmdline = job.cmdline
+    logging.info(f"pwd={os.path.abspath(os.curdir)}")
+    logging.info(cmdline)
+    if log:
+        with _output_lock:
+            log.write(f"{prefix}$ {cmdline}\n")
+    record: Dict[str, object] = {
+        "stage": _current_stage,
+        "cmd": cmdline,
+        "cwd": os.path.abspath(os.curdir),
+    }
+    start_time = time.monotonic()
+    proc = subprocess.Popen(
+        cmdline if get_os() == "win" else job.cmd,
+        env=env,
+        stdout=PIPE,
+        stderr=subprocess.STDOUT,
+        start_new_session=get_os() != "win",
+    )
+
+    def stream() -> None:
+        assert proc.stdout
+        for line in proc.stdout:
+            text = prefix + line.decode("utf-8", errors="replace").rstrip("\r\n") + "\n"
+            with _output_lock:
+                sys.stdout.write(text)
+                sys.stdout.flush()
+                if log and not log.closed:
+                    log.write(text)
+
+    streamer = _run_in_thread(stream)
+    waiter = _run_in_thread(lambda: _wait_process(proc))
+    timeout = job.timeout if job.timeout is not None else _command_timeout
+    try:
+        rusage = await asyncio.wait_for(asyncio.shield(waiter), timeout)
+    except BaseException as e:
+        _kill_process_tree(proc)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), 10)
+        except asyncio.TimeoutError:
+            _kill_process_tree(proc, force=True)
+            await waiter
+        if isinstance(e, asyncio.TimeoutError):
+            raise subprocess.TimeoutExpired(cmdline, cast(float, timeout)) from None
+        raise
+    finally:
+        record["wall_time"] = time.monotonic() - start_time
+        record["returncode"] = proc.returncode
+        _subprocess_records.append(record)
+        # build servers started by the command may keep the pipe open.
+        with contextlib.suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(streamer, 5)
+    if rusage is not None:
+        record["user_time"] = rusage.ru_utime  # type: ignore
+        record["system_time"] = rusage.ru_stime  # type: ignore
+        # ru_maxrss is the largest process among waited descendants, in KiB on Linux.
+        record["max_rss_mb"] = rusage.ru_maxrss // 1024  # type: ignore
+    return record
+
+
+async def _run_jobs(
+    jobs: Sequence[SubprocessJob], check: bool, log: Optional[TextIO]
+) -> List[int]:
+    tasks = [asyncio.ensure_future(_run_job(job, log)) for job in jobs]
+    try:
+        pending: Set[asyncio.Future] = set(tasks)
+        while pending:
+            # wakes up regularly to see whether another stage failed.
+            done, pending = await asyncio.wait(
+                pending, timeout=0.5, return_when=asyncio.FIRST_COMPLETED
+            )
+            if _cancel_event is not None and _cancel_event.is_set():
+                raise SubprocessCancelled("Commands are cancelled as another stage failed.")
+            for task in done:
+                record = task.result()
+                if check and record["returncode"] != 0:
+                    raise subprocess.CalledProcessError(
+                        cast(int, record["returncode"]), cast(str, record["cmd"])
+                    )
+    except BaseException:
+        # kills the other commands.
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    return [cast(int, task.result()["returncode"]) for task in tasks]
+
+
+def run_subprocesses(jobs: Sequence[SubprocessJob], check: bool = True) -> List[int]:
+    """Runs `jobs` at the same time and returns their exit codes.
+
+    Output lines are printed as they come, prefixed with the name of the job or the stage,
+    and appended to the gzip log of the stage. A failure if `check`, a timeout or a failure
+    of another stage kills the other jobs and raises CalledProcessError, TimeoutExpired or
+    SubprocessCancelled.
+    """
+    if not jobs:
+        return []
+    with contextlib.ExitStack() as stack:
+        log: Optional[TextIO] = None
+        if _stage_log_path is not None:
+            log = cast(TextIO, gzip.open(_stage_log_path, "at", encoding="utf-8"))
+            # streamers abandoned after their commands exit may still write to the log.
+            stack.callback(_close_locked, log)
+        return asyncio.run(_run_jobs(jobs, check, log))
+
+
+def _close_locked(f: TextIO) -> None:
+    with _output_lock:
+        f.close()
+
+
+def call_subprocess(
+    cmd: Sequence[str],
+    show_info: bool = True,
+    env: Optional[Mapping[str, str]] = None,
+    check: bool = True,
+    timeout: Optional[float] = None,
+) -> int:
+    """Runs `cmd` and raises CalledProcessError on failure if `check`, or returns its exit code."""
+    return run_subprocesses([SubprocessJob(cmd, env, timeout=timeout)], check)[0]
 
 
 def remove_if_exist(path: Path) -> None:
@@ -239,6 +809,53 @@ def match_and_add(pattern: re.Pattern, dest: List[str], line: str) -> None:
                 dest.append(name)
 
 
+def read_cmake_cache_entries(path: PathLike) -> Mapping[str, Tuple[str, str]]:
+    """Returns types and values in CMakeCache.txt by names."""
+    entries: Dict[str, Tuple[str, str]] = {}
+    pat = re.compile(r"^(?P<name>[^#/][^:=]*):(?P<type>[A-Z]+)=(?P<value>.*)$")
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            match = pat.match(line.rstrip("\n"))
+            if match:
+                entries[match["name"]] = (match["type"], match["value"])
+    return entries
+
+
+def read_cmake_cache(path: PathLike) -> Mapping[str, str]:
+    """Returns values in CMakeCache.txt by names. Types are dropped."""
+    return {name: value for name, (_, value) in read_cmake_cache_entries(path).items()}
+
+
+def to_cmake_string(value: str) -> str:
+    """Returns `value` quoted as a CMake string argument."""
+    return '"' + re.sub(r'([\\"$])', r"\\\1", value) + '"'
+
+
+def read_ninja_log(path: Path) -> Mapping[str, Tuple[int, int]]:
+    """Returns start and end in msec of the latest build of each output in .ninja_log."""
+    spans: Dict[str, Tuple[int, int]] = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.startswith("#"):
+                continue
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) < 4:
+                continue
+            # later lines are newer results for the same output.
+            spans[fields[3]] = (int(fields[0]), int(fields[1]))
+    return spans
+
+
+def print_ninja_log(path: Path, top: int = 20) -> None:
+    """Prints the slowest outputs recorded in .ninja_log."""
+    if not path.exists():
+        return
+    durations = {output: end - start for output, (start, end) in read_ninja_log(path).items()}
+    print(f"Slowest {top} outputs in {path}:")
+    for output, msec in sorted(durations.items(), key=lambda a: -a[1])[:top]:
+        print(f"{msec / 1000:10.1f} s  {output}")
+
+
 def get_value_from_env(env: str, default: Optional[str] = None) -> Optional[str]:
     if env not in os.environ:
         return default
@@ -287,6 +904,824 @@ def get_elem(parent: Element, name: str, ns: Optional[str] = None) -> Element:
     return elms[0]
 
 
+def file_digest(path: PathLike) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def iter_tree_files(
+    root: Path,
+    suffixes: Optional[Collection[str]] = None,
+    exclude: Collection[str] = (),
+    names: Collection[str] = (),
+) -> Iterator[Path]:
+    """Yields files under `root` in sorted order.
+
+    Args:
+        root (Path): Directory to walk.
+        suffixes (Optional[Collection[str]]): Suffixes of files to yield. All files if None.
+        exclude (Collection[str]): Names of files and directories to skip.
+            Directories starting with "build" and ".bak" files are always skipped.
+        names (Collection[str]): Names of files to yield whatever their suffixes are.
+    """
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(
+            d for d in dirnames if d not in exclude and not d.startswith("build")
+        )
+        for name in sorted(filenames):
+            if name in exclude or name.endswith(".bak"):
+                continue
+            if (
+                suffixes is not None
+                and name not in names
+                and os.path.splitext(name)[1] not in suffixes
+            ):
+                continue
+            yield Path(dirpath) / name
+
+
+def tree_digest(
+    root: Path,
+    suffixes: Optional[Collection[str]] = None,
+    exclude: Collection[str] = (),
+    names: Collection[str] = (),
+) -> str:
+    """Returns digest of relative paths and contents of files under `root`.
+
+    Arguments select files as those of iter_tree_files.
+    """
+    h = hashlib.sha256()
+    for path in iter_tree_files(root, suffixes, exclude, names):
+        h.update(path.relative_to(root).as_posix().encode("utf-8"))
+        h.update(file_digest(path).encode("ascii"))
+    return h.hexdigest()
+
+
+class ArtifactStore:
+    """Local content-addressed store of build outputs.
+
+    A file is stored once under `objects` by the digest of its content. An entry under
+    `entries` maps a key made from the inputs of a stage to the files it produced.
+    """
+
+    def __init__(self, root: Path):
+        self.root: Path = root
+
+    @staticmethod
+    def make_key(*inputs: object) -> str:
+        text = json.dumps(inputs, default=str, sort_keys=True)
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _object_path(self, digest: str) -> Path:
+        return self.root / "objects" / digest[:2] / digest
+
+    def _entry_path(self, key: str) -> Path:
+        return self.root / "entries" / f"{key}.json"
+
+    def save(self, key: str, base: Path, outputs: Iterable[Path]) -> None:
+        """Stores `outputs`, files or directories under `base`, as the entry of `key`."""
+        roots: List[str] = []
+        files: Dict[str, Tuple[str, int]] = {}
+        for output in outputs:
+            roots.append(output.relative_to(base).as_posix())
+            paths = [output] if output.is_file() else [p for p in output.rglob("*") if p.is_file()]
+            for path in paths:
+                digest = file_digest(path)
+                object_path = self._object_path(digest)
+                if not object_path.exists():
+                    object_path.parent.mkdir(parents=True, exist_ok=True)
+                    tmp_path = object_path.with_suffix(f".{os.getpid()}.tmp")
+                    shutil.copyfile(path, tmp_path)
+                    os.replace(tmp_path, object_path)
+                files[path.relative_to(base).as_posix()] = (digest, path.stat().st_mode)
+        entry_path = self._entry_path(key)
+        entry_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = entry_path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"roots": roots, "files": files}, f, indent=1)
+        os.replace(tmp_path, entry_path)
+        logging.info(f"Stored {len(files)} files to {self.root} as {key[:12]}.")
+
+    def restore(self, key: str, base: Path) -> bool:
+        """Restores files of `key` under `base`. Returns False if there is no entry.
+
+        Files whose contents are unchanged are kept to preserve their timestamps.
+        Files not in the entry are removed from restored directories.
+        """
+        entry_path = self._entry_path(key)
+        if not entry_path.exists():
+            return False
+        with open(entry_path, "r", encoding="utf-8") as f:
+            entry = json.load(f)
+        files: Mapping[str, Tuple[str, int]] = entry["files"]
+        for digest, _ in files.values():
+            if not self._object_path(digest).exists():
+                logging.warning(f"Entry {key[:12]} in {self.root} is broken.")
+                return False
+        for root in entry["roots"]:
+            path = base / root
+            if path.is_dir():
+                for p in [p for p in path.rglob("*") if p.is_file()]:
+                    if p.relative_to(base).as_posix() not in files:
+                        p.unlink()
+        for name, (digest, mode) in files.items():
+            path = base / name
+            if path.is_file() and file_digest(path) == digest:
+                continue
+            path.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(self._object_path(digest), path)
+            os.chmod(path, mode)
+        logging.info(f"Restored {len(files)} files from {self.root} as {key[:12]}.")
+        return True
+
+
+def get_available_memory_mb() -> int:
+    """Returns available physical memory in MiB."""
+    if os.path.exists("/proc/meminfo"):
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) // 1024
+    return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") // (1 << 20)
+
+
+class MemoryAdmission:
+    """Admits compile jobs while the sum of their memory estimates fits in the budget.
+
+    State is shared by compiler launchers through files in `state_path` guarded by a
+    file lock. Estimates are peak RSS measured in previous runs for each output.
+    """
+
+    default_estimate_mb: int = 1024
+    # SWIG wrappers are far larger than other translation units.
+    default_wrapper_estimate_mb: int = 4096
+    # peak RSS below it is not of a compiler run.
+    min_compile_mb: int = 64
+    estimate_decay: float = 0.9
+
+    def __init__(self, state_path: Path):
+        self.state_path: Path = state_path
+
+    @property
+    def budget_file(self) -> Path:
+        return self.state_path / "budget.json"
+
+    @property
+    def estimates_file(self) -> Path:
+        return self.state_path / "estimates.json"
+
+    @property
+    def reservations_file(self) -> Path:
+        return self.state_path / "reservations.json"
+
+    def _load(self, path: Path) -> Dict:
+        if not path.exists():
+            return {}
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _save(self, path: Path, data: Mapping) -> None:
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, path)
+
+    @contextlib.contextmanager
+    def _locked(self) -> Iterator[None]:
+        import fcntl
+
+        with open(self.state_path / "lock", "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def prepare(self, budget_mb: int) -> None:
+        self.state_path.mkdir(parents=True, exist_ok=True)
+        with self._locked():
+            self._save(self.budget_file, {"budget_mb": budget_mb})
+            self._save(self.reservations_file, {})
+
+    def estimate(self, unit: str) -> int:
+        estimates = self._load(self.estimates_file)
+        if unit in estimates:
+            return int(estimates[unit])
+        if "_wrap." in unit:
+            return self.default_wrapper_estimate_mb
+        return self.default_estimate_mb
+
+    def acquire(self, unit: str) -> None:
+        """Waits until the estimate of `unit` fits in the budget and reserves it."""
+        estimate = self.estimate(unit)
+        while True:
+            with self._locked():
+                budget = self._load(self.budget_file).get("budget_mb", 0)
+                reservations: Dict[str, int] = {}
+                for pid, mb in self._load(self.reservations_file).items():
+                    try:
+                        os.kill(int(pid), 0)
+                    except OSError:
+                        continue
+                    reservations[pid] = mb
+                if not reservations or sum(reservations.values()) + estimate <= budget:
+                    reservations[str(os.getpid())] = estimate
+                    self._save(self.reservations_file, reservations)
+                    return
+            time.sleep(0.5)
+
+    def release(self, unit: str, peak_mb: Optional[int]) -> None:
+        """Releases the reservation of `unit` and updates its estimate by `peak_mb`.
+
+        The estimate is kept if `peak_mb` is None, or below `min_compile_mb` as for hits of
+        ccache and sccache, which do not run the compiler. Otherwise it decays toward lower
+        peaks by `estimate_decay` a run, so a single light run does not over-admit.
+        """
+        with self._locked():
+            reservations = self._load(self.reservations_file)
+            reservations.pop(str(os.getpid()), None)
+            self._save(self.reservations_file, reservations)
+            if peak_mb is None or peak_mb < self.min_compile_mb:
+                return
+            estimates = self._load(self.estimates_file)
+            if unit in estimates:
+                peak_mb = max(peak_mb, int(estimates[unit] * self.estimate_decay))
+            estimates[unit] = peak_mb
+            self._save(self.estimates_file, estimates)
+
+    def print_peaks(self, top: int = 10) -> None:
+        estimates: Mapping[str, int] = self._load(self.estimates_file)
+        print(f"Peak RSS of the heaviest {top} translation units:")
+        for unit, mb in sorted(estimates.items(), key=lambda a: -a[1])[:top]:
+            print(f"{mb:8d} MiB  {unit}")
+
+
+def get_compile_unit_name(cmd: Sequence[str]) -> str:
+    """Returns output object of compiler command line, or source file if not found."""
+    for i, arg in enumerate(cmd[:-1]):
+        if arg == "-o":
+            return cmd[i + 1]
+    for arg in reversed(cmd):
+        if os.path.splitext(arg)[1] in (".c", ".cc", ".cpp", ".cxx"):
+            return arg
+    return " ".join(cmd)
+
+
+class CompileUnitRecorder:
+    """Records compile time, memory and optionally include costs of translation units.
+
+    Include costs are inclusive parse times from clang's -ftime-trace, or for gcc the
+    number and size of headers first opened below each header reported by -H.
+    Failed compiles and links are recorded separately.
+    """
+
+    def __init__(self, state_path: Path):
+        self.state_path: Path = state_path
+
+    @property
+    def units_file(self) -> Path:
+        return self.state_path / "units.jsonl"
+
+    @property
+    def failures_file(self) -> Path:
+        return self.state_path / "failures.jsonl"
+
+    @property
+    def links_file(self) -> Path:
+        return self.state_path / "links.jsonl"
+
+    def prepare(self) -> None:
+        self.state_path.mkdir(parents=True, exist_ok=True)
+        remove_if_exist(self.units_file)
+        remove_if_exist(self.failures_file)
+        remove_if_exist(self.links_file)
+
+    def append(self, record: Mapping[str, object], kind: RecordKind = "units") -> None:
+        line = json.dumps(record) + "\n"
+        path = self.state_path / f"{kind}.jsonl"
+        # a single write with O_APPEND is not interleaved with other launchers.
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line.encode("utf-8"))
+        finally:
+            os.close(fd)
+
+    def load(self, kind: RecordKind = "units") -> List[Dict]:
+        path = self.state_path / f"{kind}.jsonl"
+        if not path.exists():
+            return []
+        with open(path, "r", encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    @staticmethod
+    def parse_time_trace(path: Path) -> Dict[str, float]:
+        """Returns inclusive parse time in ms by header from clang -ftime-trace output."""
+        costs: Dict[str, float] = {}
+        with open(path, "r", encoding="utf-8") as f:
+            trace = json.load(f)
+        for event in trace.get("traceEvents", []):
+            if event.get("name") == "Source" and "dur" in event:
+                header = event.get("args", {}).get("detail", "")
+                costs[header] = costs.get(header, 0.0) + event["dur"] / 1000
+        return costs
+
+    @staticmethod
+    def parse_include_tree(lines: Iterable[str]) -> Dict[str, float]:
+        """Returns KiB of headers opened below each header from gcc -H output."""
+        costs: Dict[str, float] = {}
+        stack: List[str] = []
+        for line in lines:
+            depth = len(line) - len(line.lstrip("."))
+            header = line[depth:].strip()
+            size = os.path.getsize(header) / 1024 if os.path.exists(header) else 0.0
+            del stack[depth - 1 :]
+            stack.append(header)
+            for h in stack:
+                costs[h] = costs.get(h, 0.0) + size
+        return costs
+
+    def print_report(self, marked_headers: Collection[str] = (), top: int = 20) -> None:
+        units = self.load()
+        if not units:
+            return
+        print(f"Slowest {top} of {len(units)} compiled translation units:")
+        print(f"{'wall[s]':>9s} {'cpu[s]':>9s} {'RSS[MiB]':>9s}  unit")
+        for unit in sorted(units, key=lambda u: -u["wall_time"])[:top]:
+            print(
+                f"{unit['wall_time']:9.1f} {unit['user_time'] + unit['system_time']:9.1f} "
+                f"{unit['max_rss_mb']:9d}  {unit['unit']}"
+            )
+        include_costs: Dict[str, float] = {}
+        unit_counts: Dict[str, int] = {}
+        for unit in units:
+            for header, cost in unit.get("include_costs", {}).items():
+                include_costs[header] = include_costs.get(header, 0.0) + cost
+                unit_counts[header] = unit_counts.get(header, 0) + 1
+        if not include_costs:
+            return
+        unit_of_cost = "ms" if any("time_trace" in u for u in units) else "KiB"
+        print(f"Most expensive {top} headers in {unit_of_cost} summed over units:")
+        print("(* marks headers added by patches of this script)")
+        for header, cost in sorted(include_costs.items(), key=lambda a: -a[1])[:top]:
+            mark = "*" if any(header.endswith(m) for m in marked_headers) else " "
+            print(f"{cost:12.0f} {unit_counts[header]:6d} {mark} {header}")
+
+
+def compile_launcher_main(argv: Sequence[str]) -> int:
+    """Compiler launcher used by the RDKit build.
+
+    Usage: build_rdkit_csharp.py compile_launcher STATE_DIR MODES COMPILER [ARGS...]
+    MODES is comma separated "admission", "hotspots", "includes", "failures" and "links".
+    It is also used as linker launcher with "links" mode to record link times.
+    """
+    state_path = Path(argv[0])
+    modes = argv[1].split(",")
+    cmd = list(argv[2:])
+    unit = get_compile_unit_name(cmd)
+    compiler = next(
+        (a for a in cmd if os.path.basename(a) not in ("ccache", "sccache")), cmd[0]
+    )
+    time_trace = "includes" in modes and "clang" in os.path.basename(compiler)
+    include_tree = "includes" in modes and not time_trace
+    if time_trace:
+        cmd.append("-ftime-trace")
+    if include_tree:
+        cmd.append("-H")
+    admission = MemoryAdmission(state_path) if "admission" in modes else None
+    if admission:
+        admission.acquire(unit)
+    # estimates are updated only by successful compiles.
+    peak_mb: Optional[int] = None
+    try:
+        start_time = time.monotonic()
+        proc = subprocess.Popen(cmd, stderr=PIPE if include_tree else None, text=True)
+        header_lines: List[str] = []
+        if include_tree:
+            assert proc.stderr
+            in_guard_list = False
+            for line in proc.stderr:
+                if re.match(r"^\.+ ", line):
+                    header_lines.append(line)
+                elif line.startswith("Multiple include guards may be useful for:"):
+                    in_guard_list = True
+                elif not (in_guard_list and os.path.exists(line.strip())):
+                    sys.stderr.write(line)
+        _, status, rusage = os.wait4(proc.pid, 0)
+        proc.returncode = get_exit_code(status)
+        # ru_maxrss is in KiB on Linux.
+        max_rss_mb = rusage.ru_maxrss // 1024
+        if proc.returncode == 0:
+            peak_mb = max_rss_mb
+        record: Dict[str, object] = {
+            "unit": unit,
+            "wall_time": time.monotonic() - start_time,
+            "end_time": time.time(),
+            "user_time": rusage.ru_utime,
+            "system_time": rusage.ru_stime,
+            "max_rss_mb": max_rss_mb,
+        }
+        if "links" in modes and proc.returncode == 0:
+            CompileUnitRecorder(state_path).append(record, "links")
+        if "hotspots" in modes or "includes" in modes:
+            trace_path = Path(os.path.splitext(unit)[0] + ".json")
+            if time_trace and trace_path.exists():
+                record["time_trace"] = True
+                record["include_costs"] = CompileUnitRecorder.parse_time_trace(trace_path)
+            if include_tree:
+                record["include_costs"] = CompileUnitRecorder.parse_include_tree(header_lines)
+            CompileUnitRecorder(state_path).append(record)
+        if "failures" in modes and proc.returncode != 0:
+            CompileUnitRecorder(state_path).append({"unit": unit}, "failures")
+    finally:
+        if admission:
+            admission.release(unit, peak_mb)
+    return proc.returncode
+
+
+_CXX_TOKEN = re.compile(
+    r"""
+    (?P<pp>^[ \t]*\#(?:[^\n\\]|\\.)*\n?)
+    |(?P<comment>//[^\n]*|/\*.*?\*/)
+    |(?P<literal>"(?:[^"\\\n]|\\.)*"|'(?:[^'\\\n]|\\.)*')
+    |(?P<open>\{)
+    |(?P<close>\})
+    |(?P<semi>;)
+    """,
+    re.MULTILINE | re.DOTALL | re.VERBOSE,
+)
+_CXX_SCOPE_HEAD = re.compile(r"\s*(namespace(?:\s+[\w:]+)?|extern\s*\"C\")\s*", re.DOTALL)
+_CXX_COMMENT = re.compile(r"//[^\n]*|/\*.*?\*/", re.DOTALL)
+_CXX_LEADING = re.compile(r"(?:\s+|//[^\n]*|/\*.*?\*/)*", re.DOTALL)
+
+# kind, text and length of the head before the body of a top-level item of C++ source.
+# kind is "pp", "open", "close", "decl", "def" or "space".
+CxxItem = Tuple[str, str, int]
+
+
+def split_cxx_items(text: str) -> List[CxxItem]:
+    """Splits C++ source into top-level items.
+
+    Items in `namespace` and `extern "C"` blocks are top-level too; the lines opening and
+    closing the blocks are "open" and "close" items.
+    """
+    items: List[CxxItem] = []
+    start = 0
+    depth = 0
+    body_pos = 0
+    for m in _CXX_TOKEN.finditer(text):
+        kind = m.lastgroup
+        if kind in ("comment", "literal"):
+            continue
+        if depth > 0:
+            if kind == "open":
+                depth += 1
+            elif kind == "close":
+                depth -= 1
+                if depth == 0 and not _is_cxx_decl(text, start, body_pos, m.end()):
+                    items.append(("def", text[start : m.end()], body_pos - start))
+                    start = m.end()
+            continue
+        head = text[start : m.start()]
+        if kind == "pp":
+            if _CXX_COMMENT.sub("", head).strip():
+                continue
+            items.append(("pp", text[start : m.end()], 0))
+            start = m.end()
+        elif kind == "open":
+            if _CXX_SCOPE_HEAD.fullmatch(_CXX_COMMENT.sub("", head)):
+                items.append(("open", text[start : m.end()], 0))
+                start = m.end()
+            else:
+                depth = 1
+                body_pos = m.start()
+        elif kind == "close":
+            items.append(("close", text[start : m.end()], 0))
+            start = m.end()
+        elif kind == "semi":
+            items.append(("decl", text[start : m.end()], 0))
+            start = m.end()
+    items.append(("space", text[start:], 0))
+    return items
+
+
+def _is_cxx_decl(text: str, start: int, body_pos: int, end: int) -> bool:
+    """Returns whether the braces closed at `end` are a part of a declaration ending with ;."""
+    head = _CXX_COMMENT.sub("", text[start:body_pos]).strip()
+    return (
+        re.match(r"(typedef\s+)?(class|struct|union|enum)\b", head) is not None
+        or head.endswith("=")
+        or re.match(r"\s*;", text[end : end + 256]) is not None
+    )
+
+
+_CXX_INTERNAL_DEF = re.compile(
+    r"(template\s*<\s*[^>\s]|static\b|inline\b|SWIGINTERN|SWIGRUNTIME|SWIGUNUSED\s+static\b)"
+)
+_CXX_VARIABLE = re.compile(
+    r"(?P<static>static\s+)?(?P<decl>[\w:<>,\s\*&]*?[\w>\*&\s]\s*\b\w+\s*(\[[^\]]*\])?)\s*(=.*)?;",
+    re.DOTALL,
+)
+_CXX_NOT_VARIABLE = re.compile(
+    r"(typedef|using|class|struct|union|enum|template|extern|friend|namespace|return)\b"
+)
+
+
+def _is_cxx_internal(text: str) -> bool:
+    return _CXX_INTERNAL_DEF.match(_CXX_COMMENT.sub("", text).strip()) is not None
+
+
+def _split_swig_preamble(items: Sequence[CxxItem]) -> Tuple[str, str]:
+    """Returns the preamble for the part defining it and the header for other parts.
+
+    Function definitions with external linkage are kept only in the defining part and the
+    header declares them instead, as are definitions of static data members. Mutable
+    variables, such as static callbacks registered by .NET, become C++17 inline variables to
+    be one object shared by all parts.
+    """
+    defining: List[str] = []
+    header: List[str] = []
+    anonymous_depth = 0
+    scopes: List[bool] = []
+    for kind, text, head_len in items:
+        code = _CXX_COMMENT.sub("", text).strip()
+        if kind == "open":
+            is_anonymous = code.split()[0] == "namespace" and len(code.split()) == 2
+            scopes.append(is_anonymous)
+            anonymous_depth += is_anonymous
+        elif kind == "close" and scopes:
+            anonymous_depth -= scopes.pop()
+        if anonymous_depth or kind not in ("decl", "def"):
+            defining.append(text)
+            header.append(text)
+            continue
+        if kind == "def":
+            defining.append(text)
+            head = _CXX_COMMENT.sub("", text[:head_len]).strip()
+            name = head.split("(")[0].split()
+            if _CXX_INTERNAL_DEF.match(head) or not name:
+                header.append(text)
+            elif "::" not in name[-1]:
+                # prototype of a free function. Members are declared in their class.
+                header.append("\n" + head + ";")
+            continue
+        declarator = code.split("=")[0]
+        name = re.split(r"[({\[;]", declarator)[0].split()
+        if name and "::" in name[-1] and not _CXX_NOT_VARIABLE.match(code):
+            # definition of a static data member, which is declared in its class.
+            defining.append(text)
+            continue
+        m = None if "(" in declarator or "{" in declarator else _CXX_VARIABLE.fullmatch(code)
+        if m and not _CXX_NOT_VARIABLE.match(m.group("decl")) and not _is_cxx_const(declarator):
+            # an inline variable is one object in all parts.
+            pos = cast(re.Match, _CXX_LEADING.match(text)).end()
+            text = text[:pos] + "inline " + text[pos + len(m.group("static") or "") :]
+        defining.append(text)
+        header.append(text)
+    return "".join(defining), "".join(header)
+
+
+def _is_cxx_const(declarator: str) -> bool:
+    """Returns whether a variable declared by `declarator` is const, which has internal linkage."""
+    if "constexpr" in declarator:
+        return True
+    if "*" in declarator:
+        return re.search(r"\*\s*const\b[^*]*$", declarator) is not None
+    return re.search(r"\bconst\b", declarator) is not None
+
+
+def split_swig_wrapper(wrap_path: Path, parts: int, prefix: Path) -> List[Path]:
+    """Splits a C++ wrapper generated by SWIG into translation units.
+
+    Wrapper functions in the `extern "C"` section are distributed to `parts` files in
+    balanced sizes. The first part has the preamble of the wrapper and the others include
+    `<prefix>_common.h` made from it, which can be precompiled. If the wrapper has an
+    unexpected layout, the first part is the whole wrapper and the others are empty.
+    Files are written only if their contents change.
+
+    Returns:
+        List[Path]: Parts and the common header.
+    """
+    text = get_as_text(wrap_path)
+    common_path = Path(f"{prefix}_common.h")
+    guard = re.sub(r"\W", "_", common_path.name).upper()
+    part_texts: List[str]
+    try:
+        part_texts, common = _split_swig_wrapper_text(text, parts, common_path.name)
+    except ValueError as e:
+        logging.warning(f"{wrap_path} is compiled as one unit: {e}")
+        part_texts = [text] + ["\n"] * (parts - 1)
+        common = ""
+    outputs: List[Tuple[Path, str]] = [
+        (Path(f"{prefix}_part{i}.cxx"), t) for i, t in enumerate(part_texts)
+    ]
+    outputs.append((common_path, f"#ifndef {guard}\n#define {guard}\n{common}\n#endif\n"))
+    for path, content in outputs:
+        if not path.exists() or get_as_text(path) != content:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(content)
+    return [path for path, _ in outputs]
+
+
+def _split_swig_wrapper_text(text: str, parts: int, common_name: str) -> Tuple[List[str], str]:
+    items = split_cxx_items(text)
+    first_export = next(
+        (
+            i
+            for i, (kind, t, _) in enumerate(items)
+            if kind == "def" and re.search(r"SWIGEXPORT[^(]*\bCSharp_", t)
+        ),
+        None,
+    )
+    if first_export is None:
+        raise ValueError("no exported wrapper function")
+    open_index = max(
+        (i for i in range(first_export) if items[i][0] == "open" and '"C"' in items[i][1]),
+        default=None,
+    )
+    close_index = next(
+        (i for i in range(first_export, len(items)) if items[i][0] == "close"), None
+    )
+    if open_index is None or close_index is None:
+        raise ValueError('no extern "C" section')
+    # '#ifdef __cplusplus' and '#endif' around 'extern "C" {' and '}'
+    begin = open_index - 1 if items[open_index - 1][0] == "pp" else open_index
+    body_begin = open_index + 2 if items[open_index + 1][0] == "pp" else open_index + 1
+    end = close_index - 1 if items[close_index - 1][0] == "pp" else close_index
+    body = items[body_begin:end]
+    if any(kind not in ("def", "decl", "space") for kind, _, _ in body):
+        raise ValueError("preprocessor directives between wrapper functions")
+    prologue = "".join(t for _, t, _ in items[begin:body_begin])
+    epilogue = "".join(t for _, t, _ in items[end:])
+    defining, common = _split_swig_preamble(items[:begin])
+
+    # internal definitions are needed by all parts.
+    shared = "".join(t for _, t, _ in body if _is_cxx_internal(t))
+    exported = [t for _, t, _ in body if not _is_cxx_internal(t)]
+    total = sum(len(t) for t in exported)
+    chunks: List[List[str]] = [[] for _ in range(parts)]
+    size = 0
+    for t in exported:
+        chunks[min(parts - 1, size * parts // max(1, total))].append(t)
+        size += len(t)
+    part_texts = [
+        (defining if i == 0 else f'#include "{common_name}"\n')
+        + prologue
+        + shared
+        + "".join(chunk)
+        + epilogue
+        for i, chunk in enumerate(chunks)
+    ]
+    return part_texts, common
+
+
+def split_swig_wrapper_main(argv: Sequence[str]) -> int:
+    """Usage: build_rdkit_csharp.py split_swig_wrapper WRAP_CXX PARTS PREFIX"""
+    split_swig_wrapper(Path(argv[0]), int(argv[1]), Path(argv[2]))
+    return 0
+
+
+def read_make_depfile(path: PathLike) -> List[str]:
+    """Returns prerequisites listed in a dependency file in make syntax."""
+    text = re.sub(r"\\\r?\n", " ", get_as_text(path))
+    deps: List[str] = []
+    for line in text.splitlines():
+        # the first colon followed by a space, as Windows paths have colons.
+        _, sep, rest = line.partition(": ")
+        if not sep:
+            continue
+        for token in re.split(r"(?<!\\)\s+", rest.strip()):
+            if token:
+                deps.append(token.replace("\\ ", " "))
+    return list(dict.fromkeys(deps))
+
+
+class SwigCache:
+    """Memoizes outputs of SWIG runs in an ArtifactStore under `root`.
+
+    As the direct mode of ccache does, a manifest for each command line lists files SWIG
+    read in earlier runs with their digests, and outputs are keyed by the command line
+    and those digests. Files read are taken from the dependency file SWIG writes.
+    """
+
+    max_manifest_entries: int = 8
+
+    def __init__(self, root: Path):
+        self.root: Path = root
+        self.store: ArtifactStore = ArtifactStore(root)
+
+    def _manifest_path(self, cmd_key: str) -> Path:
+        return self.root / "manifests" / f"{cmd_key}.json"
+
+    def _load_manifest(self, cmd_key: str) -> List[Dict[str, object]]:
+        path = self._manifest_path(cmd_key)
+        if not path.exists():
+            return []
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def lookup(self, cmd_key: str) -> Optional[str]:
+        """Returns key of the outputs whose inputs are unchanged, or None."""
+        digests: Dict[str, Optional[str]] = {}
+
+        def digest(path: str) -> Optional[str]:
+            if path not in digests:
+                digests[path] = file_digest(path) if os.path.isfile(path) else None
+            return digests[path]
+
+        for entry in self._load_manifest(cmd_key):
+            deps = cast(Mapping[str, str], entry["deps"])
+            if all(digest(path) == d for path, d in deps.items()):
+                return cast(str, entry["key"])
+        return None
+
+    def add(self, cmd_key: str, deps: Iterable[str]) -> str:
+        """Adds a run reading `deps` to the manifest and returns key of its outputs."""
+        digests = {path: file_digest(path) for path in deps if os.path.isfile(path)}
+        key = ArtifactStore.make_key(cmd_key, digests)
+        entries = [e for e in self._load_manifest(cmd_key) if e["key"] != key]
+        entries = [{"deps": digests, "key": key}] + entries[: self.max_manifest_entries - 1]
+        path = self._manifest_path(cmd_key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entries, f, indent=1)
+        os.replace(tmp_path, path)
+        return key
+
+
+def _get_option_value(args: Sequence[str], option: str) -> Optional[str]:
+    for i, arg in enumerate(args[:-1]):
+        if arg == option:
+            return args[i + 1]
+    return None
+
+
+def swig_launcher_main(argv: Sequence[str]) -> int:
+    """Launcher of custom commands of the SWIG wrapper, which memoizes SWIG runs.
+
+    Usage: build_rdkit_csharp.py swig_launcher CACHE_DIR COMMAND [ARGS...]
+    Commands other than SWIG run as they are. Outputs are the file given by -o, -oh and
+    -MF, and files SWIG writes to -outdir.
+    """
+    cache = SwigCache(Path(argv[0]))
+    cmd = list(argv[1:])
+    # UseSWIG runs SWIG through "cmake -E env SWIG_LIB=...".
+    index = next(
+        (
+            i
+            for i, arg in enumerate(cmd)
+            if re.match(r"^swig[\d.]*(\.exe)?$", os.path.basename(arg), re.IGNORECASE)
+        ),
+        None,
+    )
+    if index is None:
+        return subprocess.call(cmd)
+    swig_args = cmd[index + 1 :]
+    version = subprocess.run(cmd[: index + 1] + ["-version"], stdout=PIPE, text=True).stdout
+    cmd_key = ArtifactStore.make_key("swig", cmd, version.strip(), os.getcwd())
+    outdir = os.path.abspath(_get_option_value(swig_args, "-outdir") or os.curdir)
+    files = [
+        os.path.abspath(value)
+        for value in (_get_option_value(swig_args, option) for option in ("-o", "-oh", "-MF"))
+        if value
+    ]
+    base = Path(os.path.commonpath([outdir] + files))
+    key = cache.lookup(cmd_key)
+    if key and cache.store.restore(key, base):
+        logging.info(f"SWIG outputs are restored from {cache.root}.")
+        return 0
+
+    dep_path = _get_option_value(swig_args, "-MF")
+    tmp_dep_path: Optional[str] = None
+    if dep_path is None:
+        fd, tmp_dep_path = tempfile.mkstemp(suffix=".d")
+        os.close(fd)
+        dep_path = tmp_dep_path
+        cmd = cmd[: index + 1] + ["-MD", "-MF", tmp_dep_path] + swig_args
+    def get_outdir_times() -> Dict[Path, int]:
+        if not os.path.isdir(outdir):
+            return {}
+        return {p: p.stat().st_mtime_ns for p in Path(outdir).iterdir() if p.is_file()}
+
+    try:
+        # files left in -outdir by earlier runs are not outputs.
+        times = get_outdir_times()
+        returncode = subprocess.call(cmd)
+        if returncode != 0:
+            return returncode
+        outputs = [Path(f) for f in files if os.path.isfile(f)]
+        outputs += [p for p, t in get_outdir_times().items() if times.get(p) != t]
+        key = cache.add(cmd_key, read_make_depfile(dep_path))
+        cache.store.save(key, base, outputs)
+    finally:
+        if tmp_dep_path:
+            os.remove(tmp_dep_path)
+    return 0
+
+
 class Config:
     def __init__(self):
         self.this_path: Optional[Path] = None
@@ -308,6 +1743,27 @@ class Config:
         self.use_static_libs: bool = False
         self.target_lang: LangType = LangType.CPlusPlus
         self.more_functions: bool = False
+        self.config_values: Mapping[str, str] = {}
+        self.artifact_cache_path: Optional[Path] = None
+        self.compiler_cache: Optional[CompilerCache] = None
+        self.build_tool: BuildTool = "make"
+        self.memory_aware_jobs: bool = False
+        self.compile_hotspots: bool = False
+        self.include_costs: bool = False
+        self.jobs: int = 1
+        self.swig_wrapper_parts: int = 1
+        self.fast_build: bool = False
+        self.unity_batch_size: int = 8
+        self.pgo: bool = False
+        self.pgo_workload: Optional[str] = None
+        self.lto: LtoMode = "none"
+        self.linker: Linker = "bfd"
+        self.gc_sections: bool = False
+        self.split_debug: bool = False
+        self.link_report: bool = False
+        self.cpu_variants: List[CpuVariant] = []
+        self.shared_core: bool = False
+        self.swig_cache: bool = False
 
 
 def to_on_off(flag: bool) -> str:
@@ -357,14 +1813,79 @@ def vcxproj_to_vscurr(proj_file: Path) -> None:
     tree.write(proj_file, "utf-8", True)
 
 
+# Config fields which change outputs of each kind of stage. Scheduling and reporting fields
+# such as jobs and compile_hotspots are left out, so artifacts and stage stamps are shared
+# by runs differing only in them.
+_rdkit_output_fields: Tuple[str, ...] = (
+    "config_values",
+    "cairo_support",
+    "freetype_support",
+    "swig_patch_enabled",
+    "use_boost",
+    "test_enabled",
+    "limit_external",
+    "use_static_libs",
+    "target_lang",
+    "more_functions",
+    "swig_wrapper_parts",
+    "fast_build",
+    "unity_batch_size",
+    "pgo",
+    "pgo_workload",
+    "lto",
+    "linker",
+    "gc_sections",
+    "split_debug",
+    "shared_core",
+)
+_stage_output_fields: Mapping[str, Tuple[str, ...]] = {
+    "zlib": (),
+    "libpng": ("use_static_libs",),
+    "pixman": (),
+    "patch": (
+        "target_lang",
+        "shared_core",
+        "more_functions",
+        "swig_patch_enabled",
+        "swig_wrapper_parts",
+        "swig_cache",
+    ),
+    # compiler launchers are wired by configures.
+    "cmake": _rdkit_output_fields
+    + (
+        "build_tool",
+        "compiler_cache",
+        "memory_aware_jobs",
+        "compile_hotspots",
+        "include_costs",
+        "link_report",
+    ),
+    "rdkit": _rdkit_output_fields,
+    "copy_dlls": _rdkit_output_fields,
+    "wrapper": _rdkit_output_fields + ("minor_version",),
+    "nuget": _rdkit_output_fields + ("minor_version", "cpu_variants"),
+}
+
+
 class NativeMaker:
-    def __init__(self, config: Config, build_platform: Optional[CpuModel] = None):
+    def __init__(
+        self,
+        config: Config,
+        build_platform: Optional[CpuModel] = None,
+        cpu_variant: Optional[CpuVariant] = None,
+    ):
         self.build_platform: Optional[CpuModel] = build_platform if build_platform else "x64"
         self.config: Config = config
+        # microarchitecture level to build RDKFuncs for in addition to the baseline.
+        self.cpu_variant: Optional[CpuVariant] = cpu_variant
+        # False when sources are patched by the patch_rdkit stage before configures.
+        self.patches_on_configure: bool = True
 
     @property
     def g_option_of_cmake(self) -> Sequence[str]:
         if get_os() == "linux":
+            if self.config.build_tool == "ninja":
+                return ["-GNinja"]
             return ["-GUnix Makefiles"]
         if get_os() == "win":
             assert self.build_platform
@@ -385,11 +1906,17 @@ class NativeMaker:
     def build_dir_name_of_rdkit(self) -> str:
         """Returns build path for RDKit. Typically "buildx86winCSharp".
 
+        With --shared_core, all target languages share "build<os><platform>Shared".
+
         Returns:
             str: Directory name.
         """
         assert self.build_platform
-        return f"build{get_os()}{self.build_platform}{_LangType_to_str[self.config.target_lang]}"
+        lang = "Shared" if self.config.shared_core else _LangType_to_str[self.config.target_lang]
+        name = f"build{get_os()}{self.build_platform}{lang}"
+        if self.cpu_variant:
+            name += f"_{self.cpu_variant}"
+        return name
 
     @property
     def ms_build_platform(self) -> MSPlatform:
@@ -529,7 +2056,270 @@ class NativeMaker:
         ]
         call_subprocess(cmd)
 
+    @property
+    def compiler_cache_path(self) -> Path:
+        """Returns directory of ccache/sccache. It is out of RDKit tree to survive --clean."""
+        assert self.config.compiler_cache
+        return self.this_path / "compiler_cache" / self.config.compiler_cache
+
+    @property
+    def build_env(self) -> Mapping[str, str]:
+        """Returns environment variables for cmake and native builds."""
+        env: Dict[str, str] = {}
+        if self.config.compiler_cache == "ccache":
+            env["CCACHE_DIR"] = str(self.compiler_cache_path)
+            # share cache entries between clones at different places. RDKIT_DIR may be
+            # outside of the clone, and a root base would make system headers relative.
+            base_dir = Path(os.path.commonpath([self.this_path, self.rdkit_path]))
+            if base_dir.parent == base_dir:
+                base_dir = self.rdkit_path
+            env["CCACHE_BASEDIR"] = str(base_dir)
+            if self.config.swig_wrapper_parts > 1 or self.config.fast_build:
+                # allow to cache units compiled with precompiled headers.
+                env["CCACHE_SLOPPINESS"] = "pch_defines,time_macros,include_file_mtime"
+        elif self.config.compiler_cache == "sccache":
+            env["SCCACHE_DIR"] = str(self.compiler_cache_path)
+        return env
+
+    @property
+    def compile_launcher_path(self) -> Path:
+        return self.rdkit_build_path / "compile_launcher"
+
+    @property
+    def memory_admission(self) -> MemoryAdmission:
+        return MemoryAdmission(self.compile_launcher_path)
+
+    @property
+    def compile_unit_recorder(self) -> CompileUnitRecorder:
+        return CompileUnitRecorder(self.compile_launcher_path)
+
+    @property
+    def link_variant(self) -> str:
+        """Returns name of the link optimizations, e.g. "lto=thin,linker=lld,gc_sections"."""
+        names = [f"lto={self.config.lto}", f"linker={self.config.linker}"]
+        if self.config.gc_sections:
+            names.append("gc_sections")
+        if self.config.split_debug:
+            names.append("split_debug")
+        if self.config.pgo:
+            names.append("pgo")
+        return ",".join(names)
+
+    @property
+    def measures_links(self) -> bool:
+        """Returns whether link times and binary sizes are reported."""
+        return get_os() == "linux" and (
+            self.config.link_report
+            or self.config.lto != "none"
+            or self.config.linker != "bfd"
+            or self.config.gc_sections
+            or self.config.split_debug
+        )
+
+    def _get_compiler_launcher_args(self) -> List[str]:
+        launchers: List[str] = []
+        modes: List[str] = []
+        if self.config.memory_aware_jobs:
+            modes.append("admission")
+        if self.config.compile_hotspots:
+            modes.append("hotspots")
+        if self.config.include_costs:
+            modes.append("includes")
+        if self.config.fast_build and get_os() != "win":
+            # to find targets to build without unity builds on failures.
+            modes.append("failures")
+        this_launcher = [
+            sys.executable,
+            str(Path(__file__).resolve()),
+            "compile_launcher",
+            str(self.compile_launcher_path),
+        ]
+        if modes:
+            launchers += this_launcher + [",".join(modes)]
+        if self.config.compiler_cache:
+            launchers.append(self.config.compiler_cache)
+        if not launchers and not self.measures_links:
+            return []
+        if get_os() == "win":
+            # Visual Studio generators ignore compiler launchers.
+            logging.warning("Compiler launchers are not supported with Visual Studio.")
+            return []
+        args: List[str] = []
+        if launchers:
+            args += [
+                f"-DCMAKE_C_COMPILER_LAUNCHER={';'.join(launchers)}",
+                f"-DCMAKE_CXX_COMPILER_LAUNCHER={';'.join(launchers)}",
+            ]
+        if self.measures_links:
+            # linker launchers need CMake 3.21 or later.
+            link_launcher = ";".join(this_launcher + ["links"])
+            args += [
+                f"-DCMAKE_C_LINKER_LAUNCHER={link_launcher}",
+                f"-DCMAKE_CXX_LINKER_LAUNCHER={link_launcher}",
+            ]
+        else:
+            args += ["-UCMAKE_C_LINKER_LAUNCHER", "-UCMAKE_CXX_LINKER_LAUNCHER"]
+        return args
+
+    def _call_compiler_cache(self, option: Literal["zero", "show"]) -> None:
+        if not self.config.compiler_cache or get_os() == "win":
+            return
+        if option == "show":
+            print(f"Statistics of {self.config.compiler_cache}:")
+        call_subprocess([self.config.compiler_cache, f"--{option}-stats"], env=self.build_env)
+
+    @property
+    def artifact_store(self) -> Optional[ArtifactStore]:
+        if self.config.artifact_cache_path is None:
+            return None
+        return ArtifactStore(self.config.artifact_cache_path)
+
+    def _make_artifact_key(
+        self, stage: str, inputs: Sequence[object], kind: Optional[str] = None
+    ) -> str:
+        """Returns key of outputs of `stage` from config fields changing outputs of its kind.
+
+        `kind` is `stage` if omitted.
+        """
+        config_vars = {
+            k: getattr(self.config, k)
+            for k in _stage_output_fields[kind or stage]
+            # the training workload is not run without --pgo.
+            if k != "pgo_workload" or self.config.pgo
+        }
+        text = json.dumps(
+            [
+                stage,
+                get_os(),
+                self.build_platform,
+                get_toolchain_id(),
+                config_vars,
+                inputs,
+            ],
+            default=str,
+            sort_keys=True,
+        )
+        # keys do not depend on where this repository is cloned.
+        return ArtifactStore.make_key(text.replace(str(self.this_path), "$HERE"))
+
+    def _run_cached(
+        self,
+        stage: str,
+        inputs: Sequence[object],
+        base: Path,
+        outputs: Callable[[], Iterable[Path]],
+        action: Callable[[], None],
+    ) -> None:
+        """Restores outputs of `stage` from the artifact store, or runs `action` and stores.
+
+        Args:
+            stage (str): Name of the stage.
+            inputs (Sequence[object]): Inputs specific to the stage. Config is always added.
+            base (Path): Directory where outputs are placed.
+            outputs (Callable[[], Iterable[Path]]): Returns outputs after `action`.
+            action (Callable[[], None]): Builds outputs.
+        """
+        store = self.artifact_store
+        if store is None:
+            action()
+            return
+        key = self._make_artifact_key(stage, inputs)
+        if store.restore(key, base):
+            logging.info(f"Stage {stage} for {self.build_platform} is restored from cache.")
+            return
+        action()
+        store.save(key, base, outputs())
+
+    @property
+    def stage_stamps_path(self) -> Path:
+        """Returns directory of stamps of stages. It survives --clean."""
+        return self.this_path / "stage_stamps"
+
+    def get_stage_target(self, stage: str, kind: StageKind) -> Optional["StageTarget"]:
+        """Returns files read and written by `stage` of this maker, or None if not tracked."""
+        script_path = Path(__file__).resolve()
+        files_path = self.this_path / "files" / "rdkit"
+        files: Dict[StageKind, Tuple[Callable[[], Iterable[Path]], Callable[[], Iterable[Path]]]]
+        files = {
+            "patch": (
+                lambda: [script_path, *(p for p in files_path.iterdir() if p.is_file())],
+                lambda: [self.patch_ledger.path],
+            ),
+            "cmake": (
+                lambda: [
+                    script_path,
+                    *self.bakable_files,
+                    *iter_tree_files(self.rdkit_path, (".cmake",), names=("CMakeLists.txt",)),
+                    *iter_tree_files(files_path, (".cmake",)),
+                ],
+                lambda: [self.rdkit_build_path / "CMakeCache.txt"],
+            ),
+        }
+        if self.config.target_lang == LangType.CSharp:
+            # SWIG writes swig_csharp while RDKit is built, and dotnet writes bin and obj.
+            files["rdkit"] = (
+                lambda: [
+                    self.rdkit_build_path / "CMakeCache.txt",
+                    *iter_tree_files(
+                        self.rdkit_path / "Code",
+                        _rdkit_source_suffixes,
+                        ("swig_csharp", "bin", "obj"),
+                    ),
+                    *iter_tree_files(self.rdkit_path / "External", _rdkit_source_suffixes),
+                ],
+                lambda: [self.get_RDKFuncs_dll_path(), self.rdkit_swig_csharp_path],
+            )
+            files["copy_dlls"] = (
+                lambda: [self.get_RDKFuncs_dll_path(), *self._get_dependent_lib_paths()],
+                lambda: [self.rdkit_wrapper_path / get_os() / cast(str, self.build_platform)],
+            )
+            if self.cpu_variant:
+                # the directory is shared with the baseline, which may replace its files.
+                files["copy_dlls"] = (
+                    lambda: [self.get_RDKFuncs_dll_path()],
+                    self._get_cpu_variant_dll_dest_paths,
+                )
+            files["wrapper"] = (
+                lambda: [
+                    script_path,
+                    *iter_tree_files(files_path),
+                    *iter_tree_files(self.rdkit_swig_csharp_path),
+                    *iter_tree_files(self.rdkit_wrapper_path / get_os()),
+                ],
+                self.get_RDKit2DotNet_dll_paths,
+            )
+            files["nuget"] = (
+                lambda: [
+                    script_path,
+                    *self.get_RDKit2DotNet_dll_paths(),
+                    *(
+                        p
+                        for _os in typing.get_args(SupportedSystem)
+                        for p in iter_tree_files(self.rdkit_wrapper_path / _os)
+                    ),
+                ],
+                lambda: [self.get_nupkg_path()],
+            )
+        if kind not in files:
+            return None
+        inputs, outputs = files[kind]
+        return StageTarget(
+            self.stage_stamps_path / f"{stage.replace(':', '_')}.stamp",
+            self._make_artifact_key(stage, [], kind),
+            inputs,
+            outputs,
+        )
+
     def make_zlib(self) -> None:
+        self._run_cached(
+            "zlib",
+            [tree_digest(self.zlib_path, exclude=("zconf.h", "zconf.h.included"))],
+            self.zlib_path,
+            lambda: [self.zlib_path / self.build_dir_name, self.zlib_path / "zconf.h"],
+            self._make_zlib,
+        )
+
+    def _make_zlib(self) -> None:
         build_path = self.zlib_path / self.build_dir_name
         build_path.mkdir(exist_ok=True)
         _curdir = os.path.abspath(os.curdir)
@@ -543,6 +2333,18 @@ class NativeMaker:
             os.chdir(_curdir)
 
     def make_libpng(self) -> None:
+        self._run_cached(
+            "libpng",
+            [
+                tree_digest(self.libpng_path),
+                file_digest(self.zlib_lib_path) if self.zlib_lib_path.exists() else None,
+            ],
+            self.libpng_path,
+            lambda: [self.libpng_path / self.build_dir_name],
+            self._make_libpng,
+        )
+
+    def _make_libpng(self) -> None:
         build_path = self.libpng_path / self.build_dir_name
         build_path.mkdir(exist_ok=True)
         _curdir = os.path.abspath(os.curdir)
@@ -564,6 +2366,18 @@ class NativeMaker:
             os.chdir(_curdir)
 
     def make_pixman(self) -> None:
+        self._run_cached(
+            "pixman",
+            [
+                tree_digest(self.pixman_path, exclude=("vc2017", "config.h")),
+                tree_digest(self.this_path / "files" / "pixman"),
+            ],
+            self.pixman_path,
+            lambda: [self.pixman_path / "vc2017" / self.ms_build_platform],
+            self._make_pixman,
+        )
+
+    def _make_pixman(self) -> None:
         _curdir = os.path.abspath(os.curdir)
         try:
             proj_dir = self.pixman_path / "vc2017"
@@ -724,42 +2538,291 @@ class NativeMaker:
     def path_RDKit2DotNet_folder(self):
         return self.rdkit_wrapper_path / "RDKit2DotNet"
 
-    def build_cmake_rdkit(self) -> Sequence[str]:
+    def build_cmake_rdkit(self, pgo_phase: Optional[PgoPhase] = None) -> Sequence[str]:
         self.rdkit_build_path.mkdir(exist_ok=True)
         _curdir = os.path.abspath(os.curdir)
         os.chdir(self.rdkit_build_path)
         try:
-            self._patch_i_files()
-            cmd = self._make_rdkit_cmake()
+            if self.patches_on_configure:
+                self._patch_i_files()
+            cmd = self._make_rdkit_cmake(pgo_phase)
             return cmd
         finally:
             os.chdir(_curdir)
 
+    def show_cmake_rdkit(self) -> None:
+        cmd = self.build_cmake_rdkit()
+        print(" ".join([(('"' + s + '"') if (" " in s or '"' in s) else s) for s in cmd]))
+
+    def patch_rdkit_sources(self) -> None:
+        self._patch_i_files()
+
     def build_rdkit(self) -> None:
+        build = self._build_rdkit_pgo if self.config.pgo else self._build_rdkit
+        # links restored from the artifact store are not measured.
+        remove_if_exist(self.compile_unit_recorder.links_file)
+        if self.config.target_lang != LangType.CSharp:
+            build()
+            return
+        self._run_cached(
+            "rdkit",
+            self._get_rdkit_artifact_inputs(),
+            self.rdkit_path,
+            lambda: [
+                self.get_RDKFuncs_dll_path(),
+                *self._get_dependent_lib_paths(),
+                self.rdkit_swig_csharp_path,
+            ],
+            build,
+        )
+
+    @property
+    def pgo_profile_path(self) -> Path:
+        """Returns directory where RDKit instrumented by --pgo writes profiles."""
+        return self.rdkit_build_path / "pgo"
+
+    def _build_rdkit_pgo(self) -> None:
+        """Builds RDKit instrumented, runs the training workload and rebuilds with the profile."""
+        if get_os() == "win":
+            logging.warning("--pgo is supported only on Linux. RDKit is built without profiles.")
+            self._build_rdkit()
+            return
+        remove_if_exist(self.pgo_profile_path)
+        self.build_cmake_rdkit("generate")
+        self._build_rdkit()
+        self._run_pgo_workload()
+        if is_clang_toolchain():
+            profiles = [str(p) for p in self.pgo_profile_path.glob("*.profraw")]
+            call_subprocess(
+                ["llvm-profdata", "merge", f"-output={self.pgo_profile_path / 'default.profdata'}"]
+                + profiles
+            )
+        self.build_cmake_rdkit("use")
+        self._build_rdkit()
+
+    def _run_pgo_workload(self) -> None:
+        """Runs the training workload of --pgo with instrumented RDKit."""
+        lib_paths = [
+            str(self.rdkit_build_path / "lib"),
+            str(self.get_RDKFuncs_dll_path().parent),
+            os.environ.get("LD_LIBRARY_PATH", ""),
+        ]
+        env = {"LD_LIBRARY_PATH": os.pathsep.join(p for p in lib_paths if p)}
+        if self.config.pgo_workload:
+            call_subprocess(shlex.split(self.config.pgo_workload), env=env)
+            return
+        self._copy_dlls()
+        self.build_wrapper()
+        _curdir = os.path.abspath(os.curdir)
+        os.chdir(self.rdkit_wrapper_path / "RDKit2DotNetTest")
+        try:
+            call_subprocess(
+                ["dotnet", "run", "-c", "Release", "--", "--train", "Data/actives_5ht3.sdf"],
+                env=env,
+            )
+        finally:
+            os.chdir(_curdir)
+
+    def _get_rdkit_artifact_inputs(self) -> Sequence[object]:
+        # compiler launchers and parallelism of LTO do not change outputs.
+        cmd_line = [
+            re.sub(r"-flto=\d+", "-flto", arg)
+            for arg in self._get_cmake_rdkit_cmd_line()
+            if not re.match(r"-[DU]CMAKE_\w+_LAUNCHER\b", arg)
+        ]
+        return [
+            cmd_line,
+            {str(p): file_digest(p) for p in self.bakable_files if p.exists()},
+            file_digest(self.rdkit_path / "CMakeLists.txt"),
+            tree_digest(self.rdkit_path / "Code", _rdkit_source_suffixes),
+            tree_digest(self.rdkit_path / "External", _rdkit_source_suffixes),
+        ]
+
+    def _build_rdkit(self) -> None:
         self.rdkit_build_path.mkdir(exist_ok=True)
         _curdir = os.path.abspath(os.curdir)
         os.chdir(self.rdkit_build_path)
         try:
+            is_clean = self._is_build_tree_clean()
+            build_start = time.time()
             if get_os() == "win":
                 self.run_msbuild("RDKit.sln")
             else:
-                cmd = ["make", "-j"]
+                targets: List[str]
                 if self.config.target_lang in (LangType.CPlusPlus,):
-                    pass
+                    targets = []
                 elif self.config.target_lang in (LangType.CSharp,):
-                    cmd += ["RDKFuncs"]
+                    targets = ["RDKFuncs"]
                 elif self.config.target_lang in (LangType.Java,):
-                    cmd += ["install"]
+                    targets = ["install"]
                 else:
                     raise AssertionError
-                call_subprocess(cmd)
+                self._call_compiler_cache("zero")
+                if self.config.memory_aware_jobs:
+                    budget_mb = get_available_memory_mb() * 9 // 10
+                    logging.info(f"Compile jobs are admitted within {budget_mb} MiB.")
+                    self.memory_admission.prepare(budget_mb)
+                if (
+                    self.config.compile_hotspots
+                    or self.config.include_costs
+                    or self.config.fast_build
+                    or self.measures_links
+                ):
+                    self.compile_unit_recorder.prepare()
+                if self.config.fast_build:
+                    self._build_with_unity_fallback(targets)
+                else:
+                    call_subprocess(self._get_native_build_cmd(targets), env=self.build_env)
+                self._call_compiler_cache("show")
+                if "RDKFuncs" in targets:
+                    self._report_swig_wrapper_compile(build_start)
+                if self.config.memory_aware_jobs:
+                    self.memory_admission.print_peaks()
+                if self.config.compile_hotspots or self.config.include_costs:
+                    self.compile_unit_recorder.print_report(self._get_patched_headers())
+                if self.config.build_tool == "ninja":
+                    print_ninja_log(self.rdkit_build_path / ".ninja_log")
+            if is_clean and not self.config.pgo:
+                self._report_clean_build_time(time.time() - build_start)
         finally:
             os.chdir(_curdir)
 
+    def _is_build_tree_clean(self) -> bool:
+        """Returns whether no object of RDKit is built yet."""
+        objects = itertools.chain(
+            self.rdkit_build_path.glob("Code/**/*.o"), self.rdkit_build_path.glob("Code/**/*.obj")
+        )
+        return next(objects, None) is None
+
+    def _build_with_unity_fallback(self, targets: Sequence[str]) -> None:
+        """Builds `targets` with --fast_build.
+
+        Targets having failed compiles are listed in fast_build_excluded.txt, which makes
+        fast_build.cmake build them without unity builds and precompiled headers, and the
+        build is repeated until no more target is excluded.
+        """
+        excluded_path = self.rdkit_build_path / "fast_build_excluded.txt"
+        cmd = self._get_native_build_cmd(targets, keep_going=True)
+        while True:
+            returncode = call_subprocess(cmd, env=self.build_env, check=False)
+            if returncode == 0:
+                return
+            excluded: Set[str] = set()
+            if excluded_path.exists():
+                excluded = set(get_as_text(excluded_path).split())
+            failed: Set[str] = set()
+            for record in self.compile_unit_recorder.load("failures"):
+                m = re.search(r"CMakeFiles/([^/]+)\.dir/", record["unit"].replace("\\", "/"))
+                if m:
+                    failed.add(m.group(1))
+            failed -= excluded
+            if not failed:
+                logging.warning(f"Build failed with {returncode}.")
+                raise subprocess.CalledProcessError(returncode, cmd)
+            logging.warning(
+                f"Building {', '.join(sorted(failed))} without unity builds "
+                "and precompiled headers."
+            )
+            with open(excluded_path, "a", encoding="utf-8") as f:
+                f.write("".join(f"{target}\n" for target in sorted(failed)))
+            remove_if_exist(self.compile_unit_recorder.failures_file)
+
+    def _report_clean_build_time(self, elapsed: float) -> None:
+        """Records time of a clean build of RDKit and compares it with the other profile.
+
+        Times are kept out of the build tree, which is removed by --clean_rdkit.
+        """
+        profile = "fast_build" if self.config.fast_build else "default"
+        path = self.this_path / "clean_build_times.json"
+        times: Dict[str, Dict[str, float]] = {}
+        if path.exists():
+            with open(path, "r", encoding="utf-8") as f:
+                times = json.load(f)
+        entry = times.setdefault(str(self.rdkit_build_path), {})
+        entry[profile] = elapsed
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(times, f, indent=1)
+        print(f"Clean build of RDKit took {elapsed:.0f} s ({profile}).")
+        if "default" in entry and "fast_build" in entry:
+            speedup = entry["default"] / entry["fast_build"]
+            print(
+                f"Clean build: {entry['fast_build']:.0f} s with --fast_build, "
+                f"{entry['default']:.0f} s without ({speedup:.2f}x)."
+            )
+
+    def _get_compile_spans(self, target_dir: str, build_start: float) -> List[Tuple[float, float]]:
+        """Returns start and end in seconds of compiles for `target_dir` in the last build.
+
+        They come from .ninja_log, or from records of compile launchers with make.
+        """
+        spans: List[Tuple[float, float]] = []
+        ninja_log = self.rdkit_build_path / ".ninja_log"
+        if self.config.build_tool == "ninja" and ninja_log.exists():
+            for output, (start, end) in read_ninja_log(ninja_log).items():
+                path = self.rdkit_build_path / output
+                # entries of earlier builds are relative to other starts.
+                if target_dir in output and path.exists() and path.stat().st_mtime >= build_start:
+                    spans.append((start / 1000, end / 1000))
+        else:
+            for record in self.compile_unit_recorder.load():
+                if target_dir in record["unit"] and "end_time" in record:
+                    spans.append((record["end_time"] - record["wall_time"], record["end_time"]))
+        return spans
+
+    def _report_swig_wrapper_compile(self, build_start: float) -> None:
+        """Prints time to compile the SWIG wrapper and speed-up by splitting it."""
+        spans = self._get_compile_spans("RDKFuncs.dir", build_start)
+        if not spans:
+            logging.info(
+                "SWIG wrapper was not compiled or not measured. "
+                "Compile times are measured with ninja or --compile_hotspots."
+            )
+            return
+        elapsed = max(end for _, end in spans) - min(start for start, _ in spans)
+        total = sum(end - start for start, end in spans)
+        parts = self.config.swig_wrapper_parts
+        timings_path = self.rdkit_build_path / "swig_wrapper_timings.json"
+        timings: Dict[str, float] = {}
+        if timings_path.exists():
+            with open(timings_path, "r", encoding="utf-8") as f:
+                timings = json.load(f)
+        timings[str(parts)] = elapsed
+        with open(timings_path, "w", encoding="utf-8") as f:
+            json.dump(timings, f, indent=1)
+        print(
+            f"SWIG wrapper compiled in {elapsed:.1f} s with {parts} unit(s), "
+            f"{total:.1f} s of compile time in total."
+        )
+        if parts > 1 and "1" in timings:
+            print(f"Speed-up over one unit ({timings['1']:.1f} s): {timings['1'] / elapsed:.2f}x")
+
+    def _get_patched_headers(self) -> Set[str]:
+        """Returns headers included by patches to bakable files, like "GraphMol/Foo.h"."""
+        pat = re.compile(r"^\s*[#%]include\s*[<\"](?:\.\./)?([^>\"]+)[>\"]", re.MULTILINE)
+        headers: Set[str] = set()
+        for path in self.bakable_files:
+            if path.exists():
+                original = set(pat.findall(get_original_text(path)))
+                headers |= set(pat.findall(get_as_text(path))) - original
+        return headers
+
+    def _get_native_build_cmd(self, targets: Sequence[str], keep_going: bool = False) -> List[str]:
+        """Returns command line to build `targets` in the build tree made by cmake on Linux."""
+        if self.config.build_tool == "ninja":
+            return ["ninja"] + (["-k", "0"] if keep_going else []) + list(targets)
+        options = ["-k"] if keep_going else []
+        if self.config.memory_aware_jobs:
+            # compile launchers hold back jobs not fitting in memory.
+            return ["make", f"-j{os.cpu_count() or 1}"] + options + list(targets)
+        return ["make", "-j"] + options + list(targets)
+
     def copy_rdkit_dlls(self) -> None:
-        self._copy_dlls()
+        if self.cpu_variant:
+            self._copy_cpu_variant_dll()
+        else:
+            self._copy_dlls()
 
-    def _patch_GraphMolCSharp_i(self):
+    def _patch_GraphMolCSharp_i(self, plan: PatchPlan) -> None:
         dic: Dict[str, str] = dict()
         _line = r"%shared_ptr(RDKit::QueryOps)"
         _insert = r"%shared_ptr(RDKit::MolBundle)" + "\n"
@@ -777,15 +2840,30 @@ class NativeMaker:
         _line = r'%include "../SubstanceGroup.i"'
         _insert = r'%include "../MolEnumerator.i"'
         dic.update({_line: _insert})
-        insert_line_after(self.path_GraphMolCSharp_i, dic, make_backup=True)
+        plan.insert_line_after(self.path_GraphMolCSharp_i, dic)
         if self.config.swig_patch_enabled and self.get_rdkit_version() < 2021032:
-            replace_file_string(
+            plan.replace_file_string(
                 self.path_GraphMolCSharp_i,
                 [("boost::int32_t", "int32_t"), ("boost::uint32_t", "uint32_t")],
-                make_backup=False,  # backed up above
             )
 
-    def _patch_MolDraw2D_i(self):
+    def _include_csharp_interface(self, plan: PatchPlan, name: str) -> None:
+        """Copies files/rdkit/<name> next to GraphMolCSharp.i and includes it there."""
+        src = self.this_path / "files" / "rdkit" / name
+        dest = self.rdkit_wrapper_path / name
+        if not dest.exists() or file_digest(dest) != file_digest(src):
+            shutil.copy2(src, dest)
+        # the digest makes SWIG run again when the interface changes.
+        plan.append_text(
+            self.path_GraphMolCSharp_i, f'\n%include "{name}" // {file_digest(src)[:16]}\n'
+        )
+
+    def _patch_fingerprint_interfaces(self, plan: PatchPlan) -> None:
+        """Adds fingerprint blocks, bulk similarity and the fingerprint index to C#."""
+        for name in _fingerprint_interfaces:
+            self._include_csharp_interface(plan, name)
+
+    def _patch_MolDraw2D_i(self, plan: PatchPlan) -> None:
         dic: Dict[str, str] = dict()
         _svg_h = "<GraphMol/MolDraw2D/MolDraw2DSVG.h>"
         _cairo_h = "<GraphMol/MolDraw2D/MolDraw2DCairo.h>"
@@ -801,18 +2879,18 @@ class NativeMaker:
         _insert += "%template(Double_Vect_Vect) std::vector<std::vector<double> >;\n"
         _insert += "%template(Point3D_Const_Vect) std::vector<const RDGeom::Point3D *>;\n"
         _insert += "%template(Point3D_Val_Vect) std::vector<RDGeom::Point3D>;\n"
-        insert_line_after(self.path_MolDraw2D_i, dic, make_backup=True)
+        plan.insert_line_after(self.path_MolDraw2D_i, dic)
 
-    def _patch_MolDraw2D_h(self) -> None:
+    def _patch_MolDraw2D_h(self, plan: PatchPlan) -> None:
         dic: Dict[str, str] = dict()
         _line = r"  const MolDrawOptions &drawOptions() const { return options_; }"
         _insert = (
             r"void setDrawOptions(const RDKit::MolDrawOptions &opts) { drawOptions() = opts; }"
         )
         dic.update({_line: _insert})
-        insert_line_after(self.path_MolDraw2D_h, dic, make_backup=True)
+        plan.insert_line_after(self.path_MolDraw2D_h, dic)
 
-    def _patch_MolDescriptors_h(self) -> None:
+    def _patch_MolDescriptors_h(self, plan: PatchPlan) -> None:
         dic: Dict[str, str] = dict()
 
         _line = r"SET(CMAKE_SWIG_OUTDIR ${CMAKE_CURRENT_SOURCE_DIR}/swig_csharp )"
@@ -826,7 +2904,7 @@ class NativeMaker:
         ]
         _insert = "\n" + "\n".join(_inserts) + "\n"
         dic.update({_line: _insert})
-        insert_line_after(self._path_csharp_wrapper_CMakeLists_txt, dic, make_backup=True)
+        plan.insert_line_after(self._path_csharp_wrapper_CMakeLists_txt, dic)
 
         _line = r"#include <GraphMol/Descriptors/MolDescriptors.h>"
         _inserts = [
@@ -862,56 +2940,311 @@ class NativeMaker:
         ]
         _insert = "\n" + "\n".join(_inserts) + "\n"
         dic.update({_line: _insert})
-        insert_line_after(self.path_Descriptors_i, dic, make_backup=True)
+        plan.insert_line_after(self.path_Descriptors_i, dic)
         dic = dict()
         _line = "#include <GraphMol/Descriptors/MQN.h>"
         _insert = "#include <GraphMol/Descriptors/BCUT.h>"
         dic.update({_line: _insert})
-        insert_line_after(self.path_MolDescriptors_h, dic, make_backup=True)
+        plan.insert_line_after(self.path_MolDescriptors_h, dic)
 
-    def _patch_MolSupplier_i(self):
+    def _patch_MolSupplier_i(self, plan: PatchPlan) -> None:
         __t0 = "%extend RDKit::ForwardSDMolSupplier {\n"
         __t1 = "};\n"
-        replace_file_string(
+        plan.replace_file_string(
             self.path_MolSupplier_i,
             [
                 (__t0, "#ifdef RDK_USE_BOOST_IOSTREAMS\n" + __t0),
                 (__t1, __t1 + "#endif\n"),
             ],
-            make_backup=True,
         )
+        if self.patches_csharp_wrapper and self.get_rdkit_version() >= 2020091:
+            # MolSupplier.i is shared with Java, so the C# enumerators live in their own file.
+            self._include_csharp_interface(plan, "MultithreadedMolSupplier.i")
+        if self.patches_csharp_wrapper:
+            self._include_csharp_interface(plan, "SDFOffsetIndex.i")
 
-    def _patch_Streams_i(self):
+    def _patch_Streams_i(self, plan: PatchPlan) -> None:
         __t2 = "%extend RDKit::gzstream {\n"
         __t3 = "%include <../RDStreams/streams.h>"
-        replace_file_string(
+        plan.replace_file_string(
             self.path_Streams_i,
             [
                 (__t2, "#ifdef RDK_USE_BOOST_IOSTREAMS\n" + __t2),
                 (__t3, "#endif\n" + __t3),
             ],
-            make_backup=True,
         )
+        if self.patches_csharp_wrapper:
+            # reads gzip files without Boost.Iostreams, which gzstream above needs.
+            self._include_csharp_interface(plan, "GzipInputStream.i")
+            self._include_csharp_interface(plan, "ManagedStreams.i")
+            self._patch_csharp_wrapper_zlib(plan)
+
+    def _patch_csharp_wrapper_zlib(self, plan: PatchPlan) -> None:
+        """Links zlib, which GzipInputStream.i uses, to the wrapper."""
+        target = "${SWIG_MODULE_RDKFuncs_REAL_NAME}"
+        _lines = [
+            "",
+            "# zlib for GzipInputStream.i. Added by build_rdkit_csharp.py.",
+            "if(NOT ZLIB_LIBRARIES)",
+            "  find_package(ZLIB REQUIRED)",
+            "endif()",
+            f"target_include_directories({target} PRIVATE ${{ZLIB_INCLUDE_DIRS}})",
+            f"target_link_libraries({target} ${{ZLIB_LIBRARIES}})",
+        ]
+        plan.append_text(self._path_csharp_wrapper_CMakeLists_txt, "\n".join(_lines) + "\n")
 
-    def _patch_i_files(self):
-        if self.config.target_lang == LangType.CSharp:
+    @property
+    def patch_ledger(self) -> PatchLedger:
+        return PatchLedger(self.rdkit_path / "build_rdkit_csharp.patches.json")
+
+    def _patch_csharp_wrapper_split(self, plan: PatchPlan) -> None:
+        """Compiles the SWIG wrapper of RDKFuncs in parts sharing a precompiled header."""
+        parts = self.config.swig_wrapper_parts
+        target = "${SWIG_MODULE_RDKFuncs_REAL_NAME}"
+        script = f'"{Path(sys.executable).as_posix()}" "{Path(__file__).resolve().as_posix()}"'
+        _lines = [
+            "",
+            f"# Compile SWIG wrapper in {parts} parts. Added by build_rdkit_csharp.py.",
+            f"get_target_property(_wrap_sources {target} SOURCES)",
+            'list(FILTER _wrap_sources INCLUDE REGEX "_wrap\\\\.(cxx|cpp)$")',
+            "if(_wrap_sources)",
+            "  list(GET _wrap_sources 0 _wrap_cxx)",
+            '  set(_wrap_prefix "${CMAKE_CURRENT_BINARY_DIR}/RDKFuncs_wrap")',
+            "  set(_wrap_parts)",
+            f"  foreach(_i RANGE {parts - 1})",
+            '    list(APPEND _wrap_parts "${_wrap_prefix}_part${_i}.cxx")',
+            "  endforeach()",
+            "  add_custom_command(",
+            '    OUTPUT ${_wrap_parts} "${_wrap_prefix}_common.h"',
+            f"    COMMAND {script} split_swig_wrapper",
+            f'      "${{_wrap_cxx}}" {parts} "${{_wrap_prefix}}"',
+            '    DEPENDS "${_wrap_cxx}"',
+            f'    COMMENT "Splitting SWIG wrapper into {parts} parts")',
+            f"  get_target_property(_all_sources {target} SOURCES)",
+            '  list(REMOVE_ITEM _all_sources "${_wrap_cxx}")',
+            f"  set_property(TARGET {target} PROPERTY SOURCES",
+            '    ${_all_sources} ${_wrap_parts} "${_wrap_prefix}_common.h")',
+            "  if(COMMAND target_precompile_headers)",
+            f'    target_precompile_headers({target} PRIVATE "${{_wrap_prefix}}_common.h")',
+            "    # the first part defines what the common header declares.",
+            '    set_source_files_properties("${_wrap_prefix}_part0.cxx"',
+            "      PROPERTIES SKIP_PRECOMPILE_HEADERS ON)",
+            "  endif()",
+            "endif()",
+        ]
+        plan.append_text(self._path_csharp_wrapper_CMakeLists_txt, "\n".join(_lines) + "\n")
+
+    @property
+    def swig_cache_path(self) -> Path:
+        """Returns directory of outputs of SWIG memoized by --swig_cache. It survives --clean."""
+        return self.this_path / "swig_cache"
+
+    def _patch_csharp_wrapper_swig_cache(self, plan: PatchPlan) -> None:
+        """Runs custom commands of the SWIG wrapper through swig_launcher to memoize SWIG."""
+        if get_os() == "win":
+            # Visual Studio generators ignore rule launchers.
+            logging.warning("--swig_cache is not supported with Visual Studio.")
+            return
+        launcher = (
+            f'"{Path(sys.executable).as_posix()}" "{Path(__file__).resolve().as_posix()}" '
+            f'swig_launcher "{self.swig_cache_path.as_posix()}"'
+        )
+        _lines = [
+            "",
+            "# Memoize SWIG runs. Added by build_rdkit_csharp.py.",
+            f"set_property(DIRECTORY PROPERTY RULE_LAUNCH_CUSTOM {to_cmake_string(launcher)})",
+        ]
+        plan.append_text(self._path_csharp_wrapper_CMakeLists_txt, "\n".join(_lines) + "\n")
+
+    @property
+    def patches_csharp_wrapper(self) -> bool:
+        """Whether the C# wrapper is patched.
+
+        A shared core build tree always has it patched, or builds for Java would revert the
+        patches and make the next C# build run SWIG again.
+        """
+        return self.config.target_lang == LangType.CSharp or self.config.shared_core
+
+    def _patch_i_files(self) -> None:
+        plan = PatchPlan()
+        if self.patches_csharp_wrapper:
             if self.config.more_functions:
-                self._patch_GraphMolCSharp_i()
-        self._patch_MolDraw2D_i()
-        self._patch_MolDraw2D_h()
+                self._patch_GraphMolCSharp_i(plan)
+            self._patch_fingerprint_interfaces(plan)
+        self._patch_MolDraw2D_i(plan)
+        self._patch_MolDraw2D_h(plan)
         if self.config.more_functions:
-            self._patch_MolDescriptors_h()
-        self._patch_MolSupplier_i()
-        self._patch_Streams_i()
-
-    def _make_rdkit_cmake(self) -> Sequence[str]:
-        cmd: List[str] = self._get_cmake_rdkit_cmd_line()
+            self._patch_MolDescriptors_h(plan)
+        # GzipInputStream.i is included before MultithreadedMolSupplier.i using it.
+        self._patch_Streams_i(plan)
+        self._patch_MolSupplier_i(plan)
+        if self.patches_csharp_wrapper and self.config.swig_wrapper_parts > 1:
+            self._patch_csharp_wrapper_split(plan)
+        if self.patches_csharp_wrapper and self.config.swig_cache:
+            self._patch_csharp_wrapper_swig_cache(plan)
+        changed = plan.apply(self.bakable_files, self.patch_ledger, from_bak=True)
+        if not changed:
+            logging.info("Patched files are up to date.")
+        for target in self._get_invalidated_targets(changed):
+            logging.info(f"Invalidated by patches: {target}")
+
+    def _get_invalidated_targets(self, changed: Iterable[Path]) -> List[str]:
+        """Returns downstream build targets which are rebuilt because of `changed` files."""
+        targets: List[str] = []
+        for path in changed:
+            if path.suffix == ".i":
+                targets.append(f"SWIG generation and compile of the wrapper ({path.name})")
+            elif path.name == "CMakeLists.txt":
+                targets.append(f"CMake configure and SWIG generation ({path})")
+            elif path.suffix == ".h":
+                targets.append(f"RDKit libraries and SWIG wrapper including {path.name}")
+            else:
+                targets.append(f"RDKit library of {path.parent.name} ({path.name})")
+        return list(dict.fromkeys(targets))
+
+    def _make_rdkit_cmake(self, pgo_phase: Optional[PgoPhase] = None) -> Sequence[str]:
+        cmake_cache = self.rdkit_build_path / "CMakeCache.txt"
+        if get_os() == "linux" and cmake_cache.exists():
+            generator = read_cmake_cache(cmake_cache).get("CMAKE_GENERATOR")
+            expected = self.g_option_of_cmake[0][len("-G") :].strip('"')
+            if generator and generator != expected:
+                raise RuntimeError(
+                    f"{self.rdkit_build_path} is configured for {generator}. "
+                    "Execute with --clean_rdkit to change the generator."
+                )
+        cmd: List[str] = self._get_cmake_rdkit_cmd_line(pgo_phase)
         if get_os() == "win":
             cmd = [a.replace("\\", "/") for a in cmd]
-        call_subprocess(cmd)
+        fingerprint = self._get_configure_fingerprint(cmd)
+        stamp_path = self.rdkit_build_path / "configure_fingerprint.txt"
+        if cmake_cache.exists() and stamp_path.exists() and get_as_text(stamp_path) == fingerprint:
+            logging.info(f"Configure of {self.rdkit_build_path} is up to date.")
+            return cmd
+        remove_if_exist(stamp_path)
+        preseed_path = self.cmake_preseed_path / f"{fingerprint}.cmake"
+        if not cmake_cache.exists() and preseed_path.exists():
+            # a fresh cache is seeded with what the last configure of the same inputs found.
+            logging.info(f"Configure is preseeded from {preseed_path}.")
+            call_subprocess(cmd[:2] + ["-C", str(preseed_path)] + cmd[2:], env=self.build_env)
+        else:
+            call_subprocess(cmd, env=self.build_env)
+        self._save_cmake_preseed(cmake_cache, preseed_path)
+        with open(stamp_path, "w", encoding="utf-8") as f:
+            f.write(fingerprint)
         return cmd
 
-    def _get_cmake_rdkit_cmd_line(self) -> List[str]:
+    @property
+    def cmake_preseed_path(self) -> Path:
+        """Returns directory of initial caches of cmake. It survives --clean_rdkit."""
+        return self.this_path / "cmake_preseed"
+
+    def _get_configure_fingerprint(self, cmd: Sequence[str]) -> str:
+        """Returns digest of the cmake command line and the inputs of configuring RDKit."""
+        return ArtifactStore.make_key(
+            cmd,
+            self.build_env,
+            {name: os.environ.get(name) for name in _configure_env_vars},
+            get_toolchain_id(),
+            tree_digest(self.rdkit_path, (".cmake",), names=("CMakeLists.txt",)),
+            tree_digest(self.this_path / "files" / "rdkit", (".cmake",)),
+        )
+
+    def _save_cmake_preseed(self, cmake_cache: Path, preseed_path: Path) -> None:
+        """Writes packages found and features checked in `cmake_cache` as an initial cache.
+
+        Options given by the command line and paths which no longer exist are left out.
+        """
+        lines: List[str] = []
+        for name, (type_, value) in sorted(read_cmake_cache_entries(cmake_cache).items()):
+            if value.endswith("NOTFOUND"):
+                continue
+            if type_ == "INTERNAL":
+                if not re.match(r"^(CMAKE_)?HAVE_", name):
+                    continue
+            elif type_ not in ("FILEPATH", "PATH") or name.startswith("CMAKE_"):
+                continue
+            elif not os.path.exists(value):
+                continue
+            lines.append(f'set({name} {to_cmake_string(value)} CACHE {type_} "")\n')
+        preseed_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = preseed_path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("# Generated by build_rdkit_csharp.py from the cache of a configure.\n")
+            f.writelines(lines)
+        os.replace(tmp_path, preseed_path)
+
+    def _get_pgo_flags(self, pgo_phase: Optional[PgoPhase]) -> List[str]:
+        """Returns flags to instrument RDKit or to optimize it with profiles of --pgo."""
+        if pgo_phase is None:
+            return []
+        profile_path = self.pgo_profile_path.as_posix()
+        if pgo_phase == "generate":
+            return [f"-fprofile-generate={profile_path}"]
+        if is_clang_toolchain():
+            return [f"-fprofile-use={profile_path}/default.profdata"]
+        # objects not run by the workload have no profile, and counters of threads race.
+        return [f"-fprofile-use={profile_path}", "-fprofile-correction", "-Wno-missing-profile"]
+
+    def _get_flag_args(self, pgo_phase: Optional[PgoPhase]) -> List[str]:
+        """Returns cmake options of compile and link flags of --pgo and link optimizations."""
+        if get_os() == "win":
+            # MSVC links with /LTCG and removes unreferenced code by default.
+            return [
+                "-DCMAKE_POLICY_DEFAULT_CMP0069=NEW",
+                f"-DCMAKE_INTERPROCEDURAL_OPTIMIZATION={to_on_off(self.config.lto != 'none')}",
+            ]
+        compile_flags = self._get_pgo_flags(pgo_phase)
+        if self.cpu_variant:
+            compile_flags.append(f"-march={self.cpu_variant}")
+        link_flags = list(compile_flags)
+        args: List[str] = []
+        if self.config.lto == "none":
+            args += ["-UCMAKE_AR", "-UCMAKE_RANLIB"]
+        else:
+            if is_clang_toolchain():
+                compile_flags.append(f"-flto={self.config.lto}")
+                link_flags.append(f"-flto={self.config.lto}")
+                ar, ranlib = "llvm-ar", "llvm-ranlib"
+            else:
+                if self.config.lto == "thin":
+                    logging.warning("ThinLTO needs Clang. GCC uses its partitioned LTO instead.")
+                compile_flags += ["-flto", "-fno-fat-lto-objects"]
+                link_flags.append(f"-flto={self.config.jobs}")
+                # static libraries of LTO objects need the archiver with the LTO plugin.
+                ar, ranlib = "gcc-ar", "gcc-ranlib"
+            args += [
+                f"-DCMAKE_AR={shutil.which(ar) or ar}",
+                f"-DCMAKE_RANLIB={shutil.which(ranlib) or ranlib}",
+            ]
+        if self.config.linker != "bfd":
+            link_flags.append(f"-fuse-ld={self.config.linker}")
+        if self.config.gc_sections:
+            compile_flags += ["-ffunction-sections", "-fdata-sections"]
+            link_flags.append("-Wl,--gc-sections")
+        if self.config.split_debug:
+            # the linker does not copy debug info left in .dwo files.
+            compile_flags += ["-g", "-gsplit-dwarf"]
+        cmake_cache = self.rdkit_build_path / "CMakeCache.txt"
+        cached = read_cmake_cache(cmake_cache) if cmake_cache.exists() else {}
+        flag_vars = [
+            ("CMAKE_C_FLAGS", "CFLAGS", compile_flags),
+            ("CMAKE_CXX_FLAGS", "CXXFLAGS", compile_flags),
+            *(
+                (f"CMAKE_{kind}_LINKER_FLAGS", "LDFLAGS", link_flags)
+                for kind in ("SHARED", "MODULE", "EXE")
+            ),
+        ]
+        for var, env, flags in flag_vars:
+            # CMake initializes the flags from the environment, which are kept.
+            env_flags = os.environ.get(env, "").split()
+            if flags:
+                args.append(f"-D{var}={' '.join(env_flags + flags)}")
+            elif var in cached and cached[var].split() != env_flags:
+                # resets flags set by a previous configure.
+                args.append(f"-U{var}")
+        return args
+
+    def _get_cmake_rdkit_cmd_line(self, pgo_phase: Optional[PgoPhase] = None) -> List[str]:
         def f_test() -> str:
             return to_on_off(self.config.test_enabled)
 
@@ -924,7 +3257,25 @@ class NativeMaker:
         args = [f"{str(self.rdkit_path)}"]
         args += ["-Wdev"]
         args += self.g_option_of_cmake
-        if self.config.target_lang == LangType.CPlusPlus:
+        args += self._get_compiler_launcher_args()
+        args += self._get_flag_args(pgo_phase)
+        if self.config.fast_build:
+            fast_build_cmake = self.this_path / "files" / "rdkit" / "fast_build.cmake"
+            args += [
+                f"-DCMAKE_PROJECT_RDKit_INCLUDE={fast_build_cmake.as_posix()}",
+                f"-DCMAKE_UNITY_BUILD_BATCH_SIZE={self.config.unity_batch_size}",
+            ]
+        else:
+            args += ["-UCMAKE_PROJECT_RDKit_INCLUDE"]
+        if self.config.shared_core:
+            # the core libraries are built once and each target builds its own wrapper.
+            args += [
+                "-DRDK_BUILD_SWIG_WRAPPERS=ON",
+                "-DRDK_BUILD_SWIG_CSHARP_WRAPPER=ON",
+                "-DRDK_BUILD_SWIG_JAVA_WRAPPER=ON",
+                "-DRDK_BUILD_PYTHON_WRAPPERS=OFF",
+            ]
+        elif self.config.target_lang == LangType.CPlusPlus:
             args += [
                 "-DRDK_BUILD_SWIG_WRAPPERS=OFF",
                 "-DRDK_BUILD_SWIG_CSHARP_WRAPPER=OFF",
@@ -1058,11 +3409,20 @@ class NativeMaker:
             raise RuntimeError
         return a
 
+    def _get_dependent_lib_paths(self) -> List[Path]:
+        # pick up dependent DLLs in buildlinux*CSharp/lib or buildwin*CSharp\bin\Release
+        if get_os() == "win":
+            return list((self.rdkit_build_path / "bin" / "Release").glob("*.dll"))
+        if get_os() == "linux":
+            return list((self.rdkit_build_path / "lib").glob("*.so.1"))
+        raise RuntimeError
+
     def _copy_dlls(self) -> None:
         assert self.build_platform
         dll_dest_path = self.rdkit_wrapper_path / get_os() / self.build_platform
-        remove_if_exist(dll_dest_path)
-        os.makedirs(dll_dest_path)
+        dll_dest_path.mkdir(parents=True, exist_ok=True)
+        # RDKFuncs of CPU variants are owned by their copy_dlls stages.
+        remove_by_pattern(dll_dest_path, self.cpu_variant_dll_pattern, delete_on_match=False)
         logging.info(f"Copy DLLs to {dll_dest_path}.")
 
         files_to_copy: List[Union[str, PathLike]] = []
@@ -1070,17 +3430,7 @@ class NativeMaker:
         if self.config.target_lang == LangType.CSharp:
             files_to_copy.append(self.get_RDKFuncs_dll_path())
 
-        # pick up dependent DLLs in buildlinux*CSharp/lib or buildwin*CSharp\bin\Release
-        if get_os() == "win":
-            lib_path = self.rdkit_build_path / "bin" / "Release"
-            for file_path in lib_path.glob("*.dll"):
-                files_to_copy.append(file_path)
-        elif get_os() == "linux":
-            lib_path = self.rdkit_build_path / "lib"
-            for file_path in lib_path.glob("*.so.1"):
-                files_to_copy.append(file_path)
-        else:
-            raise RuntimeError
+        files_to_copy += self._get_dependent_lib_paths()
 
         if not self.config.use_static_libs:
             if get_os() == "win":
@@ -1126,6 +3476,133 @@ class NativeMaker:
         for path in files_to_copy:
             shutil.copy2(path, dll_dest_path)
 
+        if self.config.split_debug and get_os() == "linux":
+            self._split_debug_info(dll_dest_path)
+        if self.measures_links:
+            self._report_link_measurements(dll_dest_path)
+
+    @property
+    def cpu_variant_dll_pattern(self) -> str:
+        """Returns pattern of names of RDKFuncs of CPU variants and their debug info."""
+        src = self.get_RDKFuncs_dll_path()
+        variants = "|".join(re.escape(v) for v in typing.get_args(CpuVariant))
+        return rf"^{re.escape(src.stem)}\.({variants}){re.escape(src.suffix)}(\.debug)?$"
+
+    def _get_cpu_variant_dll_dest_paths(self) -> List[Path]:
+        """Returns RDKFuncs of the CPU variant copied, and its debug info if split."""
+        assert self.build_platform and self.cpu_variant
+        dll_dest_path = self.rdkit_wrapper_path / get_os() / self.build_platform
+        src = self.get_RDKFuncs_dll_path()
+        dest = dll_dest_path / f"{src.stem}.{self.cpu_variant}{src.suffix}"
+        if not self.config.split_debug:
+            return [dest]
+        return [dest, dll_dest_path.parent / f"{self.build_platform}.debug" / f"{dest.name}.debug"]
+
+    def _copy_cpu_variant_dll(self) -> None:
+        """Copies RDKFuncs of the CPU variant next to the baseline, e.g. RDKFuncs.x86-64-v3.so.
+
+        DllImportResolver of RDKFuncsPINVOKE_Loader.cs loads the best one the CPU supports.
+        """
+        src = self.get_RDKFuncs_dll_path()
+        dest, *debug_files = self._get_cpu_variant_dll_dest_paths()
+        logging.info(f"Copy {src} to {dest}.")
+        shutil.copy2(src, dest)
+        for debug_file in debug_files:
+            debug_file.parent.mkdir(exist_ok=True)
+            call_subprocess(["objcopy", "--only-keep-debug", str(dest), str(debug_file)])
+            call_subprocess(
+                ["objcopy", "--strip-debug", f"--add-gnu-debuglink={debug_file}", str(dest)]
+            )
+
+    def _split_debug_info(self, dll_dest_path: Path) -> None:
+        """Moves debug info of copied binaries out of `dll_dest_path`, which is packaged."""
+        debug_path = dll_dest_path.parent / f"{self.build_platform}.debug"
+        debug_path.mkdir(exist_ok=True)
+        pattern = self.cpu_variant_dll_pattern
+        remove_by_pattern(debug_path, pattern, delete_on_match=False)
+        # RDKFuncs of CPU variants are split by their copy_dlls stages.
+        paths = [p for p in sorted(dll_dest_path.iterdir()) if not re.match(pattern, p.name)]
+        if shutil.which("dwp"):
+            # packs .dwo files of the build tree, which are not linked.
+            run_subprocesses(
+                [
+                    SubprocessJob(
+                        ["dwp", "-e", str(path), "-o", str(debug_path / f"{path.name}.dwp")],
+                        name=f"dwp {path.name}",
+                    )
+                    for path in paths
+                ],
+                check=False,
+            )
+        # binaries are independent of each other.
+        run_subprocesses(
+            [
+                SubprocessJob(
+                    [
+                        "objcopy",
+                        "--only-keep-debug",
+                        str(path),
+                        str(debug_path / f"{path.name}.debug"),
+                    ],
+                    name=f"objcopy {path.name}",
+                )
+                for path in paths
+            ]
+        )
+        run_subprocesses(
+            [
+                SubprocessJob(
+                    [
+                        "objcopy",
+                        "--strip-debug",
+                        f"--add-gnu-debuglink={debug_path / f'{path.name}.debug'}",
+                        str(path),
+                    ],
+                    name=f"objcopy {path.name}",
+                )
+                for path in paths
+            ]
+        )
+
+    def _report_link_measurements(self, dll_dest_path: Path) -> None:
+        """Records link times and sizes of copied binaries by link optimizations and compares.
+
+        Measurements are kept out of the build tree, which is removed by --clean_rdkit.
+        """
+        link_times: Dict[str, float] = {}
+        for record in self.compile_unit_recorder.load("links"):
+            name = os.path.basename(record["unit"])
+            link_times[name] = link_times.get(name, 0.0) + record["wall_time"]
+        sizes = {p.name: p.stat().st_size for p in sorted(dll_dest_path.iterdir())}
+        main_name = self.get_RDKFuncs_dll_path().name
+        path = self.this_path / "link_measurements.json"
+        measurements: Dict[str, Dict[str, Dict]] = {}
+        if path.exists():
+            with open(path, "r", encoding="utf-8") as f:
+                measurements = json.load(f)
+        variants = measurements.setdefault(str(self.rdkit_build_path), {})
+        if link_times:
+            variants[self.link_variant] = {"link_times": link_times, "sizes": sizes}
+        else:
+            # restored from the artifact store, or linker launchers need CMake 3.21 or later.
+            logging.warning("No link of RDKit is measured.")
+            variants[self.link_variant] = {
+                **variants.get(self.link_variant, {"link_times": {}}),
+                "sizes": sizes,
+            }
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(measurements, f, indent=1)
+        print(f"Link times and sizes of {dll_dest_path}:")
+        print(f"{'link[s]':>9s} {'all[s]':>9s} {'size[KiB]':>10s} {'all[KiB]':>10s}  variant")
+        for variant, m in sorted(variants.items()):
+            main_time = m["link_times"].get(main_name)
+            print(
+                (f"{main_time:9.1f} " if main_time is not None else f"{'-':>9s} ")
+                + f"{sum(m['link_times'].values()):9.1f} "
+                + f"{m['sizes'].get(main_name, 0) // 1024:10d} "
+                + f"{sum(m['sizes'].values()) // 1024:10d}  {variant}"
+            )
+
     def build_wrapper(self) -> None:
         if self.config.target_lang == LangType.CSharp:
             self._patch_rdkit_swig_created_files()
@@ -1136,70 +3613,101 @@ class NativeMaker:
             _curdir = os.path.abspath(os.curdir)
             os.chdir(self.rdkit_build_path)
             try:
-                cmd = ["make", "-j", "GraphMolWrapJar"]
-                call_subprocess(cmd)
+                cmd = self._get_native_build_cmd(["GraphMolWrapJar"])
+                call_subprocess(cmd, env=self.build_env)
             finally:
                 os.chdir(_curdir)
         else:
             pass
 
-    def _patch_rdkit_swig_created_files(self) -> None:
+    def _get_swig_patch_plan(self) -> PatchPlan:
+        plan = PatchPlan()
         # Customize the followings if required.
         if self.config.swig_patch_enabled:
-            swig_patches: List[Tuple[Path, Sequence[Tuple[str, str]]]] = []
             if self.get_rdkit_version() < 2021032:
-                swig_patches += [
-                    (
-                        # extract BOOST_BINARY.
-                        self.rdkit_swig_csharp_path / "PropertyPickleOptions.cs",
-                        [("BOOST_BINARY\\(\\s*([01]+)\\s*\\)", "0b\\1")],
-                    ),
-                    (
-                        # remove dupulicated methods.
-                        self.rdkit_swig_csharp_path / "RDKFuncs.cs",
-                        [
-                            (
-                                "public static double DiceSimilarity\\([^\\}]*\\."
-                                "DiceSimilarity__SWIG_(12|13|14)\\([^\\}]*\\}",
-                                "",
-                            )
-                        ],
-                    ),
-                ]
-            swig_patches += [
-                (
-                    self.rdkit_swig_csharp_path / "CXSmilesFields.cs",
+                # extract BOOST_BINARY.
+                plan.replace_line_string(
+                    self.rdkit_swig_csharp_path / "PropertyPickleOptions.cs",
+                    [("BOOST_BINARY\\(\\s*([01]+)\\s*\\)", "0b\\1")],
+                )
+                # remove dupulicated methods.
+                plan.replace_block_string(
+                    self.rdkit_swig_csharp_path / "RDKFuncs.cs",
+                    "public static double DiceSimilarity\\(",
+                    "\\}",
                     [
                         (
-                            "std\\:\\:numeric_limits\\<\\s*std\\:\\:int32_t\\s*\\>\\:\\:max\\(\\)",
-                            "0x7fffffff",
+                            "public static double DiceSimilarity\\([^\\}]*\\."
+                            "DiceSimilarity__SWIG_(12|13|14)\\([^\\}]*\\}",
+                            "",
                         )
                     ],
                 )
-            ]
-            for filepath, patterns in swig_patches:
-                replace_file_string(filepath, patterns, make_backup=False)
-
-        for filepath, patterns in (
-            (
-                self.rdkit_swig_csharp_path / "RDKFuncsPINVOKE.cs",
-                [("(partial )?class RDKFuncsPINVOKE\\s*\\{", "partial class RDKFuncsPINVOKE {")],
-            ),
-            (
-                self.rdkit_swig_csharp_path / "RDKFuncsPINVOKE.cs",
+            plan.replace_line_string(
+                self.rdkit_swig_csharp_path / "CXSmilesFields.cs",
                 [
                     (
-                        "static SWIGExceptionHelper\\(\\)\\s*\\{",
-                        "static SWIGExceptionHelper() { RDKFuncsPINVOKE.LoadDll();",
+                        "std\\:\\:numeric_limits\\<\\s*std\\:\\:int32_t\\s*\\>\\:\\:max\\(\\)",
+                        "0x7fffffff",
                     )
                 ],
-            ),
-        ):
-            replace_file_string(filepath, patterns, make_backup=False)
-        shutil.copy2(
-            self.this_path / "files" / "rdkit" / "RDKFuncsPINVOKE_Loader.cs",
-            self.rdkit_swig_csharp_path,
+            )
+        plan.replace_line_string(
+            self.rdkit_swig_csharp_path / "RDKFuncsPINVOKE.cs",
+            [
+                # starts with literal to be fast.
+                (
+                    "class RDKFuncsPINVOKE(?<!partial class RDKFuncsPINVOKE)\\s*\\{",
+                    "partial class RDKFuncsPINVOKE {",
+                ),
+                (
+                    "static SWIGExceptionHelper\\(\\)\\s*\\{",
+                    "static SWIGExceptionHelper() { RDKFuncsPINVOKE.LoadDll();",
+                ),
+            ],
         )
+        return plan
+
+    def benchmark_swig_patch(self) -> None:
+        """Compares the whole-text and streaming post-processing of SWIG generated files.
+
+        Both run on copies of the generated files in separate processes to measure their
+        peak RSS.
+        """
+        plan = self._get_swig_patch_plan()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            outputs: Dict[str, PatchPlan] = {}
+            for mode, streaming in (("whole_text", False), ("streaming", True)):
+                dest = Path(tmp_dir) / mode
+                outputs[mode] = plan.relocate(self.rdkit_swig_csharp_path, dest)
+                for filename in plan.patches:
+                    if filename.exists():
+                        dest_filename = dest / filename.relative_to(self.rdkit_swig_csharp_path)
+                        dest_filename.parent.mkdir(parents=True, exist_ok=True)
+                        shutil.copy2(filename, dest_filename)
+                size_mb = sum(f.stat().st_size for f in dest.rglob("*.cs")) / (1 << 20)
+                with ProcessPoolExecutor(max_workers=1) as executor:
+                    elapsed, peak_mb = executor.submit(
+                        _run_swig_patch_benchmark, outputs[mode], streaming, self.config.jobs
+                    ).result()
+                print(
+                    f"{mode}: {size_mb:.1f} MiB of C# patched in {elapsed:.2f} s, "
+                    f"peak RSS {peak_mb:.0f} MiB"
+                )
+            for filename in plan.patches:
+                if filename.exists():
+                    rel = filename.relative_to(self.rdkit_swig_csharp_path)
+                    whole_text = Path(tmp_dir) / "whole_text" / rel
+                    streaming = Path(tmp_dir) / "streaming" / rel
+                    if file_digest(whole_text) != file_digest(streaming):
+                        logging.warning(f"Outputs of {rel} differ between the modes.")
+
+    def _patch_rdkit_swig_created_files(self) -> None:
+        # Files are patched only when SWIG regenerated them since the last patch.
+        plan = self._get_swig_patch_plan()
+        plan.apply([], self.patch_ledger, from_bak=False, jobs=self.config.jobs)
+        for name in ("RDKFuncsPINVOKE_Loader.cs", "FingerprintBlocks.cs", "ManagedStreams.cs"):
+            shutil.copy2(self.this_path / "files" / "rdkit" / name, self.rdkit_swig_csharp_path)
 
     def _prepare_RDKitDotNet_folder(self):
         remove_if_exist(self.path_RDKit2DotNet_folder)
@@ -1293,6 +3801,26 @@ class NativeMaker:
         finally:
             os.chdir(_pushd_build_wrapper)
 
+    def get_RDKit2DotNet_dll_paths(self) -> List[Path]:
+        """Returns RDKit2DotNet.dll built by build_wrapper for each target framework."""
+        project = load_msbuild_xml(
+            self.this_path / "files" / "rdkit" / "RDKit2DotNet" / "RDKit2DotNet.csproj"
+        ).getroot()
+        frameworks = get_elem(list(get_elems(project, "PropertyGroup"))[0], "TargetFrameworks")
+        return [
+            self.path_RDKit2DotNet_folder / "bin" / "Release" / framework / "RDKit2DotNet.dll"
+            for framework in (frameworks.text or "").split(";")
+            if framework
+        ]
+
+    def get_nupkg_path(self) -> Path:
+        return (
+            self.path_RDKit2DotNet_folder
+            / "bin"
+            / "Release"
+            / f"{project_name}.{self.get_version_for_nuget()}.nupkg"
+        )
+
     def build_nuget_package(self) -> None:
         dll_basenames_dic = self._make_dll_basenames_dic()
         self._prepare_nuspec_file(dll_basenames_dic)
@@ -1452,6 +3980,7 @@ class NativeMaker:
         if self.config.rdkit_path:
             for path in self.bakable_files:
                 restore_from_bak(path)
+            remove_if_exist(self.patch_ledger.path)
 
             # for C#
             for p in (
@@ -1462,6 +3991,7 @@ class NativeMaker:
                     "Properties",
                     "packages",
                 ]
+                + [p.name for p in (self.this_path / "files" / "rdkit").glob("*.i")]
                 + list(typing.get_args(SupportedSystem))
                 + list(self.test_csprojects)
                 + list(self.test_sln_names)
@@ -1474,9 +4004,11 @@ class NativeMaker:
             # build dir
             for _os in typing.get_args(SupportedSystem):
                 for p in typing.get_args(CpuModel):
-                    remove_if_exist(self.rdkit_path / f"build{_os}{p}CSharp")
-                    remove_if_exist(self.rdkit_path / f"build{_os}{p}java")
-                    remove_if_exist(self.rdkit_path / f"build{_os}{p}cpp")
+                    for lang in ("CSharp", "java", "cpp", "Shared"):
+                        remove_if_exist(self.rdkit_path / f"build{_os}{p}{lang}")
+                    for v in typing.get_args(CpuVariant):
+                        remove_if_exist(self.rdkit_path / f"build{_os}{p}CSharp_{v}")
+                        remove_if_exist(self.rdkit_path / f"build{_os}{p}Shared_{v}")
 
             # libs for copy dlls
             for wrapper_name in ("gmwrapper", "csharp_wrapper"):
@@ -1512,6 +4044,340 @@ class NativeMaker:
             remove_if_exist(self.cairo_path / "vc2017")
 
 
+class StageTarget:
+    """Files a stage reads and writes, to skip the stage while its outputs are up to date.
+
+    A stamp written when the stage succeeds records `key`, which identifies the options
+    of the stage. The stage runs again when the key changes, an output is missing or an
+    input is modified after the stamp, as make compares times of targets.
+    """
+
+    def __init__(
+        self,
+        stamp_path: Path,
+        key: str,
+        inputs: Callable[[], Iterable[Path]],
+        outputs: Callable[[], Iterable[Path]],
+    ):
+        self.stamp_path: Path = stamp_path
+        self.key: str = key
+        self.inputs: Callable[[], Iterable[Path]] = inputs
+        self.outputs: Callable[[], Iterable[Path]] = outputs
+
+    def get_stale_reason(self) -> Optional[str]:
+        """Returns why the stage has to run, or None if it is up to date."""
+        if not self.stamp_path.exists():
+            return "not built yet"
+        if get_as_text(self.stamp_path) != self.key:
+            return "options changed"
+        for path in self.outputs():
+            if not path.exists():
+                return f"{path} is missing"
+        stamp_time = self.stamp_path.stat().st_mtime
+        for path in self.inputs():
+            if path.exists() and path.stat().st_mtime > stamp_time:
+                return f"{path} is newer"
+        return None
+
+    def record(self) -> None:
+        self.stamp_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.stamp_path, "w", encoding="utf-8") as f:
+            f.write(self.key)
+
+
+class BuildStage:
+    def __init__(
+        self,
+        name: str,
+        action: Callable[[], object],
+        depends: Iterable[str] = (),
+        cost: int = 1,
+        target: Optional[StageTarget] = None,
+    ):
+        self.name: str = name
+        self.action: Callable[[], object] = action
+        self.depends: List[str] = list(depends)
+        self.cost: int = cost
+        self.target: Optional[StageTarget] = target
+        self.start_time: Optional[float] = None
+        self.end_time: Optional[float] = None
+
+    @property
+    def duration(self) -> float:
+        if self.start_time is None or self.end_time is None:
+            return 0.0
+        return self.end_time - self.start_time
+
+
+def _init_stage_worker(cancel_event: EventType) -> None:
+    global _cancel_event
+    _cancel_event = cancel_event
+
+
+def run_stage_action(
+    name: str,
+    action: Callable[[], object],
+    log_dir: Optional[Path] = None,
+    timeout: Optional[float] = None,
+) -> List[Dict[str, object]]:
+    """Runs `action` as stage `name` and returns records of its subprocesses.
+
+    Output of the subprocesses is written to `<name>.log.gz` in `log_dir`, and each of them
+    is killed after `timeout` seconds. Records are attached to the exception as
+    `subprocess_records` if `action` fails.
+    """
+    global _current_stage, _stage_log_path, _command_timeout
+    _current_stage = name
+    _command_timeout = timeout
+    _stage_log_path = None
+    if log_dir is not None:
+        log_dir.mkdir(parents=True, exist_ok=True)
+        _stage_log_path = log_dir / (re.sub(r"[^\w.-]", "_", name) + ".log.gz")
+        remove_if_exist(_stage_log_path)
+    _subprocess_records.clear()
+    try:
+        action()
+    except BaseException as e:
+        e.subprocess_records = list(_subprocess_records)  # type: ignore
+        raise
+    finally:
+        _current_stage = None
+        _stage_log_path = None
+        _command_timeout = None
+    return list(_subprocess_records)
+
+
+class StageScheduler:
+    """Runs build stages along their dependency graph.
+
+    Stages whose dependencies are done run at the same time as long as the sum of their
+    costs fits in the job budget. Each stage runs in a worker process because stages
+    change the current directory. Stages with targets are skipped while up to date,
+    unless `force`. Commands of the other running stages are killed when a stage fails.
+    """
+
+    def __init__(
+        self,
+        max_jobs: int,
+        force: bool = False,
+        log_dir: Optional[Path] = None,
+        timeout: Optional[float] = None,
+    ):
+        self.max_jobs: int = max(1, max_jobs)
+        self.force: bool = force
+        # per-stage logs of commands and their timeout in seconds.
+        self.log_dir: Optional[Path] = log_dir
+        self.timeout: Optional[float] = timeout
+        self.stages: Dict[str, BuildStage] = {}
+        self.start_time: Optional[float] = None
+        self.end_time: Optional[float] = None
+        self.records: List[Dict[str, object]] = []
+
+    def add(
+        self,
+        name: str,
+        action: Callable[[], object],
+        depends: Iterable[Optional[str]] = (),
+        cost: int = 1,
+        target: Optional[StageTarget] = None,
+    ) -> str:
+        """Adds a stage. Dependencies have to be added before.
+
+        Args:
+            name (str): Unique name of the stage.
+            action (Callable[[], object]): Picklable callable, typically a method of NativeMaker.
+            depends (Iterable[Optional[str]]): Names of stages to wait for. None is ignored.
+            cost (int): Number of jobs the stage occupies in the budget.
+            target (Optional[StageTarget]): Files of the stage. The stage always runs if None.
+
+        Returns:
+            str: Name of the stage.
+        """
+        if name in self.stages:
+            raise ValueError(f"Stage {name} is already added.")
+        _depends = [d for d in depends if d]
+        for dep in _depends:
+            if dep not in self.stages:
+                raise ValueError(f"Unknown stage {dep} is required by {name}.")
+        self.stages[name] = BuildStage(name, action, _depends, min(cost, self.max_jobs), target)
+        return name
+
+    def _get_stale_reason(self, stage: BuildStage) -> Optional[str]:
+        if self.force:
+            return "forced"
+        if stage.target is None:
+            return "not tracked"
+        return stage.target.get_stale_reason()
+
+    def print_plan(self) -> None:
+        """Prints stages which would run and why, without running them.
+
+        A stage after one which runs is checked again when it is ready, as make does.
+        """
+        running: Set[str] = set()
+        for name, stage in self.stages.items():
+            reason = self._get_stale_reason(stage)
+            if reason is None:
+                reason = next((f"after {dep}" for dep in stage.depends if dep in running), None)
+            if reason is None:
+                print(f"skip {name}: up to date")
+                continue
+            running.add(name)
+            print(f"run  {name}: {reason}")
+
+    def run(self) -> None:
+        if not self.stages:
+            return
+        pending: List[str] = list(self.stages)
+        finished: Set[str] = set()
+        running: Dict[Future, BuildStage] = {}
+        used_jobs = 0
+        failure: Optional[BaseException] = None
+        self.start_time = time.monotonic()
+        cancel_event = multiprocessing.Event()
+        with ProcessPoolExecutor(
+            max_workers=self.max_jobs, initializer=_init_stage_worker, initargs=(cancel_event,)
+        ) as executor:
+            while running or (pending and failure is None):
+                if failure is None:
+                    for name in list(pending):
+                        stage = self.stages[name]
+                        if not all(dep in finished for dep in stage.depends):
+                            continue
+                        if running and used_jobs + stage.cost > self.max_jobs:
+                            continue
+                        reason = self._get_stale_reason(stage)
+                        if reason is None:
+                            logging.info(f"Stage {name} is up to date.")
+                            finished.add(name)
+                            pending.remove(name)
+                            continue
+                        logging.info(f"Start stage {name}: {reason}.")
+                        stage.start_time = time.monotonic()
+                        future = executor.submit(
+                            run_stage_action, name, stage.action, self.log_dir, self.timeout
+                        )
+                        running[future] = stage
+                        used_jobs += stage.cost
+                        pending.remove(name)
+                if not running:
+                    if not pending:
+                        break
+                    raise RuntimeError(f"Stages {pending} can not be started.")
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    stage.end_time = time.monotonic()
+                    used_jobs -= stage.cost
+                    try:
+                        self.records += future.result()
+                    except BaseException as e:
+                        self.records += getattr(e, "subprocess_records", [])
+                        if isinstance(e, SubprocessCancelled):
+                            logging.warning(f"Stage {stage.name} is cancelled.")
+                            continue
+                        logging.warning(f"Stage {stage.name} failed.")
+                        if failure is None:
+                            failure = e
+                            cancel_event.set()
+                        continue
+                    finished.add(stage.name)
+                    if stage.target is not None:
+                        stage.target.record()
+                    logging.info(f"Stage {stage.name} finished in {stage.duration:.1f} s.")
+        self.end_time = time.monotonic()
+        if failure is not None:
+            raise failure
+        self.print_critical_path()
+
+    def critical_path(self) -> Tuple[List[str], float]:
+        """Returns the longest chain of dependent stages and its total duration."""
+        finish: Dict[str, float] = {}
+        previous: Dict[str, Optional[str]] = {}
+        # stages are registered in topological order.
+        for name, stage in self.stages.items():
+            prev: Optional[str] = None
+            for dep in stage.depends:
+                if prev is None or finish[dep] > finish[prev]:
+                    prev = dep
+            finish[name] = stage.duration + (finish[prev] if prev else 0.0)
+            previous[name] = prev
+        last: Optional[str] = max(finish, key=lambda n: finish[n])
+        length = finish[last]
+        path: List[str] = []
+        while last:
+            path.append(last)
+            last = previous[last]
+        return list(reversed(path)), length
+
+    def print_critical_path(self) -> None:
+        if not self.stages or self.start_time is None or self.end_time is None:
+            return
+        path, length = self.critical_path()
+        print(
+            f"Critical path: {length:.1f} s of {self.end_time - self.start_time:.1f} s "
+            f"wall time with {self.max_jobs} jobs."
+        )
+        for name in path:
+            print(f"  {name}: {self.stages[name].duration:.1f} s")
+
+    def _get_stage_usages(self) -> Dict[str, Dict[str, float]]:
+        usages: Dict[str, Dict[str, float]] = {}
+        for name in self.stages:
+            usages[name] = {"user_time": 0.0, "system_time": 0.0, "max_rss_mb": 0.0}
+        for record in self.records:
+            usage = usages.get(cast(str, record["stage"]))
+            if usage is None:
+                continue
+            usage["user_time"] += cast(float, record.get("user_time", 0.0))
+            usage["system_time"] += cast(float, record.get("system_time", 0.0))
+            usage["max_rss_mb"] = max(usage["max_rss_mb"], cast(int, record.get("max_rss_mb", 0)))
+        return usages
+
+    def print_summary(self) -> None:
+        usages = self._get_stage_usages()
+        print(f"{'stage':30s} {'wall[s]':>9s} {'user[s]':>9s} {'sys[s]':>9s} {'RSS[MiB]':>9s}")
+        for name, stage in self.stages.items():
+            if stage.start_time is None:
+                continue
+            usage = usages[name]
+            print(
+                f"{name:30s} {stage.duration:9.1f} {usage['user_time']:9.1f} "
+                f"{usage['system_time']:9.1f} {usage['max_rss_mb']:9.0f}"
+            )
+
+    def write_report(self, path: Path, config: "Config") -> None:
+        """Writes timings of stages and resource usages of subprocesses as JSON."""
+        usages = self._get_stage_usages()
+        origin = self.start_time or 0.0
+        report = {
+            "host": {
+                "name": platform.node(),
+                "system": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "python": platform.python_version(),
+            },
+            "config": config.config_values,
+            "jobs": self.max_jobs,
+            "wall_time": (self.end_time or origin) - origin,
+            "stages": [
+                {
+                    "name": name,
+                    "depends": stage.depends,
+                    "start": stage.start_time - origin,
+                    "wall_time": stage.duration,
+                    **usages[name],
+                }
+                for name, stage in self.stages.items()
+                if stage.start_time is not None
+            ],
+            "subprocesses": self.records,
+        }
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        logging.info(f"Build report is written to {path}.")
+
+
 def config_file_to_map(path: Path) -> Mapping[str, str]:
     dic: Dict[str, str] = dict()
     with open(path, "r") as f:
@@ -1557,9 +4423,133 @@ def main() -> None:
         "show_cmake",
         "enable_test",
         "more_functions",
+        "memory_aware_jobs",
+        "compile_hotspots",
+        "include_costs",
+        "benchmark_swig_patch",
+        "fast_build",
+        "pgo",
+        "gc_sections",
+        "split_debug",
+        "link_report",
+        "shared_core",
+        "swig_cache",
     ):
         parser.add_argument(f"--{opt}", default=False, action="store_true")
+    parser.add_argument(
+        "--build_all",
+        default=False,
+        action="store_true",
+        help="same as --build_rdkit --build_wrapper --build_nuget, or without --build_nuget "
+        "unless --target_lang is csharp",
+    )
+    parser.add_argument(
+        "--plan",
+        default=False,
+        action="store_true",
+        help="print stages which would run and why, without running them",
+    )
+    parser.add_argument(
+        "--force",
+        default=False,
+        action="store_true",
+        help="run stages even if their outputs are newer than their inputs",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="number of jobs shared by the build stages running at the same time",
+    )
+    parser.add_argument(
+        "--swig_wrapper_parts",
+        type=int,
+        default=1,
+        help="number of translation units to compile the SWIG C# wrapper in parallel",
+    )
+    parser.add_argument(
+        "--unity_batch_size",
+        type=int,
+        default=8,
+        help="number of sources in a unity build unit with --fast_build",
+    )
+    parser.add_argument(
+        "--pgo_workload",
+        default=None,
+        help="command line run with instrumented RDKit by --pgo instead of RDKit2DotNetTest",
+    )
+    parser.add_argument(
+        "--lto",
+        default="none",
+        choices=typing.get_args(LtoMode),
+        help="link-time optimization of RDKit; thin needs Clang on Linux",
+    )
+    parser.add_argument(
+        "--linker",
+        default="bfd",
+        choices=typing.get_args(Linker),
+        help="linker of RDKit on Linux",
+    )
+    parser.add_argument(
+        "--cpu_variants",
+        default="",
+        help="comma separated microarchitecture levels of RDKFuncs built in addition to the "
+        f"baseline on Linux, from {', '.join(typing.get_args(CpuVariant))}",
+    )
+    parser.add_argument(
+        "--build_tool",
+        default="make",
+        choices=typing.get_args(BuildTool),
+        help="build tool of RDKit on Linux",
+    )
+    parser.add_argument(
+        "--compiler_cache",
+        default=None,
+        choices=typing.get_args(CompilerCache),
+        help="compiler launcher to cache objects of RDKit and SWIG wrapper",
+    )
+    parser.add_argument(
+        "--report",
+        default="build_report.json",
+        help="JSON file to write timings and resource usages of the build",
+    )
+    parser.add_argument(
+        "--log_dir",
+        default="build_logs",
+        help="directory to write gzip compressed output of the commands of each stage",
+    )
+    parser.add_argument(
+        "--command_timeout",
+        type=float,
+        default=None,
+        help="seconds after which a command is killed and its stage fails",
+    )
+    parser.add_argument(
+        "--artifact_cache",
+        default=None,
+        help="directory of the content-addressed cache to restore stage outputs from",
+    )
     args = parser.parse_args()
+    if args.pgo and args.target_lang != "csharp" and not args.pgo_workload:
+        parser.error("--pgo needs --pgo_workload unless --target_lang is csharp.")
+    cpu_variants = [v for v in args.cpu_variants.split(",") if v]
+    for cpu_variant in cpu_variants:
+        if cpu_variant not in typing.get_args(CpuVariant):
+            parser.error(f"Unknown CPU variant {cpu_variant}.")
+    if cpu_variants and (
+        get_os() != "linux" or args.target_lang != "csharp" or not args.use_static_libs
+    ):
+        parser.error("--cpu_variants needs --use_static_libs for C# on Linux.")
+    if cpu_variants and args.pgo:
+        parser.error("--cpu_variants cannot be used with --pgo.")
+    if args.lto != "none" and args.linker == "lld" and not is_clang_toolchain():
+        parser.error("lld cannot link objects of GCC with --lto.")
+    if args.plan and (args.clean or args.clean_zlib or args.clean_rdkit):
+        parser.error("--plan cannot be used with --clean options.")
+    if args.build_all:
+        args.build_rdkit = True
+        args.build_wrapper = True
+        args.build_nuget = args.build_nuget or args.target_lang == "csharp"
 
     # x86 is supported only for Windows
     if get_os() == "linux" and args.build_platform == "x86":
@@ -1590,38 +4580,151 @@ def main() -> None:
             if args.clean_rdkit:
                 NativeMaker(config).clean_rdkit()
 
+        scheduler = StageScheduler(
+            args.jobs,
+            force=args.force,
+            log_dir=Path(curr_dir) / args.log_dir,
+            timeout=args.command_timeout,
+        )
+        patch_stage: Optional[str] = None
+        if args.show_cmake or args.build_cmake or args.build_rdkit:
+            patch_stage = scheduler.add(
+                "patch_rdkit",
+                NativeMaker(config).patch_rdkit_sources,
+                target=NativeMaker(config).get_stage_target("patch_rdkit", "patch"),
+            )
+        # freetype, pixman and cairo projects are placed in directories shared by platforms.
+        # configures of RDKit share its source tree, where CMake downloads externals.
+        last_stage_of: Dict[str, str] = {}
+        native_stages: List[str] = []
         for cpu_model in (
             typing.get_args(CpuModel) if args.build_platform == "all" else [args.build_platform]
         ):
             maker = NativeMaker(config, cpu_model)
+            maker.patches_on_configure = patch_stage is None
+            freetype: Optional[str] = None
+            zlib: Optional[str] = None
+            libpng: Optional[str] = None
+            pixman: Optional[str] = None
+            cairo: Optional[str] = None
+            cmake: Optional[str] = None
             if args.build_freetype:
-                maker.make_freetype()
+                freetype = scheduler.add(
+                    f"{cpu_model}:freetype", maker.make_freetype, [last_stage_of.get("freetype")]
+                )
+                last_stage_of["freetype"] = freetype
             if args.build_zlib:
-                maker.make_zlib()
+                zlib = scheduler.add(f"{cpu_model}:zlib", maker.make_zlib)
             if args.build_libpng:
-                maker.make_libpng()
+                libpng = scheduler.add(f"{cpu_model}:libpng", maker.make_libpng, [zlib])
             if args.build_pixman:
-                maker.make_pixman()
+                pixman = scheduler.add(
+                    f"{cpu_model}:pixman", maker.make_pixman, [last_stage_of.get("pixman")]
+                )
+                last_stage_of["pixman"] = pixman
             if args.build_cairo:
-                maker.make_cairo()
+                cairo = scheduler.add(
+                    f"{cpu_model}:cairo",
+                    maker.make_cairo,
+                    [last_stage_of.get("cairo"), freetype, zlib, libpng, pixman],
+                )
+                last_stage_of["cairo"] = cairo
             if args.show_cmake:
-                cmd = maker.build_cmake_rdkit()
-                print(" ".join([(('"' + s + '"') if (" " in s or '"' in s) else s) for s in cmd]))
-            if args.build_cmake:
-                maker.build_cmake_rdkit()
-            if args.build_rdkit_only:
-                maker.build_rdkit()
-                maker.copy_rdkit_dlls()
-            if args.build_rdkit:
-                maker.build_cmake_rdkit()
-                maker.build_rdkit()
-                maker.copy_rdkit_dlls()
+                cmake = scheduler.add(
+                    f"{cpu_model}:cmake",
+                    maker.show_cmake_rdkit,
+                    [last_stage_of.get("cmake"), patch_stage, freetype, zlib, cairo],
+                )
+                last_stage_of["cmake"] = cmake
+            elif args.build_cmake or args.build_rdkit:
+                name = f"{cpu_model}:cmake"
+                cmake = scheduler.add(
+                    name,
+                    maker.build_cmake_rdkit,
+                    [last_stage_of.get("cmake"), patch_stage, freetype, zlib, cairo],
+                    target=maker.get_stage_target(name, "cmake"),
+                )
+                last_stage_of["cmake"] = cmake
+            if args.build_rdkit_only or args.build_rdkit:
+                # make/MSBuild uses all cores by itself and SWIG writes to the source tree.
+                name = f"{cpu_model}:rdkit"
+                rdkit: str = scheduler.add(
+                    name,
+                    maker.build_rdkit,
+                    [cmake],
+                    cost=scheduler.max_jobs,
+                    target=maker.get_stage_target(name, "rdkit"),
+                )
+                name = f"{cpu_model}:copy_dlls"
+                copy_dlls = scheduler.add(
+                    name,
+                    maker.copy_rdkit_dlls,
+                    [rdkit],
+                    target=maker.get_stage_target(name, "copy_dlls"),
+                )
+                native_stages.append(copy_dlls)
+                for cpu_variant in config.cpu_variants:
+                    # each variant is built in its own build tree.
+                    variant_maker = NativeMaker(config, cpu_model, cpu_variant)
+                    variant_maker.patches_on_configure = patch_stage is None
+                    variant_cmake: Optional[str] = None
+                    if args.build_rdkit:
+                        name = f"{cpu_model}:cmake:{cpu_variant}"
+                        variant_cmake = scheduler.add(
+                            name,
+                            variant_maker.build_cmake_rdkit,
+                            [last_stage_of.get("cmake"), patch_stage, freetype, zlib, cairo],
+                            target=variant_maker.get_stage_target(name, "cmake"),
+                        )
+                        last_stage_of["cmake"] = variant_cmake
+                    name = f"{cpu_model}:rdkit:{cpu_variant}"
+                    variant_rdkit = scheduler.add(
+                        name,
+                        variant_maker.build_rdkit,
+                        [variant_cmake, rdkit],
+                        cost=scheduler.max_jobs,
+                        target=variant_maker.get_stage_target(name, "rdkit"),
+                    )
+                    name = f"{cpu_model}:copy_dlls:{cpu_variant}"
+                    native_stages.append(
+                        scheduler.add(
+                            name,
+                            variant_maker.copy_rdkit_dlls,
+                            [variant_rdkit, copy_dlls],
+                            target=variant_maker.get_stage_target(name, "copy_dlls"),
+                        )
+                    )
         # if required x64 is used as platform
         maker = NativeMaker(config)
+        wrapper: Optional[str] = None
+        benchmark: Optional[str] = None
+        if args.benchmark_swig_patch:
+            benchmark = scheduler.add(
+                "benchmark_swig_patch", maker.benchmark_swig_patch, native_stages
+            )
         if args.build_wrapper:
-            maker.build_wrapper()
+            wrapper = scheduler.add(
+                "wrapper",
+                maker.build_wrapper,
+                [*native_stages, benchmark],
+                target=maker.get_stage_target("wrapper", "wrapper"),
+            )
         if args.build_nuget:
-            maker.build_nuget_package()
+            scheduler.add(
+                "nuget",
+                maker.build_nuget_package,
+                [*native_stages, wrapper],
+                target=maker.get_stage_target("nuget", "nuget"),
+            )
+        if args.plan:
+            scheduler.print_plan()
+            return
+        try:
+            scheduler.run()
+        finally:
+            if scheduler.stages:
+                scheduler.print_summary()
+                scheduler.write_report(Path(curr_dir) / args.report, config)
     finally:
         os.chdir(curr_dir)
 
@@ -1673,8 +4776,43 @@ def create_config(args: argparse.Namespace, config_info: Mapping[str, str]) -> C
         config.cairo_path = path_from_ini("CAIRO_DIR")
     config.eigen_path = path_from_ini("EIGEN_DIR")
     config.test_enabled = False
+    config.config_values = dict(config_info)
+    config.compiler_cache = args.compiler_cache
+    config.build_tool = args.build_tool
+    config.memory_aware_jobs = args.memory_aware_jobs
+    config.compile_hotspots = args.compile_hotspots
+    config.include_costs = args.include_costs
+    config.jobs = args.jobs
+    config.swig_wrapper_parts = max(1, args.swig_wrapper_parts)
+    config.fast_build = args.fast_build
+    config.unity_batch_size = args.unity_batch_size
+    config.pgo = args.pgo
+    config.pgo_workload = args.pgo_workload
+    config.lto = args.lto
+    config.linker = args.linker
+    config.gc_sections = args.gc_sections
+    config.split_debug = args.split_debug
+    config.link_report = args.link_report
+    config.cpu_variants = [cast(CpuVariant, v) for v in args.cpu_variants.split(",") if v]
+    config.shared_core = args.shared_core
+    config.swig_cache = args.swig_cache
+    if args.artifact_cache:
+        config.artifact_cache_path = Path(args.artifact_cache).resolve()
     return config
 
 
 if __name__ == "__main__":
-    main()
+    if sys.argv[1:2] == ["compile_launcher"]:
+        sys.exit(compile_launcher_main(sys.argv[2:]))
+    if sys.argv[1:2] == ["split_swig_wrapper"]:
+        sys.exit(split_swig_wrapper_main(sys.argv[2:]))
+    if sys.argv[1:2] == ["swig_launcher"]:
+        sys.exit(swig_launcher_main(sys.argv[2:]))
+    try:
+        main()
+    except subprocess.CalledProcessError as e:
+        logging.error(f"{e.cmd} failed with {e.returncode}.")
+        sys.exit(e.returncode)
+    except subprocess.TimeoutExpired as e:
+        logging.error(f"{e.cmd} timed out after {e.timeout} s.")
+        sys.exit(1)
@@ -0,0 +1,175 @@
+using System;
+using System.Collections.Generic;
+
+namespace GraphMolWrap
+{
+    /// <summary>
+    /// Fingerprints stored as contiguous blocks of 64-bit words, and Tanimoto and Dice
+    /// similarities computed over the blocks in single native calls.
+    /// </summary>
+    /// <remarks>
+    /// A block of <c>count</c> fingerprints of <c>nWords</c> words each holds the fingerprint
+    /// <c>i</c> at words <c>[i * nWords, (i + 1) * nWords)</c>. Overloads taking
+    /// <see cref="IntPtr"/> expect pinned memory of the required size.
+    /// </remarks>
+    public static class FingerprintBlocks
+    {
+        /// <summary>
+        /// Returns the number of 64-bit words holding <paramref name="fp"/>.
+        /// </summary>
+        public static int GetWordCount(ExplicitBitVect fp)
+        {
+            return (int)RDKFuncs.getFingerprintWordCount(fp);
+        }
+
+        /// <summary>
+        /// Writes <paramref name="fp"/> to <paramref name="nWords"/> words at <paramref name="words"/>.
+        /// </summary>
+        public static void Export(ExplicitBitVect fp, IntPtr words, int nWords)
+        {
+            RDKFuncs.exportFingerprintWords(fp, words, checked((uint)nWords));
+        }
+
+        /// <summary>
+        /// Returns a block of <paramref name="fps"/>, which have the same number of bits.
+        /// </summary>
+        /// <param name="fps">Fingerprints to export.</param>
+        /// <param name="nWords">Number of words of each fingerprint.</param>
+        public static unsafe ulong[] ExportBlock(IReadOnlyList<ExplicitBitVect> fps, out int nWords)
+        {
+            nWords = fps.Count == 0 ? 0 : GetWordCount(fps[0]);
+            var block = new ulong[fps.Count * nWords];
+            fixed (ulong* p = block)
+            {
+                for (int i = 0; i < fps.Count; i++)
+                {
+                    if (GetWordCount(fps[i]) != nWords)
+                        throw new ArgumentException("Fingerprints have different sizes.", nameof(fps));
+                    Export(fps[i], (IntPtr)(p + (long)i * nWords), nWords);
+                }
+            }
+            return block;
+        }
+
+        /// <summary>
+        /// Writes Tanimoto similarities of the query to each of <paramref name="count"/> fingerprints in the block.
+        /// </summary>
+        public static void BulkTanimoto(IntPtr query, IntPtr block, int nWords, int count, IntPtr scores)
+        {
+            RDKFuncs.bulkTanimotoWords(query, block, checked((uint)nWords), checked((uint)count), scores);
+        }
+
+        /// <summary>
+        /// Writes Dice similarities of the query to each of <paramref name="count"/> fingerprints in the block.
+        /// </summary>
+        public static void BulkDice(IntPtr query, IntPtr block, int nWords, int count, IntPtr scores)
+        {
+            RDKFuncs.bulkDiceWords(query, block, checked((uint)nWords), checked((uint)count), scores);
+        }
+
+        /// <summary>
+        /// Writes <paramref name="nQueries"/> x <paramref name="count"/> Tanimoto similarities in row-major order.
+        /// </summary>
+        /// <param name="numThreads">Number of threads. Zero or negative values are relative to the number of cores.</param>
+        public static void CrossTanimoto(IntPtr queries, int nQueries, IntPtr block, int count, int nWords, IntPtr scores, int numThreads = 1)
+        {
+            RDKFuncs.crossTanimotoWords(queries, checked((uint)nQueries), block, checked((uint)count), checked((uint)nWords), scores, numThreads);
+        }
+
+        /// <summary>
+        /// Writes <paramref name="nQueries"/> x <paramref name="count"/> Dice similarities in row-major order.
+        /// </summary>
+        /// <param name="numThreads">Number of threads. Zero or negative values are relative to the number of cores.</param>
+        public static void CrossDice(IntPtr queries, int nQueries, IntPtr block, int count, int nWords, IntPtr scores, int numThreads = 1)
+        {
+            RDKFuncs.crossDiceWords(queries, checked((uint)nQueries), block, checked((uint)count), checked((uint)nWords), scores, numThreads);
+        }
+
+#if NETCOREAPP3_1
+        /// <summary>
+        /// Writes <paramref name="fp"/> to <paramref name="words"/>.
+        /// </summary>
+        public static unsafe void Export(ExplicitBitVect fp, Span<ulong> words)
+        {
+            if (words.Length < GetWordCount(fp))
+                throw new ArgumentException("Buffer is too small.", nameof(words));
+            fixed (ulong* p = words)
+            {
+                Export(fp, (IntPtr)p, words.Length);
+            }
+        }
+
+        /// <summary>
+        /// Writes Tanimoto similarities of <paramref name="query"/> to each fingerprint in <paramref name="block"/>.
+        /// </summary>
+        public static void BulkTanimoto(ReadOnlySpan<ulong> query, ReadOnlySpan<ulong> block, Span<double> scores)
+        {
+            OneToMany(query, block, scores, false);
+        }
+
+        /// <summary>
+        /// Writes Dice similarities of <paramref name="query"/> to each fingerprint in <paramref name="block"/>.
+        /// </summary>
+        public static void BulkDice(ReadOnlySpan<ulong> query, ReadOnlySpan<ulong> block, Span<double> scores)
+        {
+            OneToMany(query, block, scores, true);
+        }
+
+        /// <summary>
+        /// Writes Tanimoto similarities of each of <paramref name="queries"/> to each fingerprint in <paramref name="block"/> in row-major order.
+        /// </summary>
+        public static void CrossTanimoto(ReadOnlySpan<ulong> queries, ReadOnlySpan<ulong> block, int nWords, Span<double> scores, int numThreads = 1)
+        {
+            ManyToMany(queries, block, nWords, scores, numThreads, false);
+        }
+
+        /// <summary>
+        /// Writes Dice similarities of each of <paramref name="queries"/> to each fingerprint in <paramref name="block"/> in row-major order.
+        /// </summary>
+        public static void CrossDice(ReadOnlySpan<ulong> queries, ReadOnlySpan<ulong> block, int nWords, Span<double> scores, int numThreads = 1)
+        {
+            ManyToMany(queries, block, nWords, scores, numThreads, true);
+        }
+
+        private static int GetCount(ReadOnlySpan<ulong> block, int nWords, string name)
+        {
+            if (nWords <= 0 || block.Length % nWords != 0)
+                throw new ArgumentException($"Length is not a multiple of {nWords}.", name);
+            return block.Length / nWords;
+        }
+
+        private static unsafe void OneToMany(ReadOnlySpan<ulong> query, ReadOnlySpan<ulong> block, Span<double> scores, bool dice)
+        {
+            int count = GetCount(block, query.Length, nameof(block));
+            if (scores.Length < count)
+                throw new ArgumentException("Buffer is too small.", nameof(scores));
+            fixed (ulong* q = query)
+            fixed (ulong* b = block)
+            fixed (double* s = scores)
+            {
+                if (dice)
+                    BulkDice((IntPtr)q, (IntPtr)b, query.Length, count, (IntPtr)s);
+                else
+                    BulkTanimoto((IntPtr)q, (IntPtr)b, query.Length, count, (IntPtr)s);
+            }
+        }
+
+        private static unsafe void ManyToMany(ReadOnlySpan<ulong> queries, ReadOnlySpan<ulong> block, int nWords, Span<double> scores, int numThreads, bool dice)
+        {
+            int nQueries = GetCount(queries, nWords, nameof(queries));
+            int count = GetCount(block, nWords, nameof(block));
+            if (scores.Length < (long)nQueries * count)
+                throw new ArgumentException("Buffer is too small.", nameof(scores));
+            fixed (ulong* q = queries)
+            fixed (ulong* b = block)
+            fixed (double* s = scores)
+            {
+                if (dice)
+                    CrossDice((IntPtr)q, nQueries, (IntPtr)b, count, nWords, (IntPtr)s, numThreads);
+                else
+                    CrossTanimoto((IntPtr)q, nQueries, (IntPtr)b, count, nWords, (IntPtr)s, numThreads);
+            }
+        }
+#endif
+    }
+}
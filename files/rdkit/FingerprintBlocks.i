@@ -0,0 +1,143 @@
+/*
+ * Fingerprints as contiguous blocks of 64-bit words and similarities over the blocks
+ * computed in single native calls. build_rdkit_csharp.py copies this file next to
+ * GraphMolCSharp.i and includes it. C# passes pinned memory as IntPtr, see
+ * FingerprintBlocks.cs.
+ */
+
+%{
+#include <algorithm>
+#include <bitset>
+#include <cstdint>
+#include <thread>
+#include <vector>
+#include <DataStructs/ExplicitBitVect.h>
+#include <RDGeneral/RDThreads.h>
+
+namespace RDKit {
+namespace FingerprintBlocksDetail {
+inline unsigned int popcount(const uint64_t *words, unsigned int nWords) {
+  unsigned int res = 0;
+  for (unsigned int i = 0; i < nWords; ++i) {
+    res += static_cast<unsigned int>(std::bitset<64>(words[i]).count());
+  }
+  return res;
+}
+
+// Tanimoto or Dice similarity of fingerprints having countA and countB bits set.
+inline double similarity(const uint64_t *a, unsigned int countA, const uint64_t *b,
+                         unsigned int countB, unsigned int nWords, bool dice) {
+  unsigned int common = 0;
+  for (unsigned int i = 0; i < nWords; ++i) {
+    common += static_cast<unsigned int>(std::bitset<64>(a[i] & b[i]).count());
+  }
+  unsigned int denom = dice ? countA + countB : countA + countB - common;
+  if (!denom) {
+    return 0.0;
+  }
+  return (dice ? 2.0 * common : static_cast<double>(common)) / denom;
+}
+
+inline void oneToMany(const uint64_t *query, const uint64_t *block, unsigned int nWords,
+                      unsigned int count, double *scores, bool dice) {
+  unsigned int queryCount = popcount(query, nWords);
+  for (unsigned int i = 0; i < count; ++i) {
+    const uint64_t *fp = block + static_cast<size_t>(i) * nWords;
+    scores[i] = similarity(query, queryCount, fp, popcount(fp, nWords), nWords, dice);
+  }
+}
+
+inline void manyToMany(const uint64_t *queries, unsigned int nQueries, const uint64_t *block,
+                       unsigned int count, unsigned int nWords, double *scores, bool dice,
+                       int numThreads) {
+  std::vector<unsigned int> counts(count);
+  for (unsigned int i = 0; i < count; ++i) {
+    counts[i] = popcount(block + static_cast<size_t>(i) * nWords, nWords);
+  }
+  auto work = [&](unsigned int begin, unsigned int end) {
+    for (unsigned int q = begin; q < end; ++q) {
+      const uint64_t *query = queries + static_cast<size_t>(q) * nWords;
+      unsigned int queryCount = popcount(query, nWords);
+      double *row = scores + static_cast<size_t>(q) * count;
+      for (unsigned int i = 0; i < count; ++i) {
+        row[i] = similarity(query, queryCount, block + static_cast<size_t>(i) * nWords,
+                            counts[i], nWords, dice);
+      }
+    }
+  };
+  unsigned int nThreads = std::min(getNumThreadsToUse(numThreads), std::max(nQueries, 1u));
+  if (nThreads <= 1) {
+    work(0, nQueries);
+    return;
+  }
+  std::vector<std::thread> threads;
+  unsigned int chunk = (nQueries + nThreads - 1) / nThreads;
+  for (unsigned int begin = 0; begin < nQueries; begin += chunk) {
+    threads.emplace_back(work, begin, std::min(begin + chunk, nQueries));
+  }
+  for (auto &thread : threads) {
+    thread.join();
+  }
+}
+}  // namespace FingerprintBlocksDetail
+}  // namespace RDKit
+%}
+
+%define RDK_BLOCK_POINTER(TYPE, NAME)
+%typemap(ctype) TYPE NAME "void *"
+%typemap(imtype) TYPE NAME "global::System.IntPtr"
+%typemap(cstype) TYPE NAME "global::System.IntPtr"
+%typemap(csin) TYPE NAME "$csinput"
+%typemap(in) TYPE NAME %{ $1 = ($1_ltype)$input; %}
+%enddef
+
+RDK_BLOCK_POINTER(uint64_t *, words)
+RDK_BLOCK_POINTER(const uint64_t *, query)
+RDK_BLOCK_POINTER(const uint64_t *, queries)
+RDK_BLOCK_POINTER(const uint64_t *, block)
+RDK_BLOCK_POINTER(double *, scores)
+
+%inline %{
+namespace RDKit {
+// Returns the number of 64-bit words holding fp.
+unsigned int getFingerprintWordCount(const ExplicitBitVect &fp) {
+  return (fp.getNumBits() + 63) / 64;
+}
+
+// Writes bits of fp to words, truncated to nWords words.
+void exportFingerprintWords(const ExplicitBitVect &fp, uint64_t *words, unsigned int nWords) {
+  std::fill(words, words + nWords, 0);
+  const boost::dynamic_bitset<> &bits = *fp.dp_bits;
+  for (size_t i = bits.find_first(); i != boost::dynamic_bitset<>::npos && i / 64 < nWords;
+       i = bits.find_next(i)) {
+    words[i / 64] |= uint64_t(1) << (i % 64);
+  }
+}
+
+// Writes similarities of query to each of count fingerprints in block to scores.
+void bulkTanimotoWords(const uint64_t *query, const uint64_t *block, unsigned int nWords,
+                       unsigned int count, double *scores) {
+  FingerprintBlocksDetail::oneToMany(query, block, nWords, count, scores, false);
+}
+
+void bulkDiceWords(const uint64_t *query, const uint64_t *block, unsigned int nWords,
+                   unsigned int count, double *scores) {
+  FingerprintBlocksDetail::oneToMany(query, block, nWords, count, scores, true);
+}
+
+// Writes nQueries x count similarities to scores in row-major order.
+void crossTanimotoWords(const uint64_t *queries, unsigned int nQueries, const uint64_t *block,
+                        unsigned int count, unsigned int nWords, double *scores,
+                        int numThreads = 1) {
+  FingerprintBlocksDetail::manyToMany(queries, nQueries, block, count, nWords, scores, false,
+                                      numThreads);
+}
+
+void crossDiceWords(const uint64_t *queries, unsigned int nQueries, const uint64_t *block,
+                    unsigned int count, unsigned int nWords, double *scores,
+                    int numThreads = 1) {
+  FingerprintBlocksDetail::manyToMany(queries, nQueries, block, count, nWords, scores, true,
+                                      numThreads);
+}
+}  // namespace RDKit
+%}
@@ -0,0 +1,484 @@
+/*
+ * Persistent fingerprint index memory-mapped at open and searched for Tanimoto
+ * similarity with popcount bounds. build_rdkit_csharp.py copies this file next to
+ * GraphMolCSharp.i and includes it after FingerprintBlocks.i.
+ *
+ * File layout, all integers in native byte order and sections 8-byte aligned:
+ *   header         FingerprintIndexDetail::Header
+ *   bucket starts  uint64[nWords * 64 + 2], first row of each popcount
+ *   ids            uint32[count], record numbers of rows sorted by popcount
+ *   words          uint64[count * nWords], fingerprints of rows
+ *   name offsets   uint64[count + 1], by record number
+ *   names          char[namesSize]
+ */
+
+%{
+#include <algorithm>
+#include <cmath>
+#include <cstdint>
+#include <cstdio>
+#include <fstream>
+#include <limits>
+#include <memory>
+#include <stdexcept>
+#include <string>
+#include <thread>
+#include <vector>
+#ifdef _WIN32
+#ifndef NOMINMAX
+#define NOMINMAX
+#endif
+#include <windows.h>
+#else
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+#endif
+#include <DataStructs/ExplicitBitVect.h>
+#include <GraphMol/FileParsers/MolSupplier.h>
+#include <GraphMol/Fingerprints/MorganFingerprints.h>
+#include <RDGeneral/RDThreads.h>
+
+namespace RDKit {
+struct FingerprintHit {
+  unsigned int id;
+  double similarity;
+};
+
+namespace FingerprintIndexDetail {
+const char Magic[8] = {'R', 'D', 'K', 'F', 'P', 'I', 'X', '\0'};
+const uint32_t Version = 1;
+
+struct Header {
+  char magic[8];
+  uint32_t version;
+  uint32_t nWords;
+  uint64_t count;
+  int32_t morganRadius;
+  uint32_t reserved;
+  uint64_t namesSize;
+};
+
+inline size_t align8(size_t n) { return (n + 7) & ~size_t(7); }
+
+class MappedFile {
+ public:
+  explicit MappedFile(const std::string &path) {
+#ifdef _WIN32
+    d_file = CreateFileA(path.c_str(), GENERIC_READ, FILE_SHARE_READ, nullptr, OPEN_EXISTING,
+                         FILE_ATTRIBUTE_NORMAL, nullptr);
+    if (d_file == INVALID_HANDLE_VALUE) {
+      throw std::runtime_error("Cannot open " + path);
+    }
+    LARGE_INTEGER size;
+    GetFileSizeEx(d_file, &size);
+    d_size = static_cast<size_t>(size.QuadPart);
+    d_mapping = CreateFileMappingA(d_file, nullptr, PAGE_READONLY, 0, 0, nullptr);
+    if (d_mapping) {
+      d_data = static_cast<const char *>(MapViewOfFile(d_mapping, FILE_MAP_READ, 0, 0, 0));
+    }
+#else
+    d_fd = open(path.c_str(), O_RDONLY);
+    if (d_fd < 0) {
+      throw std::runtime_error("Cannot open " + path);
+    }
+    struct stat st;
+    fstat(d_fd, &st);
+    d_size = static_cast<size_t>(st.st_size);
+    void *data = d_size ? mmap(nullptr, d_size, PROT_READ, MAP_SHARED, d_fd, 0) : MAP_FAILED;
+    if (data != MAP_FAILED) {
+      d_data = static_cast<const char *>(data);
+    }
+#endif
+    if (!d_data) {
+      close();
+      throw std::runtime_error("Cannot map " + path);
+    }
+  }
+  MappedFile(const MappedFile &) = delete;
+  MappedFile &operator=(const MappedFile &) = delete;
+  ~MappedFile() { close(); }
+
+  const char *data() const { return d_data; }
+  size_t size() const { return d_size; }
+
+ private:
+  void close() {
+#ifdef _WIN32
+    if (d_data) UnmapViewOfFile(d_data);
+    if (d_mapping) CloseHandle(d_mapping);
+    if (d_file != INVALID_HANDLE_VALUE) CloseHandle(d_file);
+    d_mapping = nullptr;
+    d_file = INVALID_HANDLE_VALUE;
+#else
+    if (d_data) munmap(const_cast<char *>(d_data), d_size);
+    if (d_fd >= 0) ::close(d_fd);
+    d_fd = -1;
+#endif
+    d_data = nullptr;
+  }
+
+  const char *d_data = nullptr;
+  size_t d_size = 0;
+#ifdef _WIN32
+  HANDLE d_file = INVALID_HANDLE_VALUE;
+  HANDLE d_mapping = nullptr;
+#else
+  int d_fd = -1;
+#endif
+};
+
+// orders hits by descending similarity, then by record number.
+inline bool betterHit(const FingerprintHit &a, const FingerprintHit &b) {
+  return a.similarity > b.similarity || (a.similarity == b.similarity && a.id < b.id);
+}
+}  // namespace FingerprintIndexDetail
+
+class FingerprintIndexBuilder {
+ public:
+  explicit FingerprintIndexBuilder(unsigned int nBits = 2048)
+      : d_nWords((nBits + 63) / 64) {}
+
+  void add(const ExplicitBitVect &fp, const std::string &name = "") {
+    if ((fp.getNumBits() + 63) / 64 != d_nWords) {
+      throw std::invalid_argument("Fingerprint size differs from the index.");
+    }
+    size_t offset = d_words.size();
+    d_words.resize(offset + d_nWords);
+    exportFingerprintWords(fp, d_words.data() + offset, d_nWords);
+    d_names.push_back(name);
+  }
+
+  // Adds Morgan fingerprints of molecules in suppl; failed records get empty fingerprints
+  // to keep record numbers.
+  unsigned int addMolecules(MolSupplier &suppl, unsigned int radius = 2) {
+    if (d_morganRadius >= 0 && d_morganRadius != static_cast<int>(radius)) {
+      throw std::invalid_argument("Radius differs from molecules added before.");
+    }
+    d_morganRadius = static_cast<int>(radius);
+    unsigned int n = 0;
+    while (!suppl.atEnd()) {
+      std::unique_ptr<ROMol> mol(suppl.next());
+      std::string name;
+      if (mol) {
+        mol->getPropIfPresent(common_properties::_Name, name);
+        std::unique_ptr<ExplicitBitVect> fp(
+            MorganFingerprints::getFingerprintAsBitVect(*mol, radius, d_nWords * 64));
+        add(*fp, name);
+      } else {
+        d_words.resize(d_words.size() + d_nWords, 0);
+        d_names.push_back(name);
+      }
+      ++n;
+    }
+    return n;
+  }
+
+  unsigned int size() const { return static_cast<unsigned int>(d_names.size()); }
+
+  void write(const std::string &path) const {
+    using namespace FingerprintIndexDetail;
+    const size_t count = d_names.size();
+    const unsigned int nBits = d_nWords * 64;
+    std::vector<uint32_t> popcounts(count);
+    for (size_t i = 0; i < count; ++i) {
+      popcounts[i] = FingerprintBlocksDetail::popcount(d_words.data() + i * d_nWords, d_nWords);
+    }
+    std::vector<uint64_t> starts(nBits + 2, 0);
+    for (auto c : popcounts) {
+      ++starts[c + 1];
+    }
+    for (unsigned int c = 1; c < starts.size(); ++c) {
+      starts[c] += starts[c - 1];
+    }
+    std::vector<uint32_t> ids(count);
+    std::vector<uint64_t> next(starts.begin(), starts.end() - 1);
+    for (size_t i = 0; i < count; ++i) {
+      ids[next[popcounts[i]]++] = static_cast<uint32_t>(i);
+    }
+    std::vector<uint64_t> nameOffsets(count + 1, 0);
+    for (size_t i = 0; i < count; ++i) {
+      nameOffsets[i + 1] = nameOffsets[i] + d_names[i].size();
+    }
+
+    Header header{};
+    std::copy(Magic, Magic + 8, header.magic);
+    header.version = Version;
+    header.nWords = d_nWords;
+    header.count = count;
+    header.morganRadius = d_morganRadius;
+    header.namesSize = nameOffsets[count];
+
+    const std::string tmpPath = path + ".tmp";
+    {
+      std::ofstream out(tmpPath, std::ios::binary | std::ios::trunc);
+      if (!out) {
+        throw std::runtime_error("Cannot write " + tmpPath);
+      }
+      const char padding[8] = {0};
+      out.write(reinterpret_cast<const char *>(&header), sizeof(header));
+      out.write(reinterpret_cast<const char *>(starts.data()), starts.size() * sizeof(uint64_t));
+      out.write(reinterpret_cast<const char *>(ids.data()), count * sizeof(uint32_t));
+      out.write(padding, align8(count * sizeof(uint32_t)) - count * sizeof(uint32_t));
+      for (auto id : ids) {
+        out.write(reinterpret_cast<const char *>(d_words.data() + size_t(id) * d_nWords),
+                  d_nWords * sizeof(uint64_t));
+      }
+      out.write(reinterpret_cast<const char *>(nameOffsets.data()),
+                nameOffsets.size() * sizeof(uint64_t));
+      for (const auto &name : d_names) {
+        out.write(name.data(), name.size());
+      }
+      if (!out) {
+        throw std::runtime_error("Cannot write " + tmpPath);
+      }
+    }
+    std::remove(path.c_str());
+    if (std::rename(tmpPath.c_str(), path.c_str()) != 0) {
+      throw std::runtime_error("Cannot write " + path);
+    }
+  }
+
+ private:
+  unsigned int d_nWords;
+  int d_morganRadius = -1;
+  std::vector<uint64_t> d_words;
+  std::vector<std::string> d_names;
+};
+
+class FingerprintIndex {
+ public:
+  explicit FingerprintIndex(const std::string &path)
+      : d_file(new FingerprintIndexDetail::MappedFile(path)) {
+    using namespace FingerprintIndexDetail;
+    const char *data = d_file->data();
+    if (d_file->size() < sizeof(Header) ||
+        !std::equal(Magic, Magic + 8, reinterpret_cast<const Header *>(data)->magic) ||
+        reinterpret_cast<const Header *>(data)->version != Version) {
+      throw std::runtime_error(path + " is not a fingerprint index.");
+    }
+    dp_header = reinterpret_cast<const Header *>(data);
+    const size_t count = dp_header->count;
+    size_t offset = sizeof(Header);
+    dp_starts = reinterpret_cast<const uint64_t *>(data + offset);
+    offset += (dp_header->nWords * 64 + 2) * sizeof(uint64_t);
+    dp_ids = reinterpret_cast<const uint32_t *>(data + offset);
+    offset += align8(count * sizeof(uint32_t));
+    dp_words = reinterpret_cast<const uint64_t *>(data + offset);
+    offset += count * dp_header->nWords * sizeof(uint64_t);
+    dp_nameOffsets = reinterpret_cast<const uint64_t *>(data + offset);
+    offset += (count + 1) * sizeof(uint64_t);
+    dp_names = data + offset;
+    if (d_file->size() != offset + dp_header->namesSize) {
+      throw std::runtime_error(path + " is truncated.");
+    }
+  }
+
+  unsigned int size() const { return static_cast<unsigned int>(dp_header->count); }
+  unsigned int getNumBits() const { return dp_header->nWords * 64; }
+  // Returns radius of Morgan fingerprints, or -1 if fingerprints were added directly.
+  int getMorganRadius() const { return dp_header->morganRadius; }
+
+  std::string getName(unsigned int id) const {
+    if (id >= dp_header->count) {
+      throw std::out_of_range("Record number out of range.");
+    }
+    return std::string(dp_names + dp_nameOffsets[id], dp_nameOffsets[id + 1] - dp_nameOffsets[id]);
+  }
+
+  ExplicitBitVect *makeQueryFingerprint(const ROMol &mol) const {
+    if (dp_header->morganRadius < 0) {
+      throw std::logic_error("Index is not built from molecules.");
+    }
+    return MorganFingerprints::getFingerprintAsBitVect(
+        mol, static_cast<unsigned int>(dp_header->morganRadius), getNumBits());
+  }
+
+  // Returns hits with Tanimoto similarity of at least threshold, best first.
+  std::vector<FingerprintHit> searchThreshold(const ExplicitBitVect &query, double threshold,
+                                              int numThreads = 1) const {
+    std::vector<uint64_t> q = toWords(query);
+    const unsigned int a = FingerprintBlocksDetail::popcount(q.data(), dp_header->nWords);
+    // Tanimoto similarity is at most min(a, b) / max(a, b) for b bits set.
+    unsigned int lo = 0, hi = getNumBits();
+    if (threshold > 0) {
+      lo = static_cast<unsigned int>(std::ceil(threshold * a - 1e-9));
+      hi = static_cast<unsigned int>(std::min<double>(hi, std::floor(a / threshold + 1e-9)));
+    }
+    const size_t begin = dp_starts[std::min(lo, getNumBits() + 1)];
+    const size_t end = dp_starts[std::min(hi, getNumBits()) + 1];
+    const unsigned int nThreads = threadsFor(end > begin ? end - begin : 0, numThreads);
+    std::vector<std::vector<FingerprintHit>> hits(nThreads);
+    runThreads(nThreads, [&](unsigned int t) {
+      for (size_t row = begin + t; row < end; row += nThreads) {
+        double sim = similarity(q.data(), a, row);
+        if (sim >= threshold) {
+          hits[t].push_back({dp_ids[row], sim});
+        }
+      }
+    });
+    return merge(hits, std::numeric_limits<size_t>::max());
+  }
+
+  // Returns k hits of the highest Tanimoto similarity, best first.
+  std::vector<FingerprintHit> searchTopK(const ExplicitBitVect &query, unsigned int k,
+                                         int numThreads = 1) const {
+    std::vector<uint64_t> q = toWords(query);
+    const unsigned int a = FingerprintBlocksDetail::popcount(q.data(), dp_header->nWords);
+    std::vector<std::pair<double, unsigned int>> buckets;
+    for (unsigned int b = 0; b <= getNumBits(); ++b) {
+      if (dp_starts[b + 1] > dp_starts[b]) {
+        buckets.emplace_back(std::max(a, b) ? double(std::min(a, b)) / std::max(a, b) : 0.0, b);
+      }
+    }
+    std::stable_sort(buckets.begin(), buckets.end(),
+                     [](const auto &x, const auto &y) { return x.first > y.first; });
+    if (k == 0) {
+      return {};
+    }
+    const unsigned int nThreads = threadsFor(dp_header->count, numThreads);
+    std::vector<std::vector<FingerprintHit>> hits(nThreads);
+    runThreads(nThreads, [&](unsigned int t) {
+      // a min-heap of the best k hits of this thread, whose worst bounds the rest.
+      auto &heap = hits[t];
+      auto worse = [](const FingerprintHit &x, const FingerprintHit &y) {
+        return FingerprintIndexDetail::betterHit(x, y);
+      };
+      for (const auto &bucket : buckets) {
+        if (heap.size() == k && bucket.first < heap.front().similarity) {
+          break;
+        }
+        for (size_t row = dp_starts[bucket.second] + t; row < dp_starts[bucket.second + 1];
+             row += nThreads) {
+          FingerprintHit hit{dp_ids[row], similarity(q.data(), a, row)};
+          if (heap.size() < k) {
+            heap.push_back(hit);
+            std::push_heap(heap.begin(), heap.end(), worse);
+          } else if (FingerprintIndexDetail::betterHit(hit, heap.front())) {
+            std::pop_heap(heap.begin(), heap.end(), worse);
+            heap.back() = hit;
+            std::push_heap(heap.begin(), heap.end(), worse);
+          }
+        }
+      }
+    });
+    return merge(hits, k);
+  }
+
+ private:
+  std::vector<uint64_t> toWords(const ExplicitBitVect &query) const {
+    if ((query.getNumBits() + 63) / 64 != dp_header->nWords) {
+      throw std::invalid_argument("Fingerprint size differs from the index.");
+    }
+    std::vector<uint64_t> q(dp_header->nWords);
+    exportFingerprintWords(query, q.data(), dp_header->nWords);
+    return q;
+  }
+
+  double similarity(const uint64_t *q, unsigned int a, size_t row) const {
+    const uint64_t *fp = dp_words + row * dp_header->nWords;
+    return FingerprintBlocksDetail::similarity(
+        q, a, fp, FingerprintBlocksDetail::popcount(fp, dp_header->nWords), dp_header->nWords,
+        false);
+  }
+
+  static unsigned int threadsFor(size_t rows, int numThreads) {
+    // threads are not worth starting for small indexes.
+    const size_t minRowsPerThread = 4096;
+    size_t n = std::min<size_t>(getNumThreadsToUse(numThreads), rows / minRowsPerThread);
+    return static_cast<unsigned int>(std::max<size_t>(n, 1));
+  }
+
+  template <typename F>
+  static void runThreads(unsigned int nThreads, F work) {
+    if (nThreads == 1) {
+      work(0u);
+      return;
+    }
+    std::vector<std::thread> threads;
+    for (unsigned int t = 0; t < nThreads; ++t) {
+      threads.emplace_back(work, t);
+    }
+    for (auto &thread : threads) {
+      thread.join();
+    }
+  }
+
+  static std::vector<FingerprintHit> merge(const std::vector<std::vector<FingerprintHit>> &hits,
+                                           size_t k) {
+    std::vector<FingerprintHit> res;
+    for (const auto &h : hits) {
+      res.insert(res.end(), h.begin(), h.end());
+    }
+    std::sort(res.begin(), res.end(), FingerprintIndexDetail::betterHit);
+    if (res.size() > k) {
+      res.resize(k);
+    }
+    return res;
+  }
+
+  std::shared_ptr<FingerprintIndexDetail::MappedFile> d_file;
+  const FingerprintIndexDetail::Header *dp_header;
+  const uint64_t *dp_starts;
+  const uint32_t *dp_ids;
+  const uint64_t *dp_words;
+  const uint64_t *dp_nameOffsets;
+  const char *dp_names;
+};
+}  // namespace RDKit
+%}
+
+%define RDK_FINGERPRINT_INDEX_EXCEPTION(NAME)
+%exception NAME {
+  try {
+    $action
+  } catch (const std::exception &e) {
+    SWIG_CSharpSetPendingException(SWIG_CSharpApplicationException, e.what());
+    return $null;
+  }
+}
+%enddef
+
+RDK_FINGERPRINT_INDEX_EXCEPTION(RDKit::FingerprintIndexBuilder::add)
+RDK_FINGERPRINT_INDEX_EXCEPTION(RDKit::FingerprintIndexBuilder::addMolecules)
+RDK_FINGERPRINT_INDEX_EXCEPTION(RDKit::FingerprintIndexBuilder::write)
+RDK_FINGERPRINT_INDEX_EXCEPTION(RDKit::FingerprintIndex::FingerprintIndex)
+RDK_FINGERPRINT_INDEX_EXCEPTION(RDKit::FingerprintIndex::getName)
+RDK_FINGERPRINT_INDEX_EXCEPTION(RDKit::FingerprintIndex::makeQueryFingerprint)
+RDK_FINGERPRINT_INDEX_EXCEPTION(RDKit::FingerprintIndex::searchThreshold)
+RDK_FINGERPRINT_INDEX_EXCEPTION(RDKit::FingerprintIndex::searchTopK)
+
+%newobject RDKit::FingerprintIndex::makeQueryFingerprint;
+
+namespace RDKit {
+struct FingerprintHit {
+  unsigned int id;
+  double similarity;
+};
+
+class FingerprintIndexBuilder {
+ public:
+  FingerprintIndexBuilder(unsigned int nBits = 2048);
+  void add(const ExplicitBitVect &fp, const std::string &name = "");
+  unsigned int addMolecules(MolSupplier &suppl, unsigned int radius = 2);
+  unsigned int size() const;
+  void write(const std::string &path) const;
+};
+
+class FingerprintIndex {
+ public:
+  FingerprintIndex(const std::string &path);
+  unsigned int size() const;
+  unsigned int getNumBits() const;
+  int getMorganRadius() const;
+  std::string getName(unsigned int id) const;
+  ExplicitBitVect *makeQueryFingerprint(const ROMol &mol) const;
+  std::vector<FingerprintHit> searchThreshold(const ExplicitBitVect &query, double threshold,
+                                              int numThreads = 1) const;
+  std::vector<FingerprintHit> searchTopK(const ExplicitBitVect &query, unsigned int k,
+                                         int numThreads = 1) const;
+};
+}  // namespace RDKit
+
+%template(FingerprintHit_Vect) std::vector<RDKit::FingerprintHit>;
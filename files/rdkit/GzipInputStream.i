@@ -0,0 +1,258 @@
+/*
+ * Input stream inflating gzip files with zlib, without Boost.Iostreams. Files that are
+ * not gzip compressed are passed through. build_rdkit_csharp.py copies this file next
+ * to GraphMolCSharp.i and includes it from _patch_Streams_i before the supplier
+ * interfaces using it.
+ */
+
+%{
+#include <algorithm>
+#include <condition_variable>
+#include <deque>
+#include <exception>
+#include <fstream>
+#include <istream>
+#include <mutex>
+#include <stdexcept>
+#include <streambuf>
+#include <string>
+#include <thread>
+#include <vector>
+#include <zlib.h>
+
+namespace RDKit {
+namespace GzipStreamDetail {
+// Reads a file in blocks and inflates its gzip members one after another.
+class BlockReader {
+ public:
+  BlockReader(const std::string &path, size_t bufferSize)
+      : d_in(path, std::ios::binary), d_inBuf(bufferSize) {
+    if (!d_in) {
+      throw std::runtime_error("Cannot open " + path);
+    }
+    fill();
+    d_gzip = d_avail >= 2 && static_cast<unsigned char>(d_inBuf[0]) == 0x1f &&
+             static_cast<unsigned char>(d_inBuf[1]) == 0x8b;
+    if (d_gzip) {
+      if (inflateInit2(&d_zs, 15 + 16) != Z_OK) {
+        throw std::runtime_error("Cannot initialize zlib.");
+      }
+      d_zs.next_in = reinterpret_cast<Bytef *>(d_inBuf.data());
+      d_zs.avail_in = static_cast<uInt>(d_avail);
+    }
+  }
+  BlockReader(const BlockReader &) = delete;
+  BlockReader &operator=(const BlockReader &) = delete;
+  ~BlockReader() {
+    if (d_gzip) {
+      inflateEnd(&d_zs);
+    }
+  }
+
+  // Writes up to size bytes to out and returns their number, zero at the end of file.
+  size_t read(char *out, size_t size) {
+    if (!d_gzip) {
+      size_t n = 0;
+      while (n < size && (d_pos < d_avail || fill())) {
+        size_t m = std::min(size - n, d_avail - d_pos);
+        std::copy(d_inBuf.data() + d_pos, d_inBuf.data() + d_pos + m, out + n);
+        d_pos += m;
+        n += m;
+      }
+      return n;
+    }
+    d_zs.next_out = reinterpret_cast<Bytef *>(out);
+    d_zs.avail_out = static_cast<uInt>(size);
+    while (d_zs.avail_out && !d_end) {
+      if (!d_zs.avail_in) {
+        if (!fill()) {
+          throw std::runtime_error("Unexpected end of gzip data.");
+        }
+        d_zs.next_in = reinterpret_cast<Bytef *>(d_inBuf.data());
+        d_zs.avail_in = static_cast<uInt>(d_avail);
+      }
+      int ret = inflate(&d_zs, Z_NO_FLUSH);
+      if (ret == Z_STREAM_END) {
+        // another member may follow, anything else is trailing garbage.
+        if (!d_zs.avail_in && fill()) {
+          d_zs.next_in = reinterpret_cast<Bytef *>(d_inBuf.data());
+          d_zs.avail_in = static_cast<uInt>(d_avail);
+        }
+        if (d_zs.avail_in && *d_zs.next_in == 0x1f) {
+          inflateReset(&d_zs);
+        } else {
+          d_end = true;
+        }
+      } else if (ret != Z_OK && ret != Z_BUF_ERROR) {
+        throw std::runtime_error(d_zs.msg ? d_zs.msg : "Invalid gzip data.");
+      }
+    }
+    return size - d_zs.avail_out;
+  }
+
+ private:
+  bool fill() {
+    d_in.read(d_inBuf.data(), d_inBuf.size());
+    d_avail = static_cast<size_t>(d_in.gcount());
+    d_pos = 0;
+    return d_avail > 0;
+  }
+
+  std::ifstream d_in;
+  std::vector<char> d_inBuf;
+  size_t d_avail = 0;
+  size_t d_pos = 0;
+  bool d_gzip = false;
+  bool d_end = false;
+  z_stream d_zs{};
+};
+
+// Stream buffer over a BlockReader, filled in place or by a background thread which
+// keeps up to QueueBlocks blocks inflated ahead of the reader.
+class GzipStreamBuf : public std::streambuf {
+ public:
+  GzipStreamBuf(const std::string &path, size_t bufferSize, bool backgroundThread)
+      : d_reader(path, bufferSize), d_bufferSize(bufferSize) {
+    if (backgroundThread) {
+      d_thread = std::thread(&GzipStreamBuf::produce, this);
+    } else {
+      d_buf.resize(bufferSize);
+    }
+  }
+  GzipStreamBuf(const GzipStreamBuf &) = delete;
+  GzipStreamBuf &operator=(const GzipStreamBuf &) = delete;
+  ~GzipStreamBuf() override {
+    if (d_thread.joinable()) {
+      {
+        std::lock_guard<std::mutex> lock(d_mutex);
+        d_stop = true;
+      }
+      d_cv.notify_all();
+      d_thread.join();
+    }
+  }
+
+ protected:
+  int_type underflow() override {
+    if (gptr() < egptr()) {
+      return traits_type::to_int_type(*gptr());
+    }
+    size_t n = d_thread.joinable() ? take() : d_reader.read(d_buf.data(), d_buf.size());
+    if (!n) {
+      return traits_type::eof();
+    }
+    setg(d_buf.data(), d_buf.data(), d_buf.data() + n);
+    return traits_type::to_int_type(*gptr());
+  }
+
+ private:
+  static const size_t QueueBlocks = 4;
+
+  size_t take() {
+    std::unique_lock<std::mutex> lock(d_mutex);
+    d_cv.wait(lock, [this] { return !d_full.empty() || d_done; });
+    if (d_full.empty()) {
+      if (d_error) {
+        std::rethrow_exception(d_error);
+      }
+      return 0;
+    }
+    if (d_buf.capacity()) {
+      d_free.push_back(std::move(d_buf));
+    }
+    d_buf = std::move(d_full.front());
+    d_full.pop_front();
+    d_cv.notify_all();
+    return d_buf.size();
+  }
+
+  void produce() {
+    try {
+      for (;;) {
+        std::vector<char> block;
+        {
+          std::unique_lock<std::mutex> lock(d_mutex);
+          d_cv.wait(lock, [this] { return d_full.size() < QueueBlocks || d_stop; });
+          if (d_stop) {
+            return;
+          }
+          if (!d_free.empty()) {
+            block = std::move(d_free.back());
+            d_free.pop_back();
+          }
+        }
+        block.resize(d_bufferSize);
+        block.resize(d_reader.read(block.data(), block.size()));
+        std::lock_guard<std::mutex> lock(d_mutex);
+        if (block.empty()) {
+          d_done = true;
+        } else {
+          d_full.push_back(std::move(block));
+        }
+        d_cv.notify_all();
+        if (d_done) {
+          return;
+        }
+      }
+    } catch (...) {
+      std::lock_guard<std::mutex> lock(d_mutex);
+      d_error = std::current_exception();
+      d_done = true;
+      d_cv.notify_all();
+    }
+  }
+
+  BlockReader d_reader;
+  size_t d_bufferSize;
+  std::vector<char> d_buf;
+  std::thread d_thread;
+  std::mutex d_mutex;
+  std::condition_variable d_cv;
+  std::deque<std::vector<char>> d_full;
+  std::vector<std::vector<char>> d_free;
+  std::exception_ptr d_error;
+  bool d_done = false;
+  bool d_stop = false;
+};
+}  // namespace GzipStreamDetail
+
+class GzipInputStream : public std::istream {
+ public:
+  explicit GzipInputStream(const std::string &path, unsigned int bufferSize = 1 << 20,
+                           bool backgroundThread = false)
+      : std::istream(nullptr), d_buf(path, bufferSize, backgroundThread) {
+    rdbuf(&d_buf);
+  }
+
+ private:
+  GzipStreamDetail::GzipStreamBuf d_buf;
+};
+}  // namespace RDKit
+%}
+
+%define RDK_GZIP_OPEN_EXCEPTION(NAME)
+%exception NAME {
+  try {
+    $action
+  } catch (const std::exception &e) {
+    SWIG_CSharpSetPendingException(SWIG_CSharpApplicationException, e.what());
+    return $null;
+  }
+}
+%enddef
+
+RDK_GZIP_OPEN_EXCEPTION(RDKit::ForwardSDMolSupplier::ForwardSDMolSupplier)
+RDK_GZIP_OPEN_EXCEPTION(RDKit::MultithreadedSDMolSupplier::MultithreadedSDMolSupplier)
+RDK_GZIP_OPEN_EXCEPTION(RDKit::MultithreadedSmilesMolSupplier::MultithreadedSmilesMolSupplier)
+
+%extend RDKit::ForwardSDMolSupplier {
+  // Reads fileName, gzip compressed or not, with bufferSize byte buffers. Inflates on
+  // a separate thread if backgroundThread.
+  ForwardSDMolSupplier(const std::string &fileName, bool sanitize = true, bool removeHs = true,
+                       bool strictParsing = true, unsigned int bufferSize = 1 << 20,
+                       bool backgroundThread = false) {
+    return new RDKit::ForwardSDMolSupplier(
+        new RDKit::GzipInputStream(fileName, bufferSize, backgroundThread), true, sanitize,
+        removeHs, strictParsing);
+  }
+}
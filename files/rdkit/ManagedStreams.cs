@@ -0,0 +1,229 @@
+using System;
+using System.IO;
+using System.Runtime.InteropServices;
+
+namespace GraphMolWrap
+{
+    /// <summary>
+    /// Native streams over .NET <see cref="Stream"/>s, which let suppliers and writers read and
+    /// write HTTP bodies, blob streams and the like without temporary files.
+    /// </summary>
+    /// <remarks>
+    /// Data crosses to the native side in blocks of <c>bufferSize</c> bytes. A native stream
+    /// owns the .NET stream until the supplier or writer owning it is disposed, and disposes
+    /// it then unless <c>leaveOpen</c> is set. Native code cannot see .NET exceptions, so a
+    /// failing .NET stream ends the native stream and leaves the exception in <see cref="LastError"/>.
+    /// </remarks>
+    public static class ManagedStreams
+    {
+        public const int DefaultBufferSize = 1 << 20;
+
+        [ThreadStatic]
+        private static Exception lastError;
+
+        /// <summary>
+        /// Exception thrown by the .NET stream last failing on this thread, or null.
+        /// </summary>
+        public static Exception LastError => lastError;
+
+        private sealed class Adapter
+        {
+            public Stream Stream;
+            public bool LeaveOpen;
+            public byte[] Buffer;
+        }
+
+        private delegate int ReadCallback(IntPtr handle, IntPtr buffer, int size);
+        private delegate int WriteCallback(IntPtr handle, IntPtr buffer, int size);
+        private delegate int FlushCallback(IntPtr handle);
+        private delegate void ReleaseCallback(IntPtr handle);
+
+        // kept in static fields as native code holds pointers to them.
+        private static readonly ReadCallback readCallback = Read;
+        private static readonly WriteCallback writeCallback = Write;
+        private static readonly FlushCallback flushCallback = Flush;
+        private static readonly ReleaseCallback releaseCallback = Release;
+
+        static ManagedStreams()
+        {
+            RDKFuncs.setManagedStreamCallbacks(
+                Marshal.GetFunctionPointerForDelegate(readCallback),
+                Marshal.GetFunctionPointerForDelegate(writeCallback),
+                Marshal.GetFunctionPointerForDelegate(flushCallback),
+                Marshal.GetFunctionPointerForDelegate(releaseCallback));
+        }
+
+        /// <summary>
+        /// Returns a native input stream to pass to constructors taking its ownership.
+        /// </summary>
+        public static SWIGTYPE_p_std__istream OpenInput(Stream stream, bool leaveOpen = false, int bufferSize = DefaultBufferSize)
+        {
+            if (!stream.CanRead)
+                throw new ArgumentException("Stream is not readable.", nameof(stream));
+            var handle = Alloc(stream, leaveOpen);
+            try
+            {
+                return RDKFuncs.openManagedInputStream(handle, checked((uint)bufferSize));
+            }
+            catch
+            {
+                // native streams own the handle only once returned.
+                Release(handle);
+                throw;
+            }
+        }
+
+        /// <summary>
+        /// Returns a native output stream to pass to constructors taking its ownership.
+        /// </summary>
+        public static SWIGTYPE_p_std__ostream OpenOutput(Stream stream, bool leaveOpen = false, int bufferSize = DefaultBufferSize)
+        {
+            if (!stream.CanWrite)
+                throw new ArgumentException("Stream is not writable.", nameof(stream));
+            var handle = Alloc(stream, leaveOpen);
+            try
+            {
+                return RDKFuncs.openManagedOutputStream(handle, checked((uint)bufferSize));
+            }
+            catch
+            {
+                // native streams own the handle only once returned.
+                Release(handle);
+                throw;
+            }
+        }
+
+        /// <summary>
+        /// Returns a supplier of the SD records read from <paramref name="stream"/>.
+        /// </summary>
+        public static ForwardSDMolSupplier CreateSDMolSupplier(Stream stream, bool sanitize = true, bool removeHs = true, bool strictParsing = true, bool leaveOpen = false, int bufferSize = DefaultBufferSize)
+        {
+            if (!stream.CanRead)
+                throw new ArgumentException("Stream is not readable.", nameof(stream));
+            var handle = Alloc(stream, leaveOpen);
+            try
+            {
+                return RDKFuncs.openManagedSDMolSupplier(handle, checked((uint)bufferSize), sanitize, removeHs, strictParsing);
+            }
+            catch
+            {
+                // native streams own the handle only once returned.
+                Release(handle);
+                throw;
+            }
+        }
+
+        /// <summary>
+        /// Returns a writer of SD records to <paramref name="stream"/>, which is flushed by <c>close</c> or <c>flush</c> of the writer.
+        /// </summary>
+        public static SDWriter CreateSDWriter(Stream stream, bool leaveOpen = false, int bufferSize = DefaultBufferSize)
+        {
+            if (!stream.CanWrite)
+                throw new ArgumentException("Stream is not writable.", nameof(stream));
+            var handle = Alloc(stream, leaveOpen);
+            try
+            {
+                return RDKFuncs.openManagedSDWriter(handle, checked((uint)bufferSize));
+            }
+            catch
+            {
+                // native streams own the handle only once returned.
+                Release(handle);
+                throw;
+            }
+        }
+
+        private static IntPtr Alloc(Stream stream, bool leaveOpen)
+        {
+            var adapter = new Adapter { Stream = stream ?? throw new ArgumentNullException(nameof(stream)), LeaveOpen = leaveOpen };
+            return GCHandle.ToIntPtr(GCHandle.Alloc(adapter));
+        }
+
+        private static Adapter GetAdapter(IntPtr handle)
+        {
+            return (Adapter)GCHandle.FromIntPtr(handle).Target;
+        }
+
+        private static unsafe int Read(IntPtr handle, IntPtr buffer, int size)
+        {
+            var adapter = GetAdapter(handle);
+            try
+            {
+                // fills the whole block unless the stream ends, as network streams return less.
+                int total = 0;
+                while (total < size)
+                {
+#if NETCOREAPP3_1
+                    int n = adapter.Stream.Read(new Span<byte>((byte*)buffer + total, size - total));
+#else
+                    if (adapter.Buffer == null || adapter.Buffer.Length < size)
+                        adapter.Buffer = new byte[size];
+                    int n = adapter.Stream.Read(adapter.Buffer, 0, size - total);
+                    Marshal.Copy(adapter.Buffer, 0, buffer + total, n);
+#endif
+                    if (n == 0)
+                        break;
+                    total += n;
+                }
+                return total;
+            }
+            catch (Exception e)
+            {
+                lastError = e;
+                return -1;
+            }
+        }
+
+        private static unsafe int Write(IntPtr handle, IntPtr buffer, int size)
+        {
+            var adapter = GetAdapter(handle);
+            try
+            {
+#if NETCOREAPP3_1
+                adapter.Stream.Write(new ReadOnlySpan<byte>((byte*)buffer, size));
+#else
+                if (adapter.Buffer == null || adapter.Buffer.Length < size)
+                    adapter.Buffer = new byte[size];
+                Marshal.Copy(buffer, adapter.Buffer, 0, size);
+                adapter.Stream.Write(adapter.Buffer, 0, size);
+#endif
+                return 0;
+            }
+            catch (Exception e)
+            {
+                lastError = e;
+                return -1;
+            }
+        }
+
+        private static int Flush(IntPtr handle)
+        {
+            try
+            {
+                GetAdapter(handle).Stream.Flush();
+                return 0;
+            }
+            catch (Exception e)
+            {
+                lastError = e;
+                return -1;
+            }
+        }
+
+        private static void Release(IntPtr handle)
+        {
+            var gcHandle = GCHandle.FromIntPtr(handle);
+            var adapter = (Adapter)gcHandle.Target;
+            gcHandle.Free();
+            try
+            {
+                if (!adapter.LeaveOpen)
+                    adapter.Stream.Dispose();
+            }
+            catch (Exception e)
+            {
+                lastError = e;
+            }
+        }
+    }
+}
@@ -0,0 +1,214 @@
+/*
+ * std::istream and std::ostream over .NET streams, which pass data through callbacks in
+ * blocks. build_rdkit_csharp.py copies this file next to GraphMolCSharp.i and includes
+ * it from _patch_Streams_i. ManagedStreams.cs registers the callbacks and hands out
+ * GCHandles of .NET streams as handles. RDK_BLOCK_POINTER is of FingerprintBlocks.i.
+ */
+
+%{
+#include <istream>
+#include <memory>
+#include <ostream>
+#include <stdexcept>
+#include <streambuf>
+#include <vector>
+#include <GraphMol/FileParsers/MolSupplier.h>
+#include <GraphMol/FileParsers/MolWriters.h>
+
+namespace RDKit {
+namespace ManagedStreamDetail {
+// Reads up to size bytes to buffer and returns their number, 0 at the end or -1 on error.
+typedef int(SWIGSTDCALL *ReadCallback)(void *handle, char *buffer, int size);
+// Writes size bytes of buffer and returns 0, or -1 on error.
+typedef int(SWIGSTDCALL *WriteCallback)(void *handle, const char *buffer, int size);
+typedef int(SWIGSTDCALL *FlushCallback)(void *handle);
+// Frees handle, called once when the native stream is deleted. Functions returning native
+// streams, suppliers and writers leave handle to the caller if they throw.
+typedef void(SWIGSTDCALL *ReleaseCallback)(void *handle);
+
+struct Callbacks {
+  ReadCallback read = nullptr;
+  WriteCallback write = nullptr;
+  FlushCallback flush = nullptr;
+  ReleaseCallback release = nullptr;
+};
+
+inline Callbacks &callbacks() {
+  static Callbacks instance;
+  return instance;
+}
+
+class ManagedStreamBuf : public std::streambuf {
+ public:
+  ManagedStreamBuf(void *handle, unsigned int bufferSize, bool output)
+      : d_handle(handle), d_buf(bufferSize ? bufferSize : 1) {
+    if (!callbacks().release) {
+      throw std::logic_error("Callbacks of .NET streams are not registered.");
+    }
+    if (output) {
+      setp(d_buf.data(), d_buf.data() + d_buf.size());
+    }
+  }
+  ManagedStreamBuf(const ManagedStreamBuf &) = delete;
+  ManagedStreamBuf &operator=(const ManagedStreamBuf &) = delete;
+  ~ManagedStreamBuf() override {
+    if (!d_handle) {
+      return;
+    }
+    if (pbase()) {
+      flushBuffer();
+    }
+    callbacks().release(d_handle);
+  }
+  // Gives up handle without using it again.
+  void detach() {
+    d_handle = nullptr;
+    setp(nullptr, nullptr);
+    setg(nullptr, nullptr, nullptr);
+  }
+
+ protected:
+  int_type underflow() override {
+    if (gptr() < egptr()) {
+      return traits_type::to_int_type(*gptr());
+    }
+    int n = callbacks().read(d_handle, d_buf.data(), static_cast<int>(d_buf.size()));
+    if (n < 0) {
+      throw std::ios_base::failure("Reading the .NET stream failed.");
+    }
+    if (!n) {
+      return traits_type::eof();
+    }
+    setg(d_buf.data(), d_buf.data(), d_buf.data() + n);
+    return traits_type::to_int_type(*gptr());
+  }
+
+  int_type overflow(int_type c) override {
+    if (!pbase() || !flushBuffer()) {
+      return traits_type::eof();
+    }
+    if (!traits_type::eq_int_type(c, traits_type::eof())) {
+      *pptr() = traits_type::to_char_type(c);
+      pbump(1);
+    }
+    return traits_type::not_eof(c);
+  }
+
+  int sync() override {
+    if (!pbase()) {
+      return 0;
+    }
+    return flushBuffer() && callbacks().flush(d_handle) == 0 ? 0 : -1;
+  }
+
+ private:
+  bool flushBuffer() {
+    int n = static_cast<int>(pptr() - pbase());
+    if (n && callbacks().write(d_handle, pbase(), n) != 0) {
+      return false;
+    }
+    setp(d_buf.data(), d_buf.data() + d_buf.size());
+    return true;
+  }
+
+  void *d_handle;
+  std::vector<char> d_buf;
+};
+
+class ManagedInputStream : public std::istream {
+ public:
+  ManagedInputStream(void *handle, unsigned int bufferSize)
+      : std::istream(nullptr), d_buf(handle, bufferSize, false) {
+    rdbuf(&d_buf);
+  }
+
+ private:
+  ManagedStreamBuf d_buf;
+};
+
+class ManagedOutputStream : public std::ostream {
+ public:
+  ManagedOutputStream(void *handle, unsigned int bufferSize)
+      : std::ostream(nullptr), d_buf(handle, bufferSize, true) {
+    rdbuf(&d_buf);
+  }
+
+ private:
+  ManagedStreamBuf d_buf;
+};
+}  // namespace ManagedStreamDetail
+}  // namespace RDKit
+%}
+
+RDK_BLOCK_POINTER(void *, handle)
+RDK_BLOCK_POINTER(void *, readCallback)
+RDK_BLOCK_POINTER(void *, writeCallback)
+RDK_BLOCK_POINTER(void *, flushCallback)
+RDK_BLOCK_POINTER(void *, releaseCallback)
+
+%define RDK_MANAGED_STREAM_EXCEPTION(NAME)
+%exception NAME {
+  try {
+    $action
+  } catch (const std::exception &e) {
+    SWIG_CSharpSetPendingException(SWIG_CSharpApplicationException, e.what());
+    return $null;
+  }
+}
+%enddef
+
+RDK_MANAGED_STREAM_EXCEPTION(RDKit::openManagedInputStream)
+RDK_MANAGED_STREAM_EXCEPTION(RDKit::openManagedOutputStream)
+RDK_MANAGED_STREAM_EXCEPTION(RDKit::openManagedSDMolSupplier)
+RDK_MANAGED_STREAM_EXCEPTION(RDKit::openManagedSDWriter)
+
+%newobject RDKit::openManagedSDMolSupplier;
+%newobject RDKit::openManagedSDWriter;
+
+%inline %{
+namespace RDKit {
+void setManagedStreamCallbacks(void *readCallback, void *writeCallback, void *flushCallback,
+                               void *releaseCallback) {
+  auto &c = ManagedStreamDetail::callbacks();
+  c.read = reinterpret_cast<ManagedStreamDetail::ReadCallback>(readCallback);
+  c.write = reinterpret_cast<ManagedStreamDetail::WriteCallback>(writeCallback);
+  c.flush = reinterpret_cast<ManagedStreamDetail::FlushCallback>(flushCallback);
+  c.release = reinterpret_cast<ManagedStreamDetail::ReleaseCallback>(releaseCallback);
+}
+
+// Returns a stream owning handle, to pass to constructors taking ownership of it.
+std::istream *openManagedInputStream(void *handle, unsigned int bufferSize) {
+  return new ManagedStreamDetail::ManagedInputStream(handle, bufferSize);
+}
+
+std::ostream *openManagedOutputStream(void *handle, unsigned int bufferSize) {
+  return new ManagedStreamDetail::ManagedOutputStream(handle, bufferSize);
+}
+
+ForwardSDMolSupplier *openManagedSDMolSupplier(void *handle, unsigned int bufferSize,
+                                               bool sanitize = true, bool removeHs = true,
+                                               bool strictParsing = true) {
+  std::unique_ptr<std::istream> strm(openManagedInputStream(handle, bufferSize));
+  try {
+    auto res = new ForwardSDMolSupplier(strm.get(), true, sanitize, removeHs, strictParsing);
+    strm.release();
+    return res;
+  } catch (...) {
+    static_cast<ManagedStreamDetail::ManagedStreamBuf *>(strm->rdbuf())->detach();
+    throw;
+  }
+}
+
+SDWriter *openManagedSDWriter(void *handle, unsigned int bufferSize) {
+  std::unique_ptr<std::ostream> strm(openManagedOutputStream(handle, bufferSize));
+  try {
+    auto res = new SDWriter(strm.get(), true);
+    strm.release();
+    return res;
+  } catch (...) {
+    static_cast<ManagedStreamDetail::ManagedStreamBuf *>(strm->rdbuf())->detach();
+    throw;
+  }
+}
+}  // namespace RDKit
+%}
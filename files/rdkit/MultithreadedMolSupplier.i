@@ -0,0 +1,94 @@
+/*
+ * Multithreaded SD and SMILES suppliers for C#. build_rdkit_csharp.py copies this file
+ * next to GraphMolCSharp.i and includes it from _patch_MolSupplier_i, as MolSupplier.i
+ * is shared with Java.
+ *
+ * The suppliers hand out molecules in the order their parser threads finish them. The
+ * C# enumerator puts them back in the order of the input records. Files are read by
+ * GzipInputStream of GzipInputStream.i, so they may be gzip compressed.
+ */
+
+%{
+#include <GraphMol/FileParsers/MultithreadedSDMolSupplier.h>
+#include <GraphMol/FileParsers/MultithreadedSmilesMolSupplier.h>
+%}
+
+%newobject RDKit::MultithreadedMolSupplier::next;
+%nodefaultctor RDKit::MultithreadedMolSupplier;
+
+%typemap(csinterfaces) RDKit::MultithreadedMolSupplier
+  "global::System.IDisposable, global::System.Collections.Generic.IEnumerable<ROMol>"
+%typemap(cscode) RDKit::MultithreadedMolSupplier %{
+  /// <summary>
+  /// Returns the remaining molecules in the order of the input records, and null for
+  /// records that fail to parse.
+  /// </summary>
+  public global::System.Collections.Generic.IEnumerator<ROMol> GetEnumerator() {
+    var pending = new global::System.Collections.Generic.SortedDictionary<uint, ROMol>();
+    uint last = getLastRecordId();
+    uint expected = last + 1;
+    while (!atEnd()) {
+      ROMol mol = next();
+      uint id = getLastRecordId();
+      // the record id stays the same when the supplier ran out of records while waiting.
+      if (id == last)
+        continue;
+      last = id;
+      if (id != expected) {
+        pending.Add(id, mol);
+        continue;
+      }
+      yield return mol;
+      for (expected++; pending.TryGetValue(expected, out mol); expected++) {
+        pending.Remove(expected);
+        yield return mol;
+      }
+    }
+    foreach (var item in pending)
+      yield return item.Value;
+  }
+
+  global::System.Collections.IEnumerator global::System.Collections.IEnumerable.GetEnumerator() {
+    return GetEnumerator();
+  }
+%}
+
+namespace RDKit {
+class MultithreadedMolSupplier {
+ public:
+  virtual ~MultithreadedMolSupplier();
+  ROMol *next();
+  bool atEnd();
+  unsigned int getLastRecordId() const;
+  std::string getLastItemText() const;
+};
+
+class MultithreadedSDMolSupplier : public MultithreadedMolSupplier {};
+class MultithreadedSmilesMolSupplier : public MultithreadedMolSupplier {};
+}  // namespace RDKit
+
+%extend RDKit::MultithreadedSDMolSupplier {
+  MultithreadedSDMolSupplier(const std::string &fileName, bool sanitize = true,
+                             bool removeHs = true, bool strictParsing = true,
+                             unsigned int numWriterThreads = 1, size_t sizeInputQueue = 5,
+                             size_t sizeOutputQueue = 5, unsigned int bufferSize = 1 << 20,
+                             bool backgroundThread = false) {
+    return new RDKit::MultithreadedSDMolSupplier(
+        new RDKit::GzipInputStream(fileName, bufferSize, backgroundThread), true, sanitize,
+        removeHs, strictParsing, numWriterThreads, sizeInputQueue, sizeOutputQueue);
+  }
+}
+
+%extend RDKit::MultithreadedSmilesMolSupplier {
+  MultithreadedSmilesMolSupplier(const std::string &fileName,
+                                 const std::string &delimiter = " \t", int smilesColumn = 0,
+                                 int nameColumn = 1, bool titleLine = true, bool sanitize = true,
+                                 unsigned int numWriterThreads = 1, size_t sizeInputQueue = 5,
+                                 size_t sizeOutputQueue = 5, unsigned int bufferSize = 1 << 20,
+                                 bool backgroundThread = false) {
+    return new RDKit::MultithreadedSmilesMolSupplier(
+        new RDKit::GzipInputStream(fileName, bufferSize, backgroundThread), true, delimiter,
+        smilesColumn, nameColumn, titleLine, sanitize, numWriterThreads, sizeInputQueue,
+        sizeOutputQueue);
+  }
+}
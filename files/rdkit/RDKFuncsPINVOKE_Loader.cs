@@ -1,7 +1,11 @@
 ﻿using System;
+using System.Collections.Generic;
 using System.IO;
 using System.Reflection;
 using System.Runtime.InteropServices;
+#if NETCOREAPP3_1
+using System.Runtime.Intrinsics.X86;
+#endif
 
 namespace GraphMolWrap
 {
@@ -42,26 +46,47 @@ namespace GraphMolWrap
                 }
                 string cpu = Environment.Is64BitProcess ? "x64" : "x86";
 
-                string filename = $"{DllBaseName}{suffix}";
-                {
-                    string pathToDll = Path.Combine(Path.GetDirectoryName(assembly.Location), "runtimes", $"{osname}-{cpu}", "native", filename);
-                    if (File.Exists(pathToDll))
-                        return NativeLibrary.Load(pathToDll, assembly, searchPath);
-                }
+                foreach (var filename in GetDllFileNames(osname, cpu, suffix))
                 {
-                    // ASP.NET
-                    var uri = new Uri(assembly.CodeBase);
-                    if (uri.Scheme == "file")
                     {
-                        string pathToDll = Path.Combine(Path.GetDirectoryName(uri.AbsolutePath), "runtimes", $"{osname}-{cpu}", "native", filename);
+                        string pathToDll = Path.Combine(Path.GetDirectoryName(assembly.Location), "runtimes", $"{osname}-{cpu}", "native", filename);
                         if (File.Exists(pathToDll))
                             return NativeLibrary.Load(pathToDll, assembly, searchPath);
                     }
+                    {
+                        // ASP.NET
+                        var uri = new Uri(assembly.CodeBase);
+                        if (uri.Scheme == "file")
+                        {
+                            string pathToDll = Path.Combine(Path.GetDirectoryName(uri.AbsolutePath), "runtimes", $"{osname}-{cpu}", "native", filename);
+                            if (File.Exists(pathToDll))
+                                return NativeLibrary.Load(pathToDll, assembly, searchPath);
+                        }
+                    }
                 }
             }
             return IntPtr.Zero;
         }
 
+        /// <summary>
+        /// Returns file names of the native library from the most optimized variant the CPU supports to the baseline.
+        /// </summary>
+        /// <param name="osname">"win" or "linux"</param>
+        /// <param name="cpu">"x86" or "x64"</param>
+        /// <param name="suffix">suffix of the library</param>
+        /// <returns>File names such as RDKFuncs.x86-64-v3.so, RDKFuncs.x86-64-v2.so and RDKFuncs.so.</returns>
+        private static IEnumerable<string> GetDllFileNames(string osname, string cpu, string suffix)
+        {
+            if (osname == "linux" && cpu == "x64")
+            {
+                if (Avx2.IsSupported && Bmi1.IsSupported && Bmi2.IsSupported && Fma.IsSupported && Lzcnt.IsSupported)
+                    yield return $"{DllBaseName}.x86-64-v3{suffix}";
+                if (Sse42.IsSupported && Ssse3.IsSupported && Popcnt.IsSupported)
+                    yield return $"{DllBaseName}.x86-64-v2{suffix}";
+            }
+            yield return $"{DllBaseName}{suffix}";
+        }
+
         internal static void LoadDll()
         {
             if (!loaded)
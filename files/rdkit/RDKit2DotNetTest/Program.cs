@@ -1,4 +1,5 @@
 ﻿using System;
+using System.Collections.Generic;
 using System.Text;
 using GraphMolWrap;
 using System.IO;
@@ -140,8 +141,55 @@ namespace RDKitCSharpTest
             MakePicture("Clc1cccc(N2CCN(CCC3CCC(CC3)NC(=O)c3cccs3)CC2)c1Cl", "mol.svg");
         }
 
+        /// <summary>
+        /// Workload to train RDKFuncs built with profile-guided optimization.
+        /// </summary>
+        /// <param name="path">SD file to parse, fingerprint and search</param>
+        static void Train(string path)
+        {
+            var queries = new List<ROMol>();
+            foreach (var smarts in new[] { "c1ccccc1", "[#7;R]", "C(=O)N", "[CX4][NX3]" })
+                queries.Add(RWMol.MolFromSmarts(smarts));
+
+            var mols = new List<ROMol>();
+            using (var suppl = new SDMolSupplier(path))
+            {
+                while (!suppl.atEnd())
+                {
+                    var mol = suppl.next();
+                    if (mol != null)
+                        mols.Add(mol);
+                }
+            }
+
+            var fps = new List<ExplicitBitVect>();
+            int matches = 0;
+            foreach (var mol in mols)
+            {
+                var roundTripped = RWMol.MolFromSmiles(mol.MolToSmiles());
+                fps.Add(RDKFuncs.RDKFingerprintMol(roundTripped));
+                RDKFuncs.MACCSFingerprintMol(roundTripped).Dispose();
+                foreach (var query in queries)
+                {
+                    if (mol.hasSubstructMatch(query))
+                        matches++;
+                }
+            }
+
+            double total = 0;
+            for (int i = 0; i < fps.Count; i++)
+                for (int j = i + 1; j < fps.Count; j++)
+                    total += RDKFuncs.TanimotoSimilarityEBV(fps[i], fps[j]);
+            Console.WriteLine($"Trained with {mols.Count} molecules: {matches} matches, similarity sum {total:F3}.");
+        }
+
         static void Main(string[] args)
         {
+            if (args.Length == 2 && args[0] == "--train")
+            {
+                Train(args[1]);
+                return;
+            }
             ErrorHandle();
             Demo();
             CreateSomeObjects();
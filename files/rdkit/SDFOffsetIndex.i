@@ -0,0 +1,279 @@
+/*
+ * Byte offsets of the records of an SD file, saved next to it and reused while newer than
+ * the file, and suppliers over any range of the records. build_rdkit_csharp.py copies
+ * this file next to GraphMolCSharp.i and includes it from _patch_MolSupplier_i.
+ *
+ * File layout, all integers in native byte order:
+ *   header   SDFOffsetIndexDetail::Header
+ *   offsets  uint64[count + 1], start of each record and end of the last one
+ */
+
+%{
+#include <algorithm>
+#include <cctype>
+#include <cstdint>
+#include <cstdio>
+#include <cstring>
+#include <fstream>
+#include <istream>
+#include <stdexcept>
+#include <streambuf>
+#include <string>
+#include <vector>
+#include <sys/stat.h>
+#include <GraphMol/FileParsers/MolSupplier.h>
+
+namespace RDKit {
+namespace SDFOffsetIndexDetail {
+const char Magic[8] = {'R', 'D', 'K', 'S', 'D', 'I', 'X', '\0'};
+const uint32_t Version = 1;
+const size_t BufferSize = 1 << 20;
+
+struct Header {
+  char magic[8];
+  uint32_t version;
+  uint32_t reserved;
+  uint64_t sdfSize;
+  uint64_t count;
+};
+
+// Gets size and modification time in nanoseconds of path.
+inline bool statFile(const std::string &path, uint64_t &size, int64_t &mtime) {
+#ifdef _WIN32
+  struct _stat64 st;
+  if (_stat64(path.c_str(), &st)) {
+    return false;
+  }
+#else
+  struct stat st;
+  if (stat(path.c_str(), &st)) {
+    return false;
+  }
+#endif
+  size = static_cast<uint64_t>(st.st_size);
+#ifdef _WIN32
+  mtime = static_cast<int64_t>(st.st_mtime) * 1000000000;
+#else
+  mtime = static_cast<int64_t>(st.st_mtim.tv_sec) * 1000000000 + st.st_mtim.tv_nsec;
+#endif
+  return true;
+}
+
+// Returns offsets of records, which end with $$$$ lines, and the end of the last one.
+inline std::vector<uint64_t> scanRecords(const std::string &path) {
+  std::ifstream in(path, std::ios::binary);
+  if (!in) {
+    throw std::runtime_error("Cannot open " + path);
+  }
+  std::vector<char> buf(BufferSize);
+  std::vector<uint64_t> offsets{0};
+  uint64_t pos = 0;
+  std::string head;
+  bool content = false;
+  while (in.read(buf.data(), buf.size()) || in.gcount()) {
+    const size_t n = static_cast<size_t>(in.gcount());
+    if (!pos && n >= 2 && static_cast<unsigned char>(buf[0]) == 0x1f &&
+        static_cast<unsigned char>(buf[1]) == 0x8b) {
+      throw std::invalid_argument("Cannot index compressed " + path);
+    }
+    const char *p = buf.data();
+    const char *end = p + n;
+    while (p < end) {
+      auto nl = static_cast<const char *>(std::memchr(p, '\n', end - p));
+      const char *lineEnd = nl ? nl : end;
+      if (head.size() < 4) {
+        head.append(p, std::min<size_t>(4 - head.size(), lineEnd - p));
+      }
+      content = content || std::any_of(p, lineEnd, [](char c) {
+        return !std::isspace(static_cast<unsigned char>(c));
+      });
+      if (!nl) {
+        break;
+      }
+      if (head == "$$$$") {
+        offsets.push_back(pos + (nl + 1 - buf.data()));
+        content = false;
+      }
+      head.clear();
+      p = nl + 1;
+    }
+    pos += n;
+  }
+  // the last record may miss its $$$$ line or its line break.
+  if (content) {
+    offsets.push_back(pos);
+  }
+  return offsets;
+}
+
+// Stream buffer over bytes [begin, end) of a file.
+class RangeStreamBuf : public std::streambuf {
+ public:
+  RangeStreamBuf(const std::string &path, uint64_t begin, uint64_t end)
+      : d_in(path, std::ios::binary), d_left(end - begin), d_buf(BufferSize) {
+    if (!d_in) {
+      throw std::runtime_error("Cannot open " + path);
+    }
+    d_in.seekg(static_cast<std::streamoff>(begin));
+  }
+
+ protected:
+  int_type underflow() override {
+    if (gptr() < egptr()) {
+      return traits_type::to_int_type(*gptr());
+    }
+    size_t n = static_cast<size_t>(std::min<uint64_t>(d_left, d_buf.size()));
+    d_in.read(d_buf.data(), n);
+    n = static_cast<size_t>(d_in.gcount());
+    if (!n) {
+      return traits_type::eof();
+    }
+    d_left -= n;
+    setg(d_buf.data(), d_buf.data(), d_buf.data() + n);
+    return traits_type::to_int_type(*gptr());
+  }
+
+ private:
+  std::ifstream d_in;
+  uint64_t d_left;
+  std::vector<char> d_buf;
+};
+
+class RangeInputStream : public std::istream {
+ public:
+  RangeInputStream(const std::string &path, uint64_t begin, uint64_t end)
+      : std::istream(nullptr), d_buf(path, begin, end) {
+    rdbuf(&d_buf);
+  }
+
+ private:
+  RangeStreamBuf d_buf;
+};
+}  // namespace SDFOffsetIndexDetail
+
+class SDFOffsetIndex {
+ public:
+  // Loads the index of sdfPath from indexPath, sdfPath + ".rdkidx" if empty, when it is
+  // newer than the SD file, or scans the file and saves the index there.
+  explicit SDFOffsetIndex(const std::string &sdfPath, const std::string &indexPath = "")
+      : d_sdfPath(sdfPath), d_indexPath(indexPath.empty() ? sdfPath + ".rdkidx" : indexPath) {
+    uint64_t sdfSize;
+    int64_t sdfTime;
+    if (!SDFOffsetIndexDetail::statFile(d_sdfPath, sdfSize, sdfTime)) {
+      throw std::runtime_error("Cannot open " + d_sdfPath);
+    }
+    if (!load(sdfSize, sdfTime)) {
+      d_offsets = SDFOffsetIndexDetail::scanRecords(d_sdfPath);
+      d_built = true;
+      save(sdfSize);
+    }
+  }
+
+  unsigned int size() const { return static_cast<unsigned int>(d_offsets.size() - 1); }
+  // Returns whether the index is built by scanning rather than loaded.
+  bool wasBuilt() const { return d_built; }
+  const std::string &getIndexPath() const { return d_indexPath; }
+
+  // Returns the byte offset of record, or the end of the last record for size().
+  uint64_t getOffset(unsigned int record) const {
+    if (record > size()) {
+      throw std::out_of_range("Record number out of range.");
+    }
+    return d_offsets[record];
+  }
+
+  // Returns a supplier of records [begin, end) owning its stream.
+  ForwardSDMolSupplier *openSupplier(unsigned int begin, unsigned int end, bool sanitize = true,
+                                     bool removeHs = true, bool strictParsing = true) const {
+    if (begin > end || end > size()) {
+      throw std::out_of_range("Record range out of range.");
+    }
+    return new ForwardSDMolSupplier(
+        new SDFOffsetIndexDetail::RangeInputStream(d_sdfPath, d_offsets[begin], d_offsets[end]),
+        true, sanitize, removeHs, strictParsing);
+  }
+
+ private:
+  bool load(uint64_t sdfSize, int64_t sdfTime) {
+    using namespace SDFOffsetIndexDetail;
+    uint64_t indexSize;
+    int64_t indexTime;
+    // an index as old as the file may predate a rewrite within the resolution of mtime,
+    // which is a second on Windows.
+    if (!statFile(d_indexPath, indexSize, indexTime) || indexTime <= sdfTime) {
+      return false;
+    }
+    std::ifstream in(d_indexPath, std::ios::binary);
+    Header header;
+    if (!in.read(reinterpret_cast<char *>(&header), sizeof(header)) ||
+        !std::equal(Magic, Magic + 8, header.magic) || header.version != Version ||
+        header.sdfSize != sdfSize ||
+        indexSize != sizeof(header) + (header.count + 1) * sizeof(uint64_t)) {
+      return false;
+    }
+    d_offsets.resize(header.count + 1);
+    return static_cast<bool>(
+        in.read(reinterpret_cast<char *>(d_offsets.data()), d_offsets.size() * sizeof(uint64_t)));
+  }
+
+  // Saves the index if possible; a read-only directory only costs a scan next time.
+  void save(uint64_t sdfSize) const {
+    using namespace SDFOffsetIndexDetail;
+    Header header{};
+    std::copy(Magic, Magic + 8, header.magic);
+    header.version = Version;
+    header.sdfSize = sdfSize;
+    header.count = size();
+    const std::string tmpPath = d_indexPath + ".tmp";
+    {
+      std::ofstream out(tmpPath, std::ios::binary | std::ios::trunc);
+      out.write(reinterpret_cast<const char *>(&header), sizeof(header));
+      out.write(reinterpret_cast<const char *>(d_offsets.data()),
+                d_offsets.size() * sizeof(uint64_t));
+      if (!out) {
+        out.close();
+        std::remove(tmpPath.c_str());
+        return;
+      }
+    }
+    std::remove(d_indexPath.c_str());
+    std::rename(tmpPath.c_str(), d_indexPath.c_str());
+  }
+
+  std::string d_sdfPath;
+  std::string d_indexPath;
+  std::vector<uint64_t> d_offsets;
+  bool d_built = false;
+};
+}  // namespace RDKit
+%}
+
+%define RDK_SDF_OFFSET_INDEX_EXCEPTION(NAME)
+%exception NAME {
+  try {
+    $action
+  } catch (const std::exception &e) {
+    SWIG_CSharpSetPendingException(SWIG_CSharpApplicationException, e.what());
+    return $null;
+  }
+}
+%enddef
+
+RDK_SDF_OFFSET_INDEX_EXCEPTION(RDKit::SDFOffsetIndex::SDFOffsetIndex)
+RDK_SDF_OFFSET_INDEX_EXCEPTION(RDKit::SDFOffsetIndex::getOffset)
+RDK_SDF_OFFSET_INDEX_EXCEPTION(RDKit::SDFOffsetIndex::openSupplier)
+
+%newobject RDKit::SDFOffsetIndex::openSupplier;
+
+namespace RDKit {
+class SDFOffsetIndex {
+ public:
+  SDFOffsetIndex(const std::string &sdfPath, const std::string &indexPath = "");
+  unsigned int size() const;
+  bool wasBuilt() const;
+  const std::string &getIndexPath() const;
+  unsigned long long getOffset(unsigned int record) const;
+  ForwardSDMolSupplier *openSupplier(unsigned int begin, unsigned int end, bool sanitize = true,
+                                     bool removeHs = true, bool strictParsing = true) const;
+};
+}  // namespace RDKit
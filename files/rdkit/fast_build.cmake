@@ -0,0 +1,59 @@
+# Included after project(RDKit) by build_rdkit_csharp.py --fast_build.
+# Turns on unity builds and precompiled headers for the libraries under Code.
+# Targets listed in fast_build_excluded.txt of the build tree are built as usual.
+
+if(CMAKE_VERSION VERSION_LESS 3.19)
+  message(WARNING "--fast_build needs CMake 3.19 or later and is ignored.")
+  return()
+endif()
+
+set(RDK_FAST_BUILD_EXCLUDED_FILE "${CMAKE_BINARY_DIR}/fast_build_excluded.txt")
+if(NOT EXISTS "${RDK_FAST_BUILD_EXCLUDED_FILE}")
+  file(WRITE "${RDK_FAST_BUILD_EXCLUDED_FILE}" "")
+endif()
+# excluding a target reconfigures the build tree.
+set_property(DIRECTORY APPEND PROPERTY CMAKE_CONFIGURE_DEPENDS "${RDK_FAST_BUILD_EXCLUDED_FILE}")
+
+set(RDK_FAST_BUILD_BASE_HEADERS
+  <map>
+  <memory>
+  <string>
+  <vector>
+  <RDGeneral/export.h>
+  <RDGeneral/Invariant.h>
+  <RDGeneral/types.h>
+)
+set(RDK_FAST_BUILD_GRAPHMOL_HEADERS
+  <GraphMol/RDKitBase.h>
+)
+
+function(_rdk_fast_build_get_targets dir out)
+  get_property(_targets DIRECTORY "${dir}" PROPERTY BUILDSYSTEM_TARGETS)
+  get_property(_subdirs DIRECTORY "${dir}" PROPERTY SUBDIRECTORIES)
+  foreach(_subdir IN LISTS _subdirs)
+    _rdk_fast_build_get_targets("${_subdir}" _sub_targets)
+    list(APPEND _targets ${_sub_targets})
+  endforeach()
+  set(${out} ${_targets} PARENT_SCOPE)
+endfunction()
+
+function(_rdk_fast_build_apply)
+  file(STRINGS "${RDK_FAST_BUILD_EXCLUDED_FILE}" _excluded)
+  _rdk_fast_build_get_targets("${CMAKE_SOURCE_DIR}/Code" _targets)
+  foreach(_target IN LISTS _targets)
+    get_target_property(_type ${_target} TYPE)
+    if(NOT _type MATCHES "^(STATIC|SHARED|OBJECT)_LIBRARY$" OR _target IN_LIST _excluded)
+      continue()
+    endif()
+    set_target_properties(${_target} PROPERTIES UNITY_BUILD ON)
+    target_precompile_headers(${_target} PRIVATE ${RDK_FAST_BUILD_BASE_HEADERS})
+    get_target_property(_libs ${_target} LINK_LIBRARIES)
+    if(_target MATCHES "^GraphMol(_static)?$" OR "GraphMol" IN_LIST _libs
+       OR "GraphMol_static" IN_LIST _libs)
+      target_precompile_headers(${_target} PRIVATE ${RDK_FAST_BUILD_GRAPHMOL_HEADERS})
+    endif()
+  endforeach()
+endfunction()
+
+# runs after all targets of RDKit are defined.
+cmake_language(DEFER DIRECTORY "${CMAKE_SOURCE_DIR}" CALL _rdk_fast_build_apply)